@@ -2,6 +2,15 @@
 from .vnalibrary    import *
 from .vnaclass      import *
 from .vnaexceptions import *
+from . import fleet
+from . import calfile
+from . import archive
+
+# The asyncio front-end needs Python 3.7+.
+try:
+	from .vnaasync import AsyncVNA
+except (ImportError, SyntaxError):
+	pass
 
 
 ##
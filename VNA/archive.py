@@ -0,0 +1,737 @@
+################################################################################
+#### archive.py		--	Recording of raw sweeps to memory-mapped files		####
+####																		####
+####	Sweeps are appended to preallocated segment files, one sweep		####
+####	configuration per segment, with a bounded number of segments		####
+####	kept on disk, and read back (or replayed) through an indexed,		####
+####	zero-copy reader.													####
+####																		####
+################################################################################
+import collections
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+
+import numpy as np
+
+##
+#  \addtogroup Python-Sweep-Archive
+#
+#  \section archive-brief Sweep archives
+#
+#  A \ref SweepRecorder appends raw complex sweeps to segment files in a
+#  directory. Each segment is preallocated for a fixed number of sweeps of a
+#  single sweep configuration (same paths and frequency points), and is written
+#  through a memory map, so appending a sweep is a copy into the map and nothing
+#  else. Once a segment fills up, a new one is started, and the oldest segments
+#  are deleted so no more than `max_segments` are kept.
+#
+#  A \ref SweepArchive reads the segments back, selecting sweeps by time, unit,
+#  configuration and frequency range without copying them out of the maps, and
+#  a \ref SweepReplay plays them back at their original (or a scaled) rate.
+#
+#  Layout of a segment file (all integers little-endian):
+#
+#     Offset             |  Contents                                            |
+#    --------------------|------------------------------------------------------|
+#    0                   | Magic, \ref SEGMENT_MAGIC (8 bytes)                  |
+#    8                   | Format version (uint32)                              |
+#    12                  | Header length `H` in bytes (uint32)                  |
+#    16                  | Number of sweeps written so far (uint64)             |
+#    24                  | UTF-8 JSON header, space padded to `H` bytes         |
+#    `freqs_offset`      | `N` float64 frequencies, in MHz                      |
+#    `timestamps_offset` | `C` float64 `time.time()` timestamps                 |
+#    `serials_offset`    | `C` int64 unit serial numbers                        |
+#    `configs_offset`    | `C` int64 sweep configuration ids                    |
+#    `data_offset`       | `(C, P, N)` complex128 sweep data                    |
+#
+#  `C` is the segment `capacity`, `P` the number of `paths` and `N` the number of
+#  `points`, all recorded in the header along with the `config` id and the
+#  segment `sequence` number. Every block is 64-byte aligned. The sweep count is
+#  only updated once a sweep has been completely written.
+#
+#  @{
+#
+
+## First 8 bytes of every segment file.
+SEGMENT_MAGIC = b"OVNAREC\x00"
+
+## Current version of the segment layout. Readers reject versions they don't know.
+SEGMENT_VERSION = 1
+
+## Extension of segment files.
+SEGMENT_EXTENSION = ".vnarec"
+
+## Default number of sweeps per segment.
+SEGMENT_CAPACITY = 4096
+
+## Default number of segments a \ref SweepRecorder keeps on disk.
+MAX_SEGMENTS = 64
+
+_PREFIX = struct.Struct("<8sIIQ")
+_COUNT_OFFSET = 16
+_ALIGN  = 64
+
+# Header keys of the data blocks, in file order.
+_BLOCKS = ("freqs_offset", "timestamps_offset", "serials_offset", "configs_offset", "data_offset")
+
+
+def _align(offset):
+	return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+def segment_name(prefix, sequence):
+	''' File name of segment number `sequence` of the recording named `prefix`.
+	'''
+	return "%s-%08d%s" % (prefix, sequence, SEGMENT_EXTENSION)
+
+def list_segments(dirpath, prefix=None):
+	''' Segment files in `dirpath` (optionally only those of the recording named
+		`prefix`), as a list of `(sequence, prefix, path)` tuples, oldest first.
+	'''
+	pattern = re.compile(r"^(.+)-(\d{8})%s$" % re.escape(SEGMENT_EXTENSION))
+	ret = []
+	for fname in os.listdir(dirpath):
+		match = pattern.match(fname)
+		if match and (prefix is None or match.group(1) == prefix):
+			ret.append((int(match.group(2)), match.group(1), os.path.join(dirpath, fname)))
+	ret.sort()
+	return ret
+
+def config_id(freqs, paths):
+	''' Stable id of a sweep configuration, from its frequency points and path names.
+
+		The same configuration gets the same id in every session, so ids can be
+		compared across recordings.
+
+		Returns:
+			Non-negative int that fits in an int64.
+	'''
+	freqs = np.ascontiguousarray(freqs, dtype='<f8')
+	digest = hashlib.sha1(freqs.tobytes())
+	digest.update(",".join(paths).encode("utf-8"))
+	return int(digest.hexdigest()[:15], 16)
+
+
+def _layout(freqs, paths, capacity, config, sequence):
+	npts = freqs.shape[0]
+	header = {
+		"paths"             : list(paths),
+		"points"            : npts,
+		"capacity"          : capacity,
+		"config"            : config,
+		"sequence"          : sequence,
+		"created"           : time.time(),
+		"freqs_offset"      : 10 ** 15,
+		"timestamps_offset" : 10 ** 15,
+		"serials_offset"    : 10 ** 15,
+		"configs_offset"    : 10 ** 15,
+		"data_offset"       : 10 ** 15,
+	}
+	# Size the header with wide placeholder offsets, as the offsets depend on its length.
+	header_len = _align(_PREFIX.size + len(json.dumps(header).encode("utf-8"))) - _PREFIX.size
+
+	offset = _PREFIX.size + header_len
+	for key, nbytes in [("freqs_offset", 8 * npts), ("timestamps_offset", 8 * capacity),
+			("serials_offset", 8 * capacity), ("configs_offset", 8 * capacity), ("data_offset", 0)]:
+		header[key] = offset
+		offset = _align(offset + nbytes)
+
+	size = header["data_offset"] + capacity * len(paths) * npts * 16
+	return header, header_len, size
+
+
+def _check_header(path, header, data_start):
+	# Every key the reader relies on must be present and consistent, so a truncated
+	# or partial header is reported as a bad segment rather than a KeyError or TypeError.
+	if not isinstance(header, dict):
+		raise ValueError("'%s' has a corrupt header!" % path)
+	paths = header.get("paths")
+	if not isinstance(paths, list) or not paths or not all(isinstance(name, str) for name in paths):
+		raise ValueError("'%s' has a missing or invalid 'paths' in its header!" % path)
+	for key in ("points", "capacity", "config", "sequence") + _BLOCKS:
+		value = header.get(key)
+		if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+			raise ValueError("'%s' has a missing or invalid '%s' in its header!" % (path, key))
+
+	npts, capacity = header["points"], header["capacity"]
+	offset = data_start
+	for key, nbytes in zip(_BLOCKS, (8 * npts, 8 * capacity, 8 * capacity, 8 * capacity, 0)):
+		if header[key] < offset:
+			raise ValueError("'%s' has overlapping data blocks!" % path)
+		offset = header[key] + nbytes
+
+
+class Segment(object):
+	''' One memory-mapped segment file.
+
+		Members:
+			path		- Filesystem path of the segment.
+			header		- Header dict.
+			freqs		- `(N, )` float64 frequencies.
+			timestamps	- `(C, )` float64 timestamps.
+			serials		- `(C, )` int64 unit serial numbers.
+			configs		- `(C, )` int64 sweep configuration ids.
+			data		- `(C, P, N)` complex128 sweep data.
+
+		Only the first \ref count() entries of the per-sweep arrays are valid.
+	'''
+
+	def __init__(self, path, writable=False):
+		r''' Map an existing segment file.
+
+			Args:
+				path		-- (string) Segment to open.
+				writable	-- (bool) Map it read-write (for appending), rather than read-only.
+
+			---
+
+			\exceptions ValueError if the file is not a segment, is of an unsupported version, has a malformed header, or is truncated.
+		'''
+		self.path = path
+		with open(path, "rb") as fp:
+			prefix = fp.read(_PREFIX.size)
+			if len(prefix) != _PREFIX.size:
+				raise ValueError("'%s' is not a sweep segment!" % path)
+			magic, version, header_len, dummy_count = _PREFIX.unpack(prefix)
+			if magic != SEGMENT_MAGIC:
+				raise ValueError("'%s' is not a sweep segment!" % path)
+			if version != SEGMENT_VERSION:
+				raise ValueError("Sweep segment version %s is not supported!" % version)
+			self.header = json.loads(fp.read(header_len).decode("utf-8"))
+			size = os.fstat(fp.fileno()).st_size
+		_check_header(path, self.header, _PREFIX.size + header_len)
+
+		header   = self.header
+		capacity = header["capacity"]
+		npts     = header["points"]
+		if size < header["data_offset"] + capacity * len(header["paths"]) * npts * 16:
+			raise ValueError("'%s' is truncated!" % path)
+
+		self.__mmap = np.memmap(path, dtype=np.uint8, mode="r+" if writable else "r")
+		self.__count = self.__mmap[_COUNT_OFFSET:_COUNT_OFFSET + 8].view('<u8')
+
+		self.freqs      = self.__block("freqs_offset", '<f8', (npts, ))
+		self.timestamps = self.__block("timestamps_offset", '<f8', (capacity, ))
+		self.serials    = self.__block("serials_offset", '<i8', (capacity, ))
+		self.configs    = self.__block("configs_offset", '<i8', (capacity, ))
+		self.data       = self.__block("data_offset", '<c16', (capacity, len(header["paths"]), npts))
+
+	def __block(self, key, dtype, shape):
+		start = self.header[key]
+		nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+		return self.__mmap[start:start + nbytes].view(dtype).reshape(shape)
+
+	@classmethod
+	def create(cls, path, freqs, paths, capacity, config, sequence=0):
+		''' Create and preallocate a new (empty) segment file, and map it for writing.
+
+			Args:
+				path		-- (string) Segment file to create. It must not exist.
+				freqs		-- `N` frequency points, in MHz.
+				paths		-- Names of the `P` paths in each sweep.
+				capacity	-- (int) Number of sweeps the segment holds.
+				config		-- (int) Sweep configuration id, from \ref config_id().
+				sequence	-- (int) Sequence number of the segment.
+		'''
+		freqs = np.ascontiguousarray(freqs, dtype='<f8')
+		header, header_len, size = _layout(freqs, paths, capacity, config, sequence)
+		blob = json.dumps(header).encode("utf-8")
+
+		fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0))
+		with os.fdopen(fd, "wb") as fp:
+			fp.write(_PREFIX.pack(SEGMENT_MAGIC, SEGMENT_VERSION, header_len, 0))
+			fp.write(blob + b" " * (header_len - len(blob)))
+			fp.seek(header["freqs_offset"])
+			fp.write(freqs.tobytes())
+			fp.truncate(size)
+			fp.flush()
+			# Reserve the space up front where the platform allows it, so a full
+			# disk shows up here rather than as a fault in the middle of a write.
+			if hasattr(os, "posix_fallocate"):
+				try:
+					os.posix_fallocate(fp.fileno(), 0, size)
+				except OSError:
+					pass
+		return cls(path, writable=True)
+
+	def count(self):
+		''' Number of sweeps written to the segment.
+		'''
+		return int(self.__count[0])
+
+	def full(self):
+		return self.count() >= self.header["capacity"]
+
+	def append(self, values, serial_number, config, timestamp):
+		''' Write one sweep into the next free slot.
+
+			Args:
+				values			-- `(P, N)` complex array, or a sequence of `P` complex arrays.
+				serial_number	-- (int) Serial number of the unit the sweep came from.
+				config			-- (int) Sweep configuration id.
+				timestamp		-- (float) `time.time()` the sweep was taken.
+
+			Returns:
+				Index of the sweep in the segment.
+		'''
+		idx = self.count()
+		if isinstance(values, np.ndarray):
+			self.data[idx] = values
+		else:
+			dest = self.data[idx]
+			for row, value in enumerate(values):
+				dest[row] = value
+		self.timestamps[idx] = timestamp
+		self.serials[idx]    = serial_number
+		self.configs[idx]    = config
+		# Publish the sweep only once it has been completely written.
+		self.__count[0] = idx + 1
+		return idx
+
+	def flush(self):
+		self.__mmap.flush()
+
+	def close(self):
+		''' Drop the memory map. Any views of the segment's arrays keep it alive
+			until they are released.
+		'''
+		if self.__mmap is not None and self.__mmap.flags.writeable:
+			self.__mmap.flush()
+		self.__mmap = None
+
+
+class SweepRecorder(object):
+	''' Appends sweeps to a bounded set of segment files in a directory.
+
+		One segment is kept open per sweep configuration, so units (or a single unit)
+		alternating between configurations don't force a new segment on every change.
+
+		Typical use:
+
+			rec = SweepRecorder("/data/run-1")
+			cfg = rec.register_config(vna.getFrequencies(), VNA.UNCAL_PATHS)
+			while running:
+				rec.append(cfg, serial, vna.measure_batch(1).data[0])
+			rec.close()
+
+		Appending is thread-safe, so one recorder can be shared by several units.
+	'''
+
+	def __init__(self, dirpath, prefix="sweeps", capacity=SEGMENT_CAPACITY, max_segments=MAX_SEGMENTS):
+		''' Set up a recorder writing to `dirpath`, which is created if needed.
+
+			Args:
+				dirpath			-- (string) Directory to write the segments to.
+				prefix			-- (string) Name of the recording. Segment files are named
+				                   `<prefix>-<sequence>.vnarec`. Existing segments with the same
+				                   prefix are kept, and numbering continues after them.
+				capacity		-- (int) Number of sweeps per segment.
+				max_segments	-- (int) Maximum number of segments (of this prefix) to keep.
+				                   Once exceeded, the oldest closed segments are deleted.
+				                   None keeps every segment.
+		'''
+		assert capacity > 0, "Segments must hold at least one sweep!"
+		assert max_segments is None or max_segments > 0, "The recorder must be able to keep at least one segment!"
+		if not os.path.isdir(dirpath):
+			os.makedirs(dirpath)
+
+		self.dirpath      = dirpath
+		self.prefix       = prefix
+		self.capacity     = capacity
+		self.max_segments = max_segments
+
+		existing = list_segments(dirpath, prefix)
+		self.__sequence = existing[-1][0] + 1 if existing else 0
+		self.__configs  = {}
+		self.__open     = {}
+		self.__lock     = threading.Lock()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def register_config(self, freqs, paths):
+		''' Register a sweep configuration with the recorder.
+
+			Args:
+				freqs	-- `N` frequency points of the sweeps, in MHz.
+				paths	-- Names of the rows in each sweep (e.g. `VNA.UNCAL_PATHS`).
+
+			Returns:
+				Configuration id (see \ref config_id()) to pass to \ref append().
+		'''
+		freqs = np.array(freqs, dtype='<f8')
+		paths = tuple(paths)
+		config = config_id(freqs, paths)
+		with self.__lock:
+			self.__configs[config] = (freqs, paths)
+		return config
+
+	def append(self, config, serial_number, values, timestamp=None):
+		''' Record one sweep.
+
+			Args:
+				config			-- (int) Id from \ref register_config().
+				serial_number	-- (int) Serial number of the unit the sweep came from.
+				values			-- `(P, N)` complex array, or a sequence of `P` complex arrays
+				                   (e.g. a \ref VNA::vnaclass::Uncal_Scan_Return).
+				timestamp		-- (float) `time.time()` the sweep was taken. Defaults to now.
+		'''
+		if timestamp is None:
+			timestamp = time.time()
+		with self.__lock:
+			seg = self.__open.get(config)
+			if seg is None or seg.full():
+				seg = self.__roll(config)
+			seg.append(values, serial_number, config, timestamp)
+
+	def __roll(self, config):
+		old = self.__open.pop(config, None)
+		if old is not None:
+			old.close()
+
+		freqs, paths = self.__configs[config]
+		path = os.path.join(self.dirpath, segment_name(self.prefix, self.__sequence))
+		seg = Segment.create(path, freqs, paths, self.capacity, config, self.__sequence)
+		self.__sequence += 1
+		self.__open[config] = seg
+
+		if self.max_segments is None:
+			return seg
+
+		# Drop the oldest segments that are no longer being written to.
+		active = set(open_seg.path for open_seg in self.__open.values())
+		segments = list_segments(self.dirpath, self.prefix)
+		excess = len(segments) - self.max_segments
+		for dummy_seq, dummy_prefix, old_path in segments:
+			if excess <= 0:
+				break
+			if old_path in active:
+				continue
+			try:
+				os.remove(old_path)
+			except OSError:
+				continue
+			excess -= 1
+		return seg
+
+	def flush(self):
+		''' Flush the open segments to disk.
+		'''
+		with self.__lock:
+			for seg in self.__open.values():
+				seg.flush()
+
+	def close(self):
+		''' Flush and close the open segments. Appending again starts new segments.
+		'''
+		with self.__lock:
+			for seg in self.__open.values():
+				seg.close()
+			self.__open.clear()
+
+
+## Item returned by \ref SweepArchive.select(). The arrays are views of the segment
+## at `path` wherever possible (see \ref SweepArchive.select()). `data` is `(S, P, N)`.
+Archive_Slice = collections.namedtuple("Archive_Slice", ['path', 'config', 'paths', 'freqs', 'timestamps', 'serials', 'data'])
+
+class _SegmentIndex(object):
+	# Per-segment summary, extended as the segment grows.
+	def __init__(self, seg):
+		self.seg       = seg
+		self.count     = 0
+		self.t_min     = None
+		self.t_max     = None
+		self.ordered   = True
+		self.units     = set()
+
+	def update(self):
+		count = self.seg.count()
+		if count == self.count:
+			return
+		times = self.seg.timestamps[self.count:count]
+		if self.count and times[0] < self.seg.timestamps[self.count - 1]:
+			self.ordered = False
+		if self.ordered and np.any(np.diff(times) < 0):
+			self.ordered = False
+		self.t_min = times.min() if self.t_min is None else min(self.t_min, times.min())
+		self.t_max = times.max() if self.t_max is None else max(self.t_max, times.max())
+		self.units.update(int(val) for val in np.unique(self.seg.serials[self.count:count]))
+		self.count = count
+
+def _as_slice(rows):
+	# Express a sorted row index array as a slice where possible, so indexing with it gives a view.
+	if rows.shape[0] == 0:
+		return slice(0, 0)
+	if rows.shape[0] == 1:
+		return slice(int(rows[0]), int(rows[0]) + 1)
+	steps = np.diff(rows)
+	if np.all(steps == steps[0]):
+		return slice(int(rows[0]), int(rows[-1]) + 1, int(steps[0]))
+	return rows
+
+class SweepArchive(object):
+	''' Random-access reader for the segments written by \ref SweepRecorder.
+
+		Every segment in the directory is memory-mapped read-only, and summarized in
+		a small in-memory index (time span, unit serial numbers and configuration),
+		so a query only touches the segments, and the rows, it needs:
+
+			arc = SweepArchive("/data/run-1")
+			for part in arc.select(serial=12, start=t0, stop=t0 + 300, fmin=2000, fmax=3000):
+				process(part.freqs, part.data)
+
+		The archive can be read while it is being recorded. \ref refresh() picks up new
+		sweeps and segments, and forgets segments that were rolled over.
+	'''
+
+	def __init__(self, dirpath, prefix=None):
+		''' Open the archive in `dirpath`.
+
+			Args:
+				dirpath	-- (string) Directory the segments were recorded to.
+				prefix	-- (string) Only read the recording with this prefix. Defaults to every
+				           recording in the directory.
+		'''
+		self.dirpath  = dirpath
+		self.prefix   = prefix
+		self.__index  = collections.OrderedDict()
+		self.refresh()
+
+	def refresh(self):
+		''' Update the index with sweeps and segments written since the last refresh.
+		'''
+		present = list_segments(self.dirpath, self.prefix)
+		paths = set(path for dummy_seq, dummy_prefix, path in present)
+		for path in list(self.__index.keys()):
+			if path not in paths:
+				del self.__index[path]
+
+		index = collections.OrderedDict()
+		for dummy_seq, dummy_prefix, path in present:
+			entry = self.__index.get(path)
+			if entry is None:
+				try:
+					entry = _SegmentIndex(Segment(path))
+				except (IOError, OSError, ValueError):
+					# Removed by rollover, or still being created.
+					continue
+			entry.update()
+			index[path] = entry
+		self.__index = index
+
+	def __len__(self):
+		return sum(entry.count for entry in self.__index.values())
+
+	def segments(self):
+		''' Indexed \ref Segment objects, oldest first.
+		'''
+		return [entry.seg for entry in self.__index.values()]
+
+	def units(self):
+		''' Set of unit serial numbers in the archive.
+		'''
+		ret = set()
+		for entry in self.__index.values():
+			ret |= entry.units
+		return ret
+
+	def configs(self):
+		''' Dict mapping each configuration id in the archive to its `(paths, freqs)`.
+		'''
+		ret = {}
+		for entry in self.__index.values():
+			header = entry.seg.header
+			ret.setdefault(header["config"], (tuple(header["paths"]), entry.seg.freqs))
+		return ret
+
+	def time_range(self):
+		''' `(first, last)` sweep timestamp in the archive, or None if it is empty.
+		'''
+		spans = [(entry.t_min, entry.t_max) for entry in self.__index.values() if entry.count]
+		if not spans:
+			return None
+		return min(span[0] for span in spans), max(span[1] for span in spans)
+
+	def select(self, start=None, stop=None, serial=None, config=None, fmin=None, fmax=None):
+		''' Look up the sweeps matching a query.
+
+			All arguments are optional, and unspecified ones match everything.
+
+			Args:
+				start	-- (float) Earliest timestamp (inclusive).
+				stop	-- (float) Latest timestamp (exclusive).
+				serial	-- (int) Unit serial number.
+				config	-- (int) Configuration id, see \ref config_id().
+				fmin	-- (float) Lowest frequency to return, in MHz (inclusive).
+				fmax	-- (float) Highest frequency to return, in MHz (inclusive).
+
+			Returns:
+				List of \ref Archive_Slice, one per segment with matching sweeps, oldest first.
+
+			The returned arrays are views into the memory-mapped segments (nothing is
+			copied) as long as the matching sweeps of a segment are evenly spaced, which
+			is the case for a time range, and for one unit's sweeps when units share a
+			recorder in round-robin fashion. Otherwise the sweeps are copied out.
+		'''
+		ret = []
+		for path, entry in self.__index.items():
+			seg = entry.seg
+			if not entry.count:
+				continue
+			if config is not None and seg.header["config"] != config:
+				continue
+			if serial is not None and serial not in entry.units:
+				continue
+			if start is not None and entry.t_max < start:
+				continue
+			if stop is not None and entry.t_min >= stop:
+				continue
+
+			count = entry.count
+			times = seg.timestamps[:count]
+			if entry.ordered:
+				lo = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+				hi = count if stop is None else int(np.searchsorted(times, stop, side='left'))
+				rows = slice(lo, hi)
+				if serial is not None and entry.units != set([serial]):
+					rows = _as_slice(np.flatnonzero(seg.serials[lo:hi] == serial) + lo)
+			else:
+				mask = np.ones(count, dtype=bool)
+				if start is not None:
+					mask &= times >= start
+				if stop is not None:
+					mask &= times < stop
+				if serial is not None:
+					mask &= seg.serials[:count] == serial
+				rows = _as_slice(np.flatnonzero(mask))
+
+			timestamps = seg.timestamps[rows]
+			if not timestamps.shape[0]:
+				continue
+
+			freqs = seg.freqs
+			cols = None
+			if fmin is not None or fmax is not None:
+				if np.all(np.diff(freqs) > 0):
+					lo = 0 if fmin is None else int(np.searchsorted(freqs, fmin, side='left'))
+					hi = freqs.shape[0] if fmax is None else int(np.searchsorted(freqs, fmax, side='right'))
+					cols = slice(lo, hi)
+				else:
+					keep = np.ones(freqs.shape[0], dtype=bool)
+					if fmin is not None:
+						keep &= freqs >= fmin
+					if fmax is not None:
+						keep &= freqs <= fmax
+					cols = _as_slice(np.flatnonzero(keep))
+				freqs = freqs[cols]
+				if not freqs.shape[0]:
+					continue
+
+			data = seg.data[rows]
+			if cols is not None:
+				data = data[:, :, cols]
+			ret.append(Archive_Slice(path, seg.header["config"], tuple(seg.header["paths"]),
+					freqs, timestamps, seg.serials[rows], data))
+		return ret
+
+
+## Item returned by \ref SweepReplay.next_sweep(). `data` is a `(P, N)` view of the recorded sweep.
+Replay_Return = collections.namedtuple("Replay_Return", ['timestamp', 'serial', 'config', 'paths', 'freqs', 'data'])
+
+class SweepReplay(object):
+	''' Plays recorded sweeps back in the order they were taken, paced like the original capture.
+
+		Stands in for a live unit wherever sweeps are consumed one at a time:
+
+			replay = SweepReplay(SweepArchive("/data/run-1"), speed=4.0, serial=12)
+			for sweep in replay:
+				process(sweep.freqs, sweep.data)
+	'''
+
+	def __init__(self, archive, speed=1.0, loop=False, **query):
+		''' Set up playback of the sweeps in `archive` matching `query`.
+
+			Args:
+				archive	-- \ref SweepArchive to play back.
+				speed	-- (float) Playback rate, relative to the original capture (1.0 is real
+				           time, 10.0 ten times faster). None (or 0) plays the sweeps back as
+				           fast as they are consumed.
+				loop	-- (bool) Start over after the last sweep, rather than stopping.
+				query	-- Passed to \ref SweepArchive.select() to pick the sweeps to play.
+		'''
+		self.archive = archive
+		self.speed   = speed
+		self.loop    = loop
+		self.query   = query
+		self.reset()
+
+	def reset(self):
+		''' Re-run the query (picking up sweeps recorded since), and rewind to the first sweep.
+		'''
+		self.archive.refresh()
+		self.__parts = self.archive.select(**self.query)
+		self.__times = np.zeros(0)
+		if self.__parts:
+			# Segments of different configurations overlap in time, so merge them by timestamp.
+			times = np.concatenate([part.timestamps for part in self.__parts])
+			owner = np.concatenate([np.full(part.timestamps.shape[0], idx, dtype=np.intp) for idx, part in enumerate(self.__parts)])
+			rows  = np.concatenate([np.arange(part.timestamps.shape[0], dtype=np.intp) for part in self.__parts])
+			order = np.argsort(times, kind='mergesort')
+			self.__times, self.__owner, self.__rows = times[order], owner[order], rows[order]
+		self.__pos     = 0
+		self.__started = None
+
+	def __len__(self):
+		return self.__times.shape[0]
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		return self.next_sweep()
+
+	next = __next__
+
+	def next_sweep(self):
+		r''' Wait until the next sweep is due, and return it.
+
+			Returns:
+				\ref Replay_Return
+
+			---
+
+			\exceptions StopIteration once every sweep has been played (unless looping), or
+			            if no sweeps match the query.
+		'''
+		if self.__pos >= self.__times.shape[0]:
+			if not self.loop or not self.__times.shape[0]:
+				raise StopIteration
+			self.__pos     = 0
+			self.__started = None
+
+		pos = self.__pos
+		self.__pos += 1
+
+		if self.speed:
+			now = time.time()
+			if self.__started is None:
+				self.__started = now
+			due = self.__started + (self.__times[pos] - self.__times[0]) / self.speed
+			if due > now:
+				time.sleep(due - now)
+
+		part = self.__parts[self.__owner[pos]]
+		row  = self.__rows[pos]
+		return Replay_Return(float(part.timestamps[row]), int(part.serials[row]), part.config,
+				part.paths, part.freqs, part.data[row])
+
+
+# end doxygen block
+## @}
@@ -0,0 +1,269 @@
+################################################################################
+#### calfile.py		--	Versioned binary calibration file format			####
+####																		####
+####	One file per calibration: a small JSON header (serial, IP,			####
+####	timestamp, frequency grid, ...) followed by raw numpy blocks		####
+####	that are memory-mapped on load, plus importers for the				####
+####	older pickle, CSV and TDMS calibration formats.					####
+####																		####
+################################################################################
+from . import vnaexceptions
+import collections
+import json
+import os
+import pickle
+import struct
+import time
+
+import numpy as np
+
+##
+#  \addtogroup Python-Cal-File
+#
+#  \section calfile-brief Binary calibration files
+#
+#  Layout of a calibration file (all integers little-endian):
+#
+#     Offset        |  Contents                                                 |
+#    ---------------|-----------------------------------------------------------|
+#    0              | Magic, \ref CALFILE_MAGIC (8 bytes)                       |
+#    8              | Format version (uint32)                                   |
+#    12             | Header length `H` in bytes (uint32)                       |
+#    16             | UTF-8 JSON header, space padded to `H` bytes              |
+#    `freqs_offset` | `N` float64 frequencies, in MHz                           |
+#    `terms_offset` | `(12, N)` complex128 error terms, \ref exportCalibration() order |
+#
+#  The header holds `points` (`N`), `freqs_offset`, `terms_offset`, and the
+#  `serial_number`, `address`, `timestamp` and `hardware` details of the unit the
+#  calibration came from (each may be `null` if the source did not record it).
+#  Both data blocks are 64-byte aligned, so they can be memory-mapped directly.
+#
+#  @{
+#
+
+## First 8 bytes of every calibration file.
+CALFILE_MAGIC = b"OVNACAL\x00"
+
+## Current version of the file layout. Readers reject versions they don't know.
+CALFILE_VERSION = 1
+
+## Conventional extension for calibration files.
+CALFILE_EXTENSION = ".vnacal"
+
+_PREFIX = struct.Struct("<8sII")
+_ALIGN  = 64
+
+## Return value of \ref read_calfile() and the importers. `header` is a dict, `freqs`
+## an `(N, )` float64 array and `terms` a `(12, N)` complex128 array.
+CalFile = collections.namedtuple("CalFile", ['header', 'freqs', 'terms'])
+
+
+def _align(offset):
+	return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+def _jsonable(value):
+	if isinstance(value, dict):
+		return dict((str(key), _jsonable(val)) for key, val in value.items())
+	if isinstance(value, (list, tuple, np.ndarray)):
+		return [_jsonable(val) for val in value]
+	if isinstance(value, np.generic):
+		return value.item()
+	return value
+
+
+def write_calfile(path, freqs, terms, serial_number=None, address=None, timestamp=None, hardware=None):
+	''' Write a calibration to `path`.
+
+		The file is written to a temporary name, then moved into place, so readers
+		never see a partially written file.
+
+		Args:
+			path			-- (string) Destination filesystem path.
+			freqs			-- `N` calibration frequencies, in MHz.
+			terms			-- `(12, N)` complex error terms, in \ref exportCalibration() order.
+			serial_number	-- (int) Serial number of the unit the calibration belongs to.
+			address			-- (string) IP address of the unit.
+			timestamp		-- (float) `time.time()` the calibration was made. Defaults to now.
+			hardware		-- (dict) \ref HardwareDetails of the unit, as returned by `getHardwareDetails()`.
+	'''
+	freqs = np.ascontiguousarray(freqs, dtype='<f8')
+	terms = np.ascontiguousarray(terms, dtype='<c16')
+	npts = freqs.shape[0]
+	if freqs.ndim != 1 or terms.shape != (12, npts):
+		raise ValueError("Calibration must be N frequencies and (12, N) terms (got %s and %s)" % (freqs.shape, terms.shape))
+
+	header = {
+		"serial_number" : serial_number,
+		"address"       : address,
+		"timestamp"     : time.time() if timestamp is None else timestamp,
+		"hardware"      : hardware,
+		"points"        : npts,
+		"freqs_offset"  : 0,
+		"terms_offset"  : 0,
+	}
+
+	# The offsets depend on the header length, which depends on the offsets, so
+	# size the header with generously wide placeholders first.
+	header["freqs_offset"] = header["terms_offset"] = 10 ** 15
+	header_len = _align(_PREFIX.size + len(json.dumps(_jsonable(header)).encode("utf-8"))) - _PREFIX.size
+	header["freqs_offset"] = _PREFIX.size + header_len
+	header["terms_offset"] = _align(header["freqs_offset"] + freqs.nbytes)
+
+	blob = json.dumps(_jsonable(header)).encode("utf-8")
+	blob = blob + b" " * (header_len - len(blob))
+
+	tmppath = "%s.%s.tmp" % (path, os.getpid())
+	with open(tmppath, "wb") as fp:
+		fp.write(_PREFIX.pack(CALFILE_MAGIC, CALFILE_VERSION, header_len))
+		fp.write(blob)
+		fp.write(freqs.tobytes())
+		fp.write(b"\x00" * (header["terms_offset"] - header["freqs_offset"] - freqs.nbytes))
+		fp.write(terms.tobytes())
+	getattr(os, "replace", os.rename)(tmppath, path)
+
+
+def read_calfile(path, mmap=True):
+	r''' Load a calibration written by \ref write_calfile().
+
+		Args:
+			path	-- (string) Filesystem path of the calibration.
+			mmap	-- (bool) Memory-map the data blocks (read-only), rather than reading them in.
+
+		Returns:
+			\ref CalFile
+
+		---
+
+		\exceptions \ref VNA_Exception_Bad_Cal if the file is not a calibration file, is of an
+		            unsupported version, or is truncated.
+	'''
+	with open(path, "rb") as fp:
+		prefix = fp.read(_PREFIX.size)
+		if len(prefix) != _PREFIX.size:
+			raise vnaexceptions.VNA_Exception_Bad_Cal("'%s' is not a calibration file!" % path)
+		magic, version, header_len = _PREFIX.unpack(prefix)
+		if magic != CALFILE_MAGIC:
+			raise vnaexceptions.VNA_Exception_Bad_Cal("'%s' is not a calibration file!" % path)
+		if version != CALFILE_VERSION:
+			raise vnaexceptions.VNA_Exception_Bad_Cal("Calibration file version %s is not supported!" % version)
+		try:
+			header = json.loads(fp.read(header_len).decode("utf-8"))
+		except ValueError:
+			raise vnaexceptions.VNA_Exception_Bad_Cal("'%s' has a corrupt header!" % path)
+		_check_layout(path, header, _PREFIX.size + header_len)
+
+		npts = header["points"]
+		end = header["terms_offset"] + 12 * npts * 16
+		if os.fstat(fp.fileno()).st_size < end:
+			raise vnaexceptions.VNA_Exception_Bad_Cal("'%s' is truncated!" % path)
+
+		if mmap:
+			freqs = np.memmap(path, dtype='<f8', mode='r', offset=header["freqs_offset"], shape=(npts, ))
+			terms = np.memmap(path, dtype='<c16', mode='r', offset=header["terms_offset"], shape=(12, npts))
+		else:
+			fp.seek(header["freqs_offset"])
+			freqs = np.fromfile(fp, dtype='<f8', count=npts)
+			fp.seek(header["terms_offset"])
+			terms = np.fromfile(fp, dtype='<c16', count=12 * npts).reshape(12, npts)
+
+	return CalFile(header, freqs, terms)
+
+
+def _check_layout(path, header, data_start):
+	# The data block layout must be present and consistent, so a malformed header
+	# is reported as a bad calibration rather than a KeyError or TypeError.
+	if not isinstance(header, dict):
+		raise vnaexceptions.VNA_Exception_Bad_Cal("'%s' has a corrupt header!" % path)
+	for key in ("points", "freqs_offset", "terms_offset"):
+		value = header.get(key)
+		if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+			raise vnaexceptions.VNA_Exception_Bad_Cal("'%s' has a missing or invalid '%s' in its header!" % (path, key))
+	if header["freqs_offset"] < data_start or header["terms_offset"] < header["freqs_offset"] + header["points"] * 8:
+		raise vnaexceptions.VNA_Exception_Bad_Cal("'%s' has overlapping data blocks!" % path)
+
+
+def _make_header(serial_number=None, address=None, timestamp=None, hardware=None, points=0):
+	return {
+		"serial_number" : serial_number,
+		"address"       : address,
+		"timestamp"     : timestamp,
+		"hardware"      : hardware,
+		"points"        : points,
+	}
+
+def import_pickle(path):
+	''' Import a calibration pickled by the older `VNA.save_dll_cal()`.
+
+		Only load pickles from trusted sources, as unpickling can run arbitrary code.
+	'''
+	with open(path, "rb") as fp:
+		cal = pickle.load(fp)
+
+	freqs = np.asarray(cal['cal_f'], dtype=np.float64)
+	terms = np.array(cal['cal_p'], dtype=np.complex128)
+	hardware = cal.get('hardware')
+	serial = hardware.get('serial_number') if hardware else None
+	header = _make_header(serial, cal.get('address'), cal.get('time'), hardware, freqs.shape[0])
+	return CalFile(header, freqs, terms)
+
+def import_csv(path):
+	''' Import a 25-column CSV calibration, as loaded by `VnaThread.tryLoadLocalCal()`.
+
+		One header row, then one row per frequency: the frequency, followed by the
+		real and imaginary part of each term, in \ref exportCalibration() order.
+	'''
+	dat = np.loadtxt(path, delimiter=",", skiprows=1, dtype=np.float64, ndmin=2)
+	if dat.shape[1] != 25:
+		raise vnaexceptions.VNA_Exception_Bad_Cal("CSV calibration '%s' has %s columns, rather than 25!" % (path, dat.shape[1]))
+
+	freqs = np.ascontiguousarray(dat[:, 0])
+	terms = (dat[:, 1::2] + 1j * dat[:, 2::2]).T.copy()
+	return CalFile(_make_header(points=freqs.shape[0]), freqs, terms)
+
+## Term names used in the LabVIEW TDMS calibration files, in \ref exportCalibration() order.
+TDMS_TERMS = ('e00', 'e11', 'e10e01', 'e30', 'e22', 'e10e32', 'ep33', 'ep22', 'ep23ep32', 'ep03', 'ep11', 'ep23ep01')
+
+def import_tdms(path):
+	''' Import a TDMS calibration, as read by \ref VNA::calutil::read_cal_TDMS(). Needs `nptdms`.
+	'''
+	from . import calutil
+	cal = calutil.read_cal_TDMS(path, with_frequencies=True)
+
+	freqs = np.asarray(cal['frequencies'], dtype=np.float64)
+	terms = np.array([cal[name] for name in TDMS_TERMS], dtype=np.complex128)
+	return CalFile(_make_header(points=freqs.shape[0]), freqs, terms)
+
+def import_calibration(path, mmap=True):
+	''' Load a calibration in any supported format, picked by file extension.
+
+		`.pik`/`.pickle` files go through \ref import_pickle(), `.csv` through
+		\ref import_csv(), `.tdms` through \ref import_tdms(), and anything else
+		through \ref read_calfile().
+
+		Returns:
+			\ref CalFile
+	'''
+	ext = os.path.splitext(path)[1].lower()
+	if ext in (".pik", ".pickle"):
+		return import_pickle(path)
+	if ext == ".csv":
+		return import_csv(path)
+	if ext == ".tdms":
+		return import_tdms(path)
+	return read_calfile(path, mmap=mmap)
+
+def convert_calibration(src, dst):
+	''' Convert a calibration in any format \ref import_calibration() understands
+		into a binary calibration file.
+
+		Returns:
+			\ref CalFile of the converted calibration.
+	'''
+	cal = import_calibration(src)
+	header = cal.header
+	write_calfile(dst, cal.freqs, cal.terms, header["serial_number"], header["address"], header["timestamp"], header["hardware"])
+	return read_calfile(dst)
+
+
+# end doxygen block
+## @}
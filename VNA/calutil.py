@@ -12,6 +12,9 @@
 ####	Date: 08.24.2015													####
 ####																		####
 ################################################################################
+import collections as _collections
+import threading as _threading
+
 def generate_rawDict(ports, caltype='solt'):
 	''' Make a dictionary to store raw signals (e.g. used for VNA calibration)
 		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -56,7 +59,7 @@ def generate_rawDict(ports, caltype='solt'):
 	return rawDict
 ####
 
-def catalog_dirpath(dirpath, FILETYPE='csv', CONTEXT=None, DATATYPE='uncal'):
+def catalog_dirpath(dirpath, FILETYPE='csv', CONTEXT=None, DATATYPE='uncal', index=False):
 	''' Catalog (VNA) files in a directory, given some filename structure
 		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 		Usage:	dirpath = './8.18_vnaCAL/'
@@ -69,6 +72,9 @@ def catalog_dirpath(dirpath, FILETYPE='csv', CONTEXT=None, DATATYPE='uncal'):
 				EXTRACT_FILETYPE	-- file-extension to consider
 				EXTRACT_CONTEXT		-- comment description in filename
 				EXTRACT_DATATYPE	-- type of VNA signals, ('uncal', 'cal')
+				index				-- (optional, bool) keep a persistent index of the
+									   directory (see update_catalog_index), so only
+									   new or changed files are looked at again
 
 		OUT:	EXTRACT.files 		-- relative filenames
 				EXTRACT.context 	-- file context (comment in filename)
@@ -89,42 +95,22 @@ def catalog_dirpath(dirpath, FILETYPE='csv', CONTEXT=None, DATATYPE='uncal'):
 	EXTRACT_terms = []
 	EXTRACT_datas = []
 
-	files = os.listdir(dirpath)
-	for fname in files:
-		title = fname.split('.')			# check filetype
-		if (len(title)<=1) or (title[len(title)-1].lower()!=EXTRACT_FILETYPE):
-			#print('--> wrong filetype')
-			continue
-		#
-		title = title[0]
+	if index:
+		entries = update_catalog_index(dirpath, EXTRACT_FILETYPE)[0]
+		parsed = [(fname, entries[fname]['name']) for fname in sorted(entries)]
+	else:
+		parsed = [(fname, _parse_catalog_fname(fname, EXTRACT_FILETYPE)) for fname in os.listdir(dirpath)]
+	#
 
-		description = title.split('_')		# check fileext
-		fileCONTEXT = description[0].lower()
-		if (EXTRACT_CONTEXT is not None) and (fileCONTEXT!=EXTRACT_CONTEXT):
-			#print('--> bad context')
+	for fname, description in parsed:
+		if not _catalog_match(description, EXTRACT_CONTEXT, EXTRACT_DATATYPE):
 			continue
 		#
-
-		if fileCONTEXT=='cal':				# routine for files as "CAL_..."
-
-			pNUM = [int(p) for p in description[1].split('p') if p!=''] # list of ports involved
-			pTERM = description[2].lower() # termination of the port (S-O-L-T)
-			pDATA = description[3].lower() # which signal was measured
-
-			if EXTRACT_DATATYPE.lower()=='uncal' and pDATA in ['a','u','v','b']:
-				pass
-			elif EXTRACT_DATATYPE.lower()=='cal' and pDATA in ['s11','s21','s12','s22']:
-				pass
-			elif EXTRACT_DATATYPE is None:
-				pass
-			else:
-				#print('bad sigfile')
-				continue
-			#
+		[fileCONTEXT, pNUM, pTERM, pDATA] = description
 
 		EXTRACT_files 	+= [dirpath+fname]
 		EXTRACT_context += [fileCONTEXT]
-		EXTRACT_ports 	+= [pNUM]
+		EXTRACT_ports 	+= [list(pNUM) if pNUM is not None else None]
 		EXTRACT_terms	+= [pTERM]
 		EXTRACT_datas	+= [pDATA]
 	#
@@ -135,16 +121,316 @@ def catalog_dirpath(dirpath, FILETYPE='csv', CONTEXT=None, DATATYPE='uncal'):
 	return catalog_files(EXTRACT_files, EXTRACT_context, EXTRACT_ports, EXTRACT_terms, EXTRACT_datas)
 ####
 
-def read_labview_CSV(fname):
+def _parse_catalog_fname(fname, FILETYPE):
+	# [context, ports, termination, signal] from a filename like "CAL_p1p2_t_u.csv",
+	# or None if it is not of type FILETYPE
+	title = fname.split('.')			# check filetype
+	if (len(title)<=1) or (title[len(title)-1].lower()!=FILETYPE):
+		return None
+	#
+	title = title[0]
+
+	description = title.split('_')		# check fileext
+	fileCONTEXT = description[0].lower()
+	if fileCONTEXT=='cal':				# routine for files as "CAL_..."
+		try:
+			pNUM = [int(p) for p in description[1].split('p') if p!=''] # list of ports involved
+			pTERM = description[2].lower() # termination of the port (S-O-L-T)
+			pDATA = description[3].lower() # which signal was measured
+		except (IndexError, ValueError):
+			return None
+		#
+		return [fileCONTEXT, pNUM, pTERM, pDATA]
+	#
+	return [fileCONTEXT, None, None, None]
+####
+
+def _catalog_match(description, CONTEXT, DATATYPE):
+	if description is None:
+		return False
+	#
+	[fileCONTEXT, pNUM, pTERM, pDATA] = description
+	if (CONTEXT is not None) and (fileCONTEXT!=CONTEXT):
+		#print('--> bad context')
+		return False
+	#
+	if fileCONTEXT=='cal':
+		if DATATYPE is None:
+			pass
+		elif DATATYPE.lower()=='uncal' and pDATA in ['a','u','v','b']:
+			pass
+		elif DATATYPE.lower()=='cal' and pDATA in ['s11','s21','s12','s22']:
+			pass
+		else:
+			#print('bad sigfile')
+			return False
+		#
+	#
+	return True
+####
+
+## Version of the on-disk catalog index format
+CATALOG_INDEX_VERSION = 1
+
+def update_catalog_index(dirpath, FILETYPE='csv'):
+	''' Bring the persistent catalog index of a directory up to date
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+		Usage:	entries, changed = update_catalog_index('./8.18_vnaCAL/')
+
+		The index is kept in the directory itself (.calutil_catalog_<FILETYPE>.json).
+		Only files whose mtime or size differ from the index are parsed again,
+		files that have disappeared are dropped, and the index is only rewritten
+		if something changed. If the directory isn't writable, the index is just
+		rebuilt in memory each time.
+
+		IN:		dirpath		-- directory to index
+				FILETYPE	-- file-extension to consider
+
+		OUT:	entries		-- dict of {filename: {'mtime', 'size', 'name'}}, where
+							   'name' is the parsed [context, ports, term, data]
+				changed		-- sorted list of filenames that are new or changed
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+	'''
+	import os
+	import json
+
+	indexname = os.path.join(dirpath, '.calutil_catalog_%s.json' % FILETYPE)
+	entries = {}
+	try:
+		with open(indexname, 'r') as fp:
+			index = json.load(fp)
+		#
+		if index.get('version')==CATALOG_INDEX_VERSION:
+			entries = index['entries']
+		#
+	except (IOError, OSError, ValueError, KeyError):
+		pass
+	#
+
+	current = {}
+	changed = []
+	for fname in os.listdir(dirpath):
+		if fname.startswith('.') or not fname.lower().endswith('.'+FILETYPE):
+			continue
+		#
+		try:
+			stat = os.stat(os.path.join(dirpath, fname))
+		except OSError:
+			continue # removed while scanning
+		#
+		entry = entries.get(fname)
+		if entry is None or entry['mtime']!=stat.st_mtime or entry['size']!=stat.st_size:
+			entry = {'mtime': stat.st_mtime, 'size': stat.st_size, 'name': _parse_catalog_fname(fname, FILETYPE)}
+			changed += [fname]
+		#
+		current[fname] = entry
+	#
+
+	if changed or len(current)!=len(entries):
+		tmpname = '%s.%s.tmp' % (indexname, os.getpid())
+		try:
+			with open(tmpname, 'w') as fp:
+				json.dump({'version': CATALOG_INDEX_VERSION, 'entries': current}, fp)
+			#
+			getattr(os, 'replace', os.rename)(tmpname, indexname)
+		except (IOError, OSError):
+			if os.path.exists(tmpname):
+				os.remove(tmpname)
+			#
+		#
+	#
+
+	return current, sorted(changed)
+####
+
+def watch_catalog(dirpath, callback, FILETYPE='csv', CONTEXT=None, DATATYPE='uncal', interval=1.0, stop=None, cache=True):
+	''' Ingest files as they are dropped into a directory
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+		Usage:	stop = threading.Event()
+				threading.Thread(target=watch_catalog, args=(dirpath, ingest),
+								 kwargs={'stop': stop}).start()
+
+		Polls the directory index (see update_catalog_index) every interval
+		seconds. Once a new or changed file matching CONTEXT/DATATYPE has kept
+		the same mtime and size for a whole poll (so it is not still being
+		written), it is read with read_labview_CSV and handed to the callback.
+		Files already in the index when watching starts are not handed over.
+		After that, the watcher keeps its own record of what it has seen, so
+		anything else updating the index meanwhile does not hide new files.
+
+		IN:		dirpath		-- directory to watch
+				callback	-- callback(fname, filedat), fname as in catalog_dirpath
+							   and filedat the output of read_labview_CSV
+				FILETYPE, CONTEXT, DATATYPE
+							-- filters, as for catalog_dirpath
+				interval	-- (optional) seconds between polls
+				stop		-- (optional) threading.Event; watching ends once set.
+							   If not given, this never returns.
+				cache		-- (optional, bool) write a binary sidecar for each file
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+	'''
+	import time
+
+	snapshot = None # {fname: (mtime, size)} as of the previous poll
+	handled = {}    # {fname: (mtime, size)} as last handed over (or skipped)
+	while True:
+		entries, changed = update_catalog_index(dirpath, FILETYPE)
+		current = dict((fname, (entry['mtime'], entry['size'])) for fname, entry in entries.items())
+
+		if snapshot is None:
+			# Start from what was already indexed before watching began.
+			handled = dict((fname, stat) for fname, stat in current.items() if fname not in changed)
+			snapshot = dict(handled)
+		#
+		ready = [fname for fname in sorted(current) if snapshot.get(fname)==current[fname] and handled.get(fname)!=current[fname]]
+		snapshot = current
+		handled = dict((fname, stat) for fname, stat in handled.items() if fname in current)
+		for fname in ready:
+			handled[fname] = current[fname]
+			if not _catalog_match(entries[fname]['name'], CONTEXT, DATATYPE):
+				continue
+			#
+			try:
+				filedat = read_labview_CSV(dirpath+fname, cache=cache)
+			except Exception as e:
+				print('Could not read %s: %s' % (dirpath+fname, e))
+				continue
+			#
+			callback(dirpath+fname, filedat)
+		#
+
+		if stop is None:
+			time.sleep(interval)
+		elif stop.wait(interval):
+			return
+		#
+	#
+####
+
+def read_labview_CSV(fname, cache=False):
 	''' Read in CSV files produced Akela VNA v1.4 (LabView application)
 		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 		IN:		fname			-- relative filepath of a single csv file
+				cache			-- (optional, bool) keep a binary copy of the parsed
+								   file next to it (fname + '.npz'), and load that
+								   instead while the CSV's mtime and size match
 
 		OUT:	file.props		-- Stimulus info, a dictionary of props and vals
 				file.data		-- Graph data, a list containing MxN np arrays
 				file.data_names	-- Labels corresponding to signals in file.data
 		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 	'''
+	if cache:
+		file = _read_labview_sidecar(fname)
+		if file is not None:
+			return file
+		#
+	#
+
+	try:
+		file = _parse_labview_CSV(fname)
+	except (ValueError, IndexError):
+		file = _read_labview_CSV_rows(fname)
+	#
+
+	if cache:
+		_write_labview_sidecar(fname, file)
+	#
+	return file
+####
+
+def _parse_labview_CSV(fname):
+	# Bulk version of _read_labview_CSV_rows: the header rows and the stimulus
+	# section go through csv, and the graph columns are parsed in one go by numpy
+	import csv
+	import numpy as np
+	from collections import namedtuple
+
+	with open(fname, newline='') as csvfile:
+		lines = csvfile.read().splitlines()
+	#
+	rows = list(csv.reader(lines[:8], delimiter=',', quotechar='|'))
+
+	## figure out which positions will have data in them
+	infoIDX = [idx for idx in range(0,len(rows[0])) if 'Stimulus' in rows[0][idx]]
+	dataIDX = [idx for idx in range(0,len(rows[0])) if 'Graph' in rows[0][idx] and 'Stimulus' not in rows[0][idx]]
+
+	## The stimulus section will last 2 columns, and 1+6 more rows
+	fileprops = {}
+	if infoIDX:
+		infoIDX = infoIDX[-1]
+		for row in rows[2:8]:
+			fileprops[ row[infoIDX] ] = float(row[infoIDX+1])
+		#
+	#
+
+	## The graph sections will last 3 columns (1 with SIGNAME, 2 with data), from row 1 on
+	filedata_names = [ rows[1][idx] for idx in dataIDX ]
+	usecols = [col for idx in dataIDX for col in (idx+1, idx+2)]
+	filedata = []
+	if usecols:
+		values = np.loadtxt(lines[1:], delimiter=',', usecols=usecols, ndmin=2)
+		filedata = [np.ascontiguousarray(values[:, 2*idx:2*idx+2]) for idx in range(0,len(dataIDX))]
+	#
+
+	file = namedtuple('labview_csv', 'props, data, data_names')
+
+	return file(fileprops, filedata, filedata_names)
+####
+
+def _read_labview_sidecar(fname):
+	import os
+	import numpy as np
+	from collections import namedtuple
+
+	try:
+		stat = os.stat(fname)
+		with np.load(fname+'.npz') as dat:
+			if int(dat['src_size'])!=stat.st_size or float(dat['src_mtime'])!=stat.st_mtime:
+				return None
+			#
+			fileprops = dict(zip([str(key) for key in dat['prop_names']], [float(val) for val in dat['prop_values']]))
+			filedata = list(dat['data'])
+			filedata_names = [str(name) for name in dat['data_names']]
+		#
+	except (IOError, OSError, KeyError, ValueError):
+		return None
+	#
+
+	file = namedtuple('labview_csv', 'props, data, data_names')
+
+	return file(fileprops, filedata, filedata_names)
+####
+
+def _write_labview_sidecar(fname, file):
+	import os
+	import numpy as np
+
+	if len(set(dat.shape for dat in file.data)) > 1:
+		return # ragged graph sections, not worth caching
+	#
+	stat = os.stat(fname)
+	tmpname = '%s.npz.%s.tmp' % (fname, os.getpid())
+	try:
+		with open(tmpname, 'wb') as fp:
+			np.savez(fp,
+					src_size=stat.st_size, src_mtime=stat.st_mtime,
+					prop_names=np.array(list(file.props.keys()), dtype=np.str_),
+					prop_values=np.array(list(file.props.values()), dtype=np.float64),
+					data=np.array(file.data, dtype=np.float64),
+					data_names=np.array(file.data_names, dtype=np.str_))
+		#
+		getattr(os, 'replace', os.rename)(tmpname, fname+'.npz')
+	except (IOError, OSError):
+		print('Could not write cache file for %s' % fname)
+		if os.path.exists(tmpname):
+			os.remove(tmpname)
+		#
+	#
+####
+
+def _read_labview_CSV_rows(fname):
+	# Row-by-row reader, for files the bulk parser in read_labview_CSV can't handle
 	import csv
 	import numpy as np
 	from collections import namedtuple
@@ -203,24 +489,51 @@ def read_labview_CSV(fname):
 	return file(fileprops, filedata, filedata_names)
 ####
 
-def catalog_labview_to_CALdict(catalog, CAL_data):
+def _load_catalog_file(job):
+	# Pool worker for catalog_labview_to_CALdict. Returns a plain tuple, as the
+	# labview_csv namedtuple class can't be pickled back to the parent.
+	[fname, cache] = job
+	return tuple(read_labview_CSV(fname, cache=cache))
+####
+
+def catalog_labview_to_CALdict(catalog, CAL_data, cache=False, workers=None):
 	''' Read a catalog of Akela VNA v1.4 CSV files, and return an organized dict
 		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 		IN:		catalog			-- a catalog of files, output of catalog_dirpath
 				CAL_data		-- an (empty) dict, output of generate_CALdict
+				cache			-- (optional, bool) use binary sidecar files, see
+								   read_labview_CSV
+				workers			-- (optional, int) read the files on a pool of this
+								   many processes, rather than one after the other
 
 		OUT:	CAL_data		-- a filled dict, with data read from catalog
 		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 	'''
 	from collections import namedtuple
 	raw_sig = namedtuple('uncalibrated_measurement', 'signal, ref')
+	labview_csv = namedtuple('labview_csv', 'props, data, data_names')
+
+	jobs = [[fname, cache] for fname in catalog.files]
+	if workers and len(jobs) > 1:
+		import multiprocessing
+		pool = multiprocessing.Pool(workers)
+		try:
+			filedats = [labview_csv(*filedat) for filedat in pool.map(_load_catalog_file, jobs)]
+		finally:
+			pool.close()
+			pool.join()
+		#
+	else:
+		filedats = [read_labview_CSV(fname, cache=cache) for fname in catalog.files]
+	#
+
 	for idx in range(0,len(catalog.files)):
 		fname = catalog.files[idx]
 		port = catalog.ports[idx]
 		term = catalog.terms[idx]
 		data = catalog.datas[idx]
 
-		filedat = read_labview_CSV(fname) # read in file
+		filedat = filedats[idx] # read in file
 		if len(filedat.data)!=4: # make sure ref is recorded with signal
 			raise('FilesAreNotFormattedCorrectly')
 		#
@@ -374,41 +687,11 @@ def generate_CALterms(CAL_data, caltype='solt', rotation=None):
 		S12ThruM = TV / TR;
 		S22ThruM = TB / TR;
 
-		# One-port terms
-		EDF = S11LoadM;		#1, fw-directivity
-		EDR = S22LoadM;		#7,	rv-directivity
-
-		A = S11ShortM + S11OpenM - EDF - EDF; #2,	fw-portmatch
-		B = S11OpenM - S11ShortM;
-		ESF = A/B;
-		A = S22ShortM + S22OpenM - EDR - EDR; #8,	rv-portmatch
-		B = S22OpenM - S22ShortM;
-		ESR = A/B;
-
-		A = (S11OpenM - EDF)*(S11ShortM - EDF)*(-2); #3,	fw-reflectiontracking
-		B = S11OpenM - S11ShortM;
-		ERF = A/B;
-		A = (S22OpenM - EDR)*(S22ShortM - EDR)*(-2); #9, 	rv-reflectiontracking
-		B = S22OpenM - S22ShortM;
-		ERR = A/B;
-
-		# Two-port terms
-		EXF = S21LoadsM; #4, 	fw-
-		EXR = S12LoadsM; #10, 	rv-
-
-		A = S11ThruM - EDF; #5,	fw-
-		B = ERF + ESF*A;
-		ELF = A/B;
-		A = S22ThruM - EDR; #11, rv-
-		B = ERR + ESR*A;
-		ELR = A/B;
-
-		A = S21ThruM - EXF; #6,	fw-
-		B = ESF*ELF*(-1) + 1;
-		ETF = A*B;
-		A = S12ThruM - EXR; #12, rv-
-		B = ESR*ELR*(-1) + 1;
-		ETR = A*B;
+		[EDF, ESF, ERF, EXF, ELF, ETF, EDR, ESR, ERR, EXR, ELR, ETR] = generate_CALterms_batch(
+				S11OpenM, S11ShortM, S11LoadM,
+				S22OpenM, S22ShortM, S22LoadM,
+				S21LoadsM, S12LoadsM,
+				S11ThruM, S21ThruM, S12ThruM, S22ThruM )
 
 		calterms = cal_terms(	frequencies,
 								EDF, EDR, ESF, ESR,
@@ -469,7 +752,310 @@ def generate_CALterms(CAL_data, caltype='solt', rotation=None):
 	return [caldata, calterms, calib]
 ####
 
-def read_cal_TDMS(tdms_filename, porttype='2-port'):
+## Order of the 12 error terms along the first axis of the batch arrays. This is the
+## same order as VNA.exportCalibration() / VNA.importCalibration() use.
+CALTERM_ORDER = ('EDF', 'ESF', 'ERF', 'EXF', 'ELF', 'ETF', 'EDR', 'ESR', 'ERR', 'EXR', 'ELR', 'ETR')
+
+def generate_CALterms_batch(S11OpenM, S11ShortM, S11LoadM,
+							S22OpenM, S22ShortM, S22LoadM,
+							S21LoadsM, S12LoadsM,
+							S11ThruM, S21ThruM, S12ThruM, S22ThruM, out=None):
+	''' Compute the 12 SOLT error terms for a whole stack of calibrations at once
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+		Usage:	terms = generate_CALterms_batch(*standards)		# (12, units, N)
+				vna.importCalibration(freqs, *terms[unit])
+
+		IN:		S11OpenM ... S22ThruM	-- measured ratios (signal / ref) for each
+										   standard, as in generate_CALterms. Any
+										   broadcastable (..., N) shape, e.g. one
+										   row per unit for a whole fleet.
+				out						-- (optional) preallocated (12, ..., N)
+										   complex array to write the terms into
+
+		OUT:	out						-- (12, ..., N) complex array, rows in
+										   CALTERM_ORDER
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+	'''
+	import numpy as np
+
+	shape = np.broadcast(S11OpenM, S11ShortM, S11LoadM, S22OpenM, S22ShortM, S22LoadM,
+						S21LoadsM, S12LoadsM, S11ThruM, S21ThruM, S12ThruM, S22ThruM).shape
+	if out is None:
+		out = np.empty((12,)+shape, dtype=np.complex128)
+	elif out.shape != (12,)+shape:
+		raise ValueError('out has shape %s, expected %s' % (out.shape, (12,)+shape))
+	#
+	[EDF, ESF, ERF, EXF, ELF, ETF, EDR, ESR, ERR, EXR, ELR, ETR] = out
+
+	for [D, E, R, X, EL, ET, O, S, L, T, TX, LX] in [
+			[EDF, ESF, ERF, EXF, ELF, ETF, S11OpenM, S11ShortM, S11LoadM, S11ThruM, S21ThruM, S21LoadsM],	# forward
+			[EDR, ESR, ERR, EXR, ELR, ETR, S22OpenM, S22ShortM, S22LoadM, S22ThruM, S12ThruM, S12LoadsM] ]:	# reverse
+
+		# One-port terms
+		D[...] = L								# directivity
+		np.subtract(O, S, out=ET)				# (scratch) open - short
+		np.add(O, S, out=E)						# portmatch
+		E -= D
+		E -= D
+		E /= ET
+		np.subtract(O, D, out=R)				# reflection tracking
+		np.subtract(S, D, out=EL)				# (scratch)
+		R *= EL
+		R *= -2
+		R /= ET
+
+		# Two-port terms
+		X[...] = LX								# leakage
+		np.subtract(T, D, out=EL)				# port-2 match
+		np.multiply(E, EL, out=ET)				# (scratch)
+		ET += R
+		EL /= ET
+		np.multiply(E, EL, out=ET)				# transmission tracking
+		np.subtract(1, ET, out=ET)
+		ET *= np.subtract(TX, X)
+	#
+	return out
+####
+
+def applyCalibration_batch(terms, A, U, V, B, R=None, out=None, work=None):
+	''' Apply the 12-term correction to a whole stack of sweeps at once
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+		Usage:	batch = vna.measure_batch(100)				# (100, 5, N)
+				S = applyCalibration_batch(terms, *batch.data.swapaxes(0, 1))
+				S11, S21, S12, S22 = S						# each (100, N)
+
+		IN:		terms		-- (12, ..., N) complex error terms in CALTERM_ORDER,
+							   already on the sweep's frequency grid (see
+							   exportCalibration / generate_CALterms_batch).
+							   Broadcast against the data, so one set of terms
+							   can correct a whole batch of sweeps.
+				A, U, V, B	-- raw S11, S21, S12, S22 paths (T1R1, T1R2, T2R1,
+							   T2R2), any broadcastable (..., N) shape
+				R			-- (optional) reference path. If not given, A/U/V/B
+							   are taken to already be ratios.
+				out			-- (optional) preallocated (4, ..., N) complex output
+				work		-- (optional) preallocated (5, ..., N) complex scratch
+
+		OUT:	out			-- (4, ..., N) complex array of S11, S21, S12, S22
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+	'''
+	import numpy as np
+
+	inputs = [A, U, V, B] if R is None else [A, U, V, B, R]
+	shape = np.broadcast(terms[0], *inputs).shape
+	if out is None:
+		out = np.empty((4,)+shape, dtype=np.complex128)
+	elif out.shape != (4,)+shape:
+		raise ValueError('out has shape %s, expected %s' % (out.shape, (4,)+shape))
+	#
+	if work is None:
+		work = np.empty((5,)+shape, dtype=np.complex128)
+	elif work.shape != (5,)+shape:
+		raise ValueError('work has shape %s, expected %s' % (work.shape, (5,)+shape))
+	#
+
+	[EDF, ESF, ERF, EXF, ELF, ETF, EDR, ESR, ERR, EXR, ELR, ETR] = terms
+	[S11, S21, S12, S22] = out
+	[P, Q, C, Dinv, T] = work
+
+	# normalized measurements, e.g. S11N = (A/R - EDF)/ERF
+	for [N, M, DX, RT] in [[S11, A, EDF, ERF], [S21, U, EXF, ETF], [S12, V, EXR, ETR], [S22, B, EDR, ERR]]:
+		if R is None:
+			N[...] = M
+		else:
+			np.divide(M, R, out=N)
+		#
+		N -= DX
+		N /= RT
+	#
+
+	np.multiply(S21, S12, out=C)				# S21N*S12N
+	np.multiply(S11, ESF, out=P); P += 1		# S11N*ESF + 1
+	np.multiply(S22, ESR, out=Q); Q += 1		# S22N*ESR + 1
+	np.multiply(P, Q, out=Dinv)					# D
+	np.multiply(C, ELF*ELR, out=T)
+	Dinv -= T
+	np.divide(1, Dinv, out=Dinv)
+
+	np.multiply(S22, ESR - ELF, out=T); T += 1	# S21 = S21N*(S22N*(ESR - ELF) + 1) / D
+	T *= Dinv
+	S21 *= T
+	np.multiply(S11, ESF - ELR, out=T); T += 1	# S12 = S12N*(S11N*(ESF - ELR) + 1) / D
+	T *= Dinv
+	S12 *= T
+	S11 *= Q									# S11 = (S11N*(S22N*ESR + 1) - ELF*S21N*S12N) / D
+	np.multiply(C, ELF, out=T)
+	S11 -= T
+	S11 *= Dinv
+	S22 *= P									# S22 = (S22N*(S11N*ESF + 1) - ELR*S21N*S12N) / D
+	np.multiply(C, ELR, out=T)
+	S22 -= T
+	S22 *= Dinv
+
+	return out
+####
+
+def save_raw_sweeps(fname, frequencies, raw, timestamps=None, **meta):
+	''' Save raw (uncalibrated) sweeps, so they can be (re-)corrected later
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+		Usage:	batch = vna.measure_batch(100)
+				save_raw_sweeps('run1.npz', vna.getFrequencies(), batch.data, batch.timestamps)
+
+		IN:		fname		-- filepath (.npz)
+				frequencies	-- (N,) sweep frequencies, MHz
+				raw			-- (..., 5, N) complex T1R1, T1R2, T2R1, T2R2, Ref
+				timestamps	-- (optional) array of sweep times
+				meta		-- (optional) extra arrays/values to store alongside
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+	'''
+	import numpy as np
+
+	if timestamps is not None:
+		meta['timestamps'] = timestamps
+	#
+	with open(fname, 'wb') as fp:
+		np.savez(fp, frequencies=frequencies, raw=raw, **meta)
+	#
+####
+
+_recorrect_cal = None
+
+def _recorrect_init(cal_f, cal_terms, interp):
+	# Sent to each worker once, so interpCALterms can reuse its fits between files on the same grid
+	global _recorrect_cal
+	_recorrect_cal = (cal_f, cal_terms, interp)
+####
+
+def _recorrect_file(job):
+	import numpy as np
+	[fname, outname] = job
+	[cal_f, cal_terms, interp] = _recorrect_cal
+
+	with np.load(fname) as dat:
+		frequencies = dat['frequencies']
+		raw = dat['raw']
+		meta = dict((key, dat[key]) for key in dat.files if key not in ('frequencies', 'raw'))
+	#
+
+	terms = interpCALterms(cal_f, cal_terms, frequencies, mode=interp)
+	sparams = np.empty(raw.shape[:-2] + (4, raw.shape[-1]), dtype=np.complex128)
+	applyCalibration_batch(terms, *np.moveaxis(raw, -2, 0), out=np.moveaxis(sparams, -2, 0))
+
+	with open(outname, 'wb') as fp:
+		np.savez(fp, frequencies=frequencies, sparams=sparams, **meta)
+	#
+	return outname
+####
+
+def recorrect_raw_sweeps(fnames, cal_f, cal_terms, suffix='_cal', interp='magphase', workers=None):
+	''' Re-correct a whole archive of raw sweep files with a (different) calibration
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+		Usage:	files = glob.glob('./archive/*.npz')
+				recorrect_raw_sweeps(files, cal_f, cal_terms, workers=8)
+
+		Every file (written by save_raw_sweeps) is corrected in a pool of worker
+		processes, and written next to the original as <name><suffix>.npz, holding
+		'frequencies', 'sparams' ((..., 4, N) S11, S21, S12, S22) and any extra
+		arrays from the raw file.
+
+		IN:		fnames		-- list of raw sweep filepaths
+				cal_f		-- (M,) calibration frequencies, MHz
+				cal_terms	-- (12, M) complex error terms, in CALTERM_ORDER
+				suffix		-- (optional) appended to each output filename
+				interp		-- (optional) interpolation mode, see interpCALterms
+				workers		-- (optional) number of processes, default is one per CPU.
+							   0 processes the files serially, in this process.
+
+		OUT:	outnames	-- list of the written filepaths, in the order of fnames
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+	'''
+	import os
+	import numpy as np
+	import multiprocessing
+
+	cal_f = np.asarray(cal_f, dtype=np.float64)
+	cal_terms = np.asarray(cal_terms, dtype=np.complex128)
+
+	jobs = []
+	for fname in fnames:
+		root, ext = os.path.splitext(fname)
+		jobs += [[fname, root+suffix+'.npz']]
+	#
+
+	if workers==0:
+		_recorrect_init(cal_f, cal_terms, interp)
+		return [_recorrect_file(job) for job in jobs]
+	#
+	pool = multiprocessing.Pool(workers, initializer=_recorrect_init, initargs=(cal_f, cal_terms, interp))
+	try:
+		return pool.map(_recorrect_file, jobs)
+	finally:
+		pool.close()
+		pool.join()
+	#
+####
+
+def recorrect_archive(src_dir, dst_dir, cal_f, cal_terms, interp='magphase', prefix='sweeps_cal', chunk=256, capacity=None, **query):
+	''' Re-correct raw sweeps from a recorded sweep archive into a new archive
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+		Usage:	recorrect_archive('./run1', './run1-cal', cal_f, cal_terms,
+						serial=12, start=t0, stop=t0+300, fmin=2000, fmax=3000)
+
+		The sweeps are picked with VNA.archive.SweepArchive.select (so only the
+		segments and rows that match are read), corrected `chunk` sweeps at a
+		time, and recorded to dst_dir as S11, S21, S12, S22, keeping their
+		timestamps and unit serial numbers. Every corrected segment is kept,
+		however many sweeps are corrected.
+
+		IN:		src_dir		-- archive directory, as written by VNA.archive.SweepRecorder
+				dst_dir		-- directory for the corrected archive
+				cal_f		-- (M,) calibration frequencies, MHz
+				cal_terms	-- (12, M) complex error terms, in CALTERM_ORDER
+				interp		-- (optional) interpolation mode, see interpCALterms
+				prefix		-- (optional) recording name of the corrected archive
+				chunk		-- (optional) number of sweeps corrected at once
+				capacity	-- (optional) sweeps per corrected segment, defaults to
+							   VNA.archive.SEGMENT_CAPACITY
+				query		-- (optional) start, stop, serial, config, fmin, fmax,
+							   see SweepArchive.select
+
+		OUT:	count		-- number of sweeps corrected
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+	'''
+	import numpy as np
+	from . import archive
+
+	raw_paths = ('T1R1', 'T1R2', 'T2R1', 'T2R2', 'Ref')
+	cal_paths = ('S11', 'S21', 'S12', 'S22')
+
+	src = archive.SweepArchive(src_dir)
+	count = 0
+	if capacity is None:
+		capacity = archive.SEGMENT_CAPACITY
+	with archive.SweepRecorder(dst_dir, prefix=prefix, capacity=capacity, max_segments=None) as rec:
+		for part in src.select(**query):
+			if part.paths != raw_paths:
+				continue
+			#
+			terms = interpCALterms(cal_f, cal_terms, part.freqs, mode=interp)
+			config = rec.register_config(part.freqs, cal_paths)
+			sparams = np.empty((min(chunk, part.data.shape[0]), 4, part.freqs.shape[0]), dtype=np.complex128)
+			for lo in range(0, part.data.shape[0], chunk):
+				raw = part.data[lo:lo+chunk]
+				out = sparams[:raw.shape[0]]
+				applyCalibration_batch(terms, *np.moveaxis(raw, 1, 0), out=np.moveaxis(out, 1, 0))
+				for idx in range(raw.shape[0]):
+					rec.append(config, part.serials[lo+idx], out[idx], part.timestamps[lo+idx])
+				#
+				count += raw.shape[0]
+			#
+		#
+	#
+	return count
+####
+
+def read_cal_TDMS(tdms_filename, porttype='2-port', with_frequencies=False):
+	# with_frequencies also returns the channels' x-axis, as 'frequencies'
 	from nptdms import TdmsFile
 	tdms_file = TdmsFile(tdms_filename)
 
@@ -507,6 +1093,9 @@ def read_cal_TDMS(tdms_filename, porttype='2-port'):
 	for each in cal_paramsR.keys():
 		cal_params[each] = cal_paramsR[each] + 1j*cal_paramsI[each]
 	#
+	if with_frequencies:
+		cal_params['frequencies'] = bins
+	#
 
 	#from collections import namedtuple
 	#return namedtuple('GenericDict', cal_params.keys())(**cal_params)
@@ -525,39 +1114,118 @@ def interpData(x,y, x_new):
 	return interpolated
 ####
 
-def applyCalibration(calterms, freq, A, U, V, B, R, caltype='solt'):
+## Order of the error terms in the calterms tuple returned by generate_CALterms
+## (after the leading 'frequencies' array).
+CALTERM_ORDER_SOLT = ('EDF', 'EDR', 'ESF', 'ESR', 'ERF', 'ERR', 'EXF', 'EXR', 'ELF', 'ELR', 'ETF', 'ETR')
+
+## Maximum number of (calibration, frequency grid) pairs interpCALterms keeps.
+INTERP_CACHE_SIZE = 16
+
+## Shared by every thread calibrating sweeps, so only touched under _interp_lock.
+_interp_cache = _collections.OrderedDict()
+_interp_lock = _threading.Lock()
+
+def _interp_key(mode, frequencies, terms, freq):
+	# Identifies a resampling by the contents of its arrays (not their ids, which
+	# can be reused, and say nothing about in-place changes).
+	import hashlib
+	import numpy as np
+	digest = hashlib.sha1()
+	for arr in [frequencies, freq] + list(terms):
+		arr = np.ascontiguousarray(arr)
+		digest.update(("%s%s" % (arr.dtype.str, arr.shape)).encode('ascii'))
+		digest.update(arr)
+	#
+	return (mode, digest.hexdigest())
+####
+
+def interpCALterms(frequencies, terms, freq, mode='reim', cache=True):
+	''' Resample a set of calibration terms onto a new frequency grid, with caching
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+		Usage:	terms = interpCALterms(cal_f, cal_terms, vna.getFrequencies())
+				S = applyCalibration_batch(terms, *raw)
+
+		The spline fits are only computed the first time a given calibration is
+		resampled onto a given grid. The result is kept in a bounded (LRU) cache,
+		so calibrating a live stream of sweeps only costs the correction itself
+		(plus hashing the arrays, which is how calibrations and grids are told
+		apart). The cache is shared, and safe to use from several threads.
+
+		IN:		frequencies	-- (N,) frequencies the terms are defined at
+				terms		-- sequence of 12 (N,) complex arrays (or a (12, N) array)
+				freq		-- (M,) frequencies to resample onto
+				mode		-- (optional, str) what to interpolate
+								- 'reim'		real and imaginary parts
+								- 'magphase'	magnitude and unwrapped phase
+				cache		-- (optional, bool) use the interpolation cache
+
+		OUT:	terms		-- (12, M) complex array, read-only
+		~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+	'''
+	import numpy as np
+
+	freq = np.asarray(freq, dtype=np.float64)
+	if cache:
+		key = _interp_key(mode, frequencies, terms, freq)
+		with _interp_lock:
+			out = _interp_cache.pop(key, None)
+			if out is not None:
+				_interp_cache[key] = out # mark as most recently used
+				return out
+			#
+		#
+	#
+
+	out = np.empty((len(terms), freq.shape[0]), dtype=np.complex128)
+	for idx, term in enumerate(terms):
+		if mode=='reim':
+			out[idx].real = interpData(frequencies, np.real(term), freq)
+			out[idx].imag = interpData(frequencies, np.imag(term), freq)
+		elif mode=='magphase':
+			mag = interpData(frequencies, np.abs(term), freq)
+			phase = interpData(frequencies, np.unwrap(np.angle(term)), freq)
+			out[idx] = mag*np.exp(1j*phase)
+		else:
+			raise ValueError('Unknown interpolation mode "%s"' % mode)
+		#
+	#
+	out.flags.writeable = False
+
+	if cache:
+		with _interp_lock:
+			_interp_cache[key] = out
+			while len(_interp_cache) > INTERP_CACHE_SIZE:
+				_interp_cache.popitem(last=False)
+			#
+		#
+	#
+	return out
+####
+
+def clear_interp_cache():
+	''' Drop every resampled calibration kept by interpCALterms.
+	'''
+	with _interp_lock:
+		_interp_cache.clear()
+	#
+####
+
+def applyCalibration(calterms, freq, A, U, V, B, R, caltype='solt', interp='reim'):
 	import numpy as np
 	from collections import namedtuple
 	calibrated_params = namedtuple('calibrated_params', 'S11, S21, S12, S22')
 
 	if caltype.lower()=='solt':
-		[frequencies, EDF, EDR, ESF, ESR, ERF, ERR, EXF, EXR, ELF, ELR, ETF, ETR] = calterms
+		frequencies = calterms[0]
 
 		# if length of A/U/V/B is different than that of frequencies, then perform interpolation!
-		#hint: interpolate using mag/phase separately, then convert back to real+1j*imag!
+		# ('interp' selects real/imag or mag/phase interpolation, see interpCALterms)
 
 		t = [A.shape, U.shape, V.shape, B.shape, R.shape, freq.shape]
 		if len(set(t))==1: # then input lengths are the same
-
-			#if freq==frequencies:
-			#	# good to go!
-			#	pass
-			#	# but, interpolate for the hell of it!
-			#else:
-			#	# perform interpolation
-			#	pass
-			##
-
-			cal_interpolated = []
-			cal_interpolated += [freq]
-			for term in calterms[1:]: # skip 'frequencies' array
-				term_Real_interp = interpData(frequencies, np.real(term), freq)
-				term_Imag_interp = interpData(frequencies, np.imag(term), freq)
-
-				term_interpolated = term_Real_interp + 1j*term_Imag_interp
-				cal_interpolated += [term_interpolated]
-			#
-			[frequencies, EDF, EDR, ESF, ESR, ERF, ERR, EXF, EXR, ELF, ELR, ETF, ETR] = cal_interpolated
+			# reorder to CALTERM_ORDER (just references, no copies)
+			terms = [calterms[1 + CALTERM_ORDER_SOLT.index(name)] for name in CALTERM_ORDER]
+			terms = interpCALterms(frequencies, terms, freq, mode=interp)
 
 		else:
 			print('Input signals are not of the same shape.')
@@ -566,25 +1234,10 @@ def applyCalibration(calterms, freq, A, U, V, B, R, caltype='solt'):
 		#
 
 		# the assumption is that all 4 paths are measured.
-		S11M = A/R;
-		S21M = U/R;
-		S12M = V/R;
-		S22M = B/R;
-
-		S11N = (S11M - EDF)/ERF;
-		S21N = (S21M - EXF)/ETF;
-		S12N = (S12M - EXR)/ETR;
-		S22N = (S22M - EDR)/ERR;
-
-		D = (S11N*ESF + 1)*(S22N*ESR + 1) - ELF*ELR*S21N*S12N;
-
-		S11 = (S11N*(S22N*ESR + 1) - ELF*S21N*S12N) / D;
-		S21 = S21N*(S22N*(ESR - ELF) + 1) / D;
-		S12 = S12N*(S11N*(ESF - ELR) + 1) / D;
-		S22 = (S22N*(S11N*ESF + 1) - ELR*S21N*S12N) / D;
+		[S11, S21, S12, S22] = applyCalibration_batch(terms, A, U, V, B, R)
 	#
 
-	return calibrated_params(S11, S21, S12, S21)
+	return calibrated_params(S11, S21, S12, S22)
 ####
 
 def compare_cal(cald, calibration, tdms_filename='/home/abhe/3dsims/VNA/8.18_vnaCAL/cal.tdms', savepath=None):
@@ -0,0 +1,411 @@
+################################################################################
+#### fleet.py		--	Concurrent acquisition from many VNA units			####
+####																		####
+####	Runs sweeps from a set of `VNA` instances on a bounded pool			####
+####	of worker threads, with per-unit sweep streams, aggregate			####
+####	throughput statistics and per-unit failure isolation.				####
+####																		####
+################################################################################
+from . import vnalibrary as vna
+from . import vnaclass
+from . import vnaexceptions
+import collections
+import logging
+import threading
+import time
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+##
+#  \addtogroup Python-Fleet-API
+#
+#  \section fleet-api-brief Multi-unit acquisition
+#
+#  A \ref Fleet owns a set of (already connected and started) VNA objects, and
+#  keeps each of them measuring continuously, using at most `workers` threads in
+#  total. Each unit has at most one measurement in flight at a time, and a small
+#  ring of preallocated buffers, so acquisition on a unit only stalls when its
+#  consumer falls behind by more than `depth` sweeps.
+#
+#  Sweeps can either be consumed per unit with \ref Fleet.stream(), or handed to a
+#  callback on the worker thread as they complete.
+#
+#  A unit that raises (or exceeds `sweep_timeout`, \ref SWEEP_TIMEOUT by default, in
+#  which case it is interrupted) is marked as failed and stops being scheduled. The
+#  other units are unaffected.
+#
+#      units = {"bench-1" : VNA.VNA("192.168.1.207", 1026),
+#               "bench-2" : VNA.VNA("192.168.1.208", 1026)}
+#      for unit in units.values():
+#          unit.set_config(VNA.HOP_45K, VNA.ATTEN_0, freq=(375, 6000, 1024))
+#          unit.start()
+#
+#      with VNA.fleet.Fleet(units, workers=4) as fleet:
+#          for sweep in fleet.stream("bench-1", count=100):
+#              process(sweep.data)
+#          print(fleet.stats().rate)
+#
+#  Units can be brought up concurrently with \ref connect():
+#
+#      units = VNA.fleet.connect([("192.168.1.207", 1026), ("192.168.1.208", 1026)])
+#      print("Failed:", units.failed)
+#      fleet = VNA.fleet.Fleet(units.ready)
+#
+#  @{
+#
+
+## Default number of seconds a measurement may take before its unit is interrupted and failed
+SWEEP_TIMEOUT = 10.0
+
+## Return value of \ref connect()
+Connect_Return = collections.namedtuple("Connect_Return", ['ready', 'failed'])
+
+## Return value of \ref Fleet.stats()
+Fleet_Stats = collections.namedtuple("Fleet_Stats", ['sweeps', 'elapsed', 'rate', 'per_unit', 'failed'])
+
+
+def connect(addresses, workers=None, progress=None, **kwargs):
+	''' Connect to and initialize many units concurrently.
+
+		Each unit is brought up by constructing a \ref VNA::vnaclass::VNA (set IP and
+		port, `initialize()`, ping and download the hardware details), on a pool of
+		threads. Since that is dominated by waiting on the network, bringing up a
+		fleet takes roughly as long as the slowest unit, rather than the sum of all
+		of them.
+
+		A unit that does not respond fails with the DLL's communication timeout
+		(see \ref VNA::vnalibrary::RAW_VNA.setTimeout()), and does not affect the others.
+
+		Args:
+			addresses	-- Either a dict of `{name : (ip, port)}`, or a sequence of `(ip, port)`
+			               tuples, which are then named `"ip:port"`.
+			workers		-- (int) Maximum number of units to initialize at once. Defaults to all of them.
+			progress	-- Optional `progress(name, completed, total, error)`, called as each unit
+			               finishes. `error` is `None` if the unit came up. Calls are serialized,
+			               but are made from the worker threads.
+			kwargs		-- Passed through to the \ref VNA::vnaclass::VNA constructor. If units are named,
+			               `vna_no` defaults to the name.
+
+		Returns:
+			`Connect_Return(ready, failed)`. `ready` is an ordered dict of `{name : VNA}` for the units
+			that came up, in the order they were specified, and `failed` is a dict of
+			`{name : exception}` for the ones that did not.
+	'''
+	named = isinstance(addresses, dict)
+	if not named:
+		addresses = collections.OrderedDict(("%s:%s" % tuple(addr), addr) for addr in addresses)
+
+	log     = logging.getLogger("Main.VNA-Fleet")
+	total   = len(addresses)
+	pending = queue.Queue()
+	for item in addresses.items():
+		pending.put(item)
+
+	results = {}
+	lock    = threading.Lock()
+
+	def worker():
+		while True:
+			try:
+				name, (device_ip, device_ip_port) = pending.get_nowait()
+			except queue.Empty:
+				return
+
+			unit_kwargs = dict(kwargs)
+			if named:
+				unit_kwargs.setdefault("vna_no", name)
+
+			unit, error = None, None
+			try:
+				unit = vnaclass.VNA(device_ip, device_ip_port, **unit_kwargs)
+			except Exception as e:
+				error = e
+				log.error("Failed to bring up unit %s (%s:%s): %s", name, device_ip, device_ip_port, e)
+
+			with lock:
+				results[name] = (unit, error)
+				if progress:
+					try:
+						progress(name, len(results), total, error)
+					except Exception as e:
+						log.error("Connect progress callback raised: %s", e)
+
+	threads = [threading.Thread(target=worker, name="VNA-Connect-%s" % num) for num in range(min(workers or total, total))]
+	for thread in threads:
+		thread.daemon = True
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	ready  = collections.OrderedDict((name, results[name][0]) for name in addresses if results[name][1] is None)
+	failed = dict((name, results[name][1]) for name in addresses if results[name][1] is not None)
+	return Connect_Return(ready, failed)
+
+
+class FleetUnit(object):
+	''' Scheduling state of one VNA within a \ref Fleet.
+	'''
+	def __init__(self, name, vna_dev, calibrated, depth):
+		self.name = name
+		self.vna  = vna_dev
+
+		if calibrated:
+			self.paths   = vnaclass.CAL_PATHS
+			self.measure = vna_dev.measure2PortCalibratedArray
+		else:
+			self.paths   = vnaclass.UNCAL_PATHS
+			self.measure = vna_dev.measureUncalibratedArray
+
+		npts = vna_dev.getNumberOfFrequencies()
+		self.buffers = [vna.SweepBuffer(len(self.paths), npts) for dummy in range(depth)]
+		self.free    = collections.deque(range(depth))
+		self.ready   = queue.Queue()
+		self.held    = None
+
+		self.lock      = threading.Lock()
+		self.scheduled = False
+		self.started   = None
+		self.timed_out = False
+		self.sweeps    = 0
+		self.error     = None
+
+	def sweep(self, seq, timestamp, idx):
+		return vnaclass.Stream_Return(seq, timestamp, self.buffers[idx].data, self.paths)
+
+
+class Fleet(object):
+	''' Bounded worker pool that keeps a set of VNA units acquiring concurrently.
+	'''
+
+	def __init__(self, units, workers=8, calibrated=False, depth=2, sweep_timeout=SWEEP_TIMEOUT, callback=None):
+		''' Set up (but do not start) acquisition from a set of units.
+
+			Every unit must be connected, configured and started (see
+			\ref VNA::vnaclass::VNA.start()) before \ref start() is called, and must
+			not be reconfigured while the fleet is running.
+
+			Args:
+				units			-- Either a dict of `{name : VNA}`, or a sequence of VNA objects, which
+				                   are then named by their `"ip:port"`.
+				workers			-- (int) Maximum number of measurements in flight at once, across all units.
+				calibrated		-- (bool) Measure S-parameters with the DLL calibration rather than the raw paths.
+				depth			-- (int) Number of sweep buffers per unit.
+				sweep_timeout	-- (float) Number of seconds after which a measurement is interrupted,
+				                   and its unit marked as failed. None disables the watchdog, so a
+				                   hung unit keeps a worker busy indefinitely.
+				callback		-- Optional `callback(name, sweep)`, called on the worker thread for
+				                   every completed sweep. The sweep data is only valid for the duration
+				                   of the call. If set, \ref stream() and \ref get() are not used.
+		'''
+		if not isinstance(units, dict):
+			units = collections.OrderedDict(("%s:%s" % (unit.getIPAddress(), unit.getIPPort()), unit) for unit in units)
+
+		self.log = logging.getLogger("Main.VNA-Fleet")
+
+		self.units = collections.OrderedDict(
+				(name, FleetUnit(name, vna_dev, calibrated, depth)) for name, vna_dev in units.items()
+			)
+		self.callback      = callback
+		self.sweep_timeout = sweep_timeout
+
+		self.__jobs    = queue.Queue()
+		self.__halt    = threading.Event()
+		self.__workers = [threading.Thread(target=self.__worker, name="VNA-Fleet-%s" % num) for num in range(workers)]
+		for thread in self.__workers:
+			thread.daemon = True
+		self.__watchdog = None
+		if sweep_timeout is not None:
+			self.__watchdog = threading.Thread(target=self.__watch, name="VNA-Fleet-Watchdog")
+			self.__watchdog.daemon = True
+
+		self.__count_lock = threading.Lock()
+		self.__sweeps     = 0
+		self.__start_time = None
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def start(self):
+		''' Start the worker threads, and begin acquiring from every unit.
+		'''
+		self.__start_time = time.time()
+		for thread in self.__workers:
+			thread.start()
+		if self.__watchdog:
+			self.__watchdog.start()
+		for unit in self.units.values():
+			self.__schedule(unit)
+
+	def close(self):
+		''' Stop acquisition, interrupting any measurements that are in flight.
+
+			The units themselves are left in the TASK_STARTED state.
+		'''
+		self.__halt.set()
+		for dummy in self.__workers:
+			self.__jobs.put(None)
+
+		for thread in self.__workers:
+			while thread.is_alive():
+				for unit in self.units.values():
+					if unit.started is not None:
+						self.__interrupt(unit)
+				thread.join(0.05)
+		if self.__watchdog and self.__watchdog.is_alive():
+			self.__watchdog.join()
+
+	def __schedule(self, unit):
+		with unit.lock:
+			if self.__halt.is_set() or unit.error or unit.scheduled or not unit.free:
+				return
+			unit.scheduled = True
+		self.__jobs.put(unit)
+
+	def __interrupt(self, unit):
+		try:
+			unit.vna.interruptMeasurement()
+		except vnaexceptions.VNA_Exception:
+			pass
+
+	def __fail(self, unit, error):
+		self.log.error("Unit %s failed: %s", unit.name, error)
+		with unit.lock:
+			unit.error     = error
+			unit.scheduled = False
+		unit.ready.put(("error", error))
+
+	def __worker(self):
+		while True:
+			unit = self.__jobs.get()
+			if unit is None or self.__halt.is_set():
+				return
+
+			with unit.lock:
+				idx = unit.free.popleft()
+				unit.started   = time.time()
+				unit.timed_out = False
+			try:
+				unit.measure(unit.buffers[idx])
+			except Exception as e:
+				with unit.lock:
+					unit.started = None
+					timed_out    = unit.timed_out
+					unit.free.appendleft(idx)
+				if self.__halt.is_set():
+					return
+				if isinstance(e, vnaexceptions.VNA_Exception_Interrupted) and timed_out:
+					e = vnaexceptions.VNA_Exception_No_Response("Measurement exceeded sweep timeout of %s seconds" % self.sweep_timeout)
+				self.__fail(unit, e)
+				continue
+
+			timestamp = time.time()
+			with unit.lock:
+				unit.started   = None
+				unit.scheduled = False
+				seq = unit.sweeps
+				unit.sweeps += 1
+			with self.__count_lock:
+				self.__sweeps += 1
+
+			if self.callback:
+				try:
+					self.callback(unit.name, unit.sweep(seq, timestamp, idx))
+				except Exception as e:
+					self.log.error("Sweep callback for unit %s raised: %s", unit.name, e)
+				with unit.lock:
+					unit.free.append(idx)
+			else:
+				unit.ready.put(("sweep", (seq, timestamp, idx)))
+			self.__schedule(unit)
+
+	def __watch(self):
+		while not self.__halt.wait(min(self.sweep_timeout / 4.0, 0.5)):
+			now = time.time()
+			for unit in self.units.values():
+				# Checked and interrupted under the lock, so a sweep finishing in between
+				# can't hand the interrupt on to the unit's next measurement.
+				with unit.lock:
+					started = unit.started
+					if started is None or now - started <= self.sweep_timeout:
+						continue
+					self.log.warning("Unit %s has been measuring for %0.1f seconds. Interrupting.", unit.name, now - started)
+					unit.timed_out = True
+					self.__interrupt(unit)
+
+	def get(self, name, timeout=None):
+		''' Return the next sweep from unit `name`, blocking until it is available.
+
+			The buffer of the sweep previously returned for this unit is recycled
+			by this call, so that sweep's data must not be used afterwards.
+
+			Args:
+				name		-- Name of the unit.
+				timeout		-- (float) Optional maximum number of seconds to wait.
+
+			Returns:
+				\ref VNA::vnaclass::Stream_Return for the unit.
+
+			Raises:
+				The exception that made the unit fail, if it has failed. `queue.Empty`
+				if `timeout` expires.
+		'''
+		unit = self.units[name]
+		if unit.held is not None:
+			with unit.lock:
+				unit.free.append(unit.held)
+			unit.held = None
+			self.__schedule(unit)
+
+		kind, value = unit.ready.get(timeout=timeout)
+		if kind == "error":
+			# Leave it in place, so subsequent calls also see the failure.
+			unit.ready.put((kind, value))
+			raise value
+
+		seq, timestamp, idx = value
+		unit.held = idx
+		return unit.sweep(seq, timestamp, idx)
+
+	def stream(self, name, count=None, timeout=None):
+		''' Iterate over the sweeps of one unit. See \ref get().
+
+			Args:
+				name		-- Name of the unit.
+				count		-- (int) Optional number of sweeps to return.
+				timeout		-- (float) Optional maximum number of seconds to wait for each sweep.
+		'''
+		received = 0
+		while count is None or received < count:
+			yield self.get(name, timeout=timeout)
+			received += 1
+
+	def failed(self):
+		''' Returns:
+				dict of `{name : exception}` for every unit that has failed.
+		'''
+		return dict((name, unit.error) for name, unit in self.units.items() if unit.error is not None)
+
+	def stats(self):
+		''' Aggregate acquisition statistics.
+
+			Returns:
+				`Fleet_Stats(sweeps, elapsed, rate, per_unit, failed)`, where `rate` is the
+				aggregate sweeps per second since \ref start(), and `per_unit` is a dict of
+				`{name : sweeps}`.
+		'''
+		elapsed = time.time() - self.__start_time if self.__start_time else 0.0
+		with self.__count_lock:
+			sweeps = self.__sweeps
+		rate = sweeps / elapsed if elapsed > 0 else 0.0
+		per_unit = dict((name, unit.sweeps) for name, unit in self.units.items())
+		return Fleet_Stats(sweeps, elapsed, rate, per_unit, sorted(self.failed()))
+
+
+# end doxygen block
+## @}
@@ -0,0 +1,244 @@
+################################################################################
+#### vnaasync.py	--	asyncio front-end for the VNA interface				####
+####																		####
+####	Runs the blocking DLL calls on a managed thread-pool, so a			####
+####	single event loop can drive many units at once.					####
+####																		####
+####	Requires Python 3.7 or later.										####
+####																		####
+################################################################################
+import asyncio
+import concurrent.futures
+import functools
+import threading
+import time
+
+from . import vnalibrary as vna
+from . import vnaclass
+from . import vnaexceptions
+
+##
+#  \addtogroup Python-Async-API
+#
+#  \section async-api-brief asyncio VNA API Interface
+#
+#  \ref AsyncVNA wraps a \ref VNA::vnaclass::VNA (or \ref VNA::vnalibrary::RAW_VNA)
+#  instance. Every method of the wrapped object is available as a coroutine,
+#  which executes the underlying (blocking) call on a shared thread-pool:
+#
+#      dev = await AsyncVNA.connect("192.168.1.207", 1026)
+#      await dev.set_config(VNA.HOP_45K, VNA.ATTEN_0, freq=(375, 6000, 1024))
+#      await dev.start()
+#
+#      async for sweep in dev.sweeps(calibrated=False):
+#          process(sweep.data)
+#
+#  Calls to a single unit are serialized (the DLL task is not re-entrant), while
+#  calls to different units run concurrently. Cancelling a coroutine that is
+#  blocked in one of the measurement functions calls `interruptMeasurement()`
+#  on the unit, and waits for the measurement call to return before the
+#  cancellation propagates, so the unit is always left idle and usable.
+#
+#  @{
+#
+
+## Default number of threads in the shared executor. This bounds the number of
+## blocking DLL calls that can be in flight at once, across all units.
+DEFAULT_WORKERS = 32
+
+## Methods that block waiting on sweep data, and can therefore be aborted with
+## `interruptMeasurement()`.
+INTERRUPTIBLE = frozenset([
+	'measureUncalibrated',
+	'measureUncalibratedArray',
+	'measure2PortCalibrated',
+	'measure2PortCalibratedArray',
+	'measureCalibrationStep',
+	'measure_uncal',
+	'measure_cal',
+	'measure_batch',
+])
+
+_executor      = None
+_executor_lock = threading.Lock()
+
+def default_executor():
+	''' Return the process-wide executor that \ref AsyncVNA instances share
+	by default, creating it on first use.
+	'''
+	global _executor
+	with _executor_lock:
+		if _executor is None:
+			_executor = concurrent.futures.ThreadPoolExecutor(max_workers=DEFAULT_WORKERS, thread_name_prefix="VNA-Async")
+		return _executor
+
+
+class AsyncVNA(object):
+	''' asyncio wrapper around a single VNA task.
+
+		Any method of the wrapped device can be awaited through this object (e.g.
+		`await dev.getFrequencies()`). The wrapped device is available as `dev.vna`
+		for anything that should not go through the executor.
+	'''
+
+	def __init__(self, vna_dev, executor=None):
+		''' Wrap an existing VNA object.
+
+			Args:
+				vna_dev		-- \ref VNA::vnaclass::VNA or \ref VNA::vnalibrary::RAW_VNA instance.
+				executor	-- `concurrent.futures.Executor` to run the blocking calls on.
+				               Defaults to the shared executor from \ref default_executor().
+		'''
+		self.vna      = vna_dev
+		self.executor = executor if executor is not None else default_executor()
+		self.__lock   = None
+
+	@classmethod
+	async def connect(cls, device_ip, device_ip_port, executor=None, **kwargs):
+		''' Create, connect to and initialize a \ref VNA::vnaclass::VNA on the executor.
+
+			Args:
+				device_ip		-- (str) IP address of the unit.
+				device_ip_port	-- (int) Port of the unit.
+				executor		-- Optional executor, see \ref AsyncVNA.__init__().
+				kwargs			-- Passed through to the \ref VNA::vnaclass::VNA constructor.
+
+			Returns:
+				\ref AsyncVNA instance wrapping the connected unit.
+		'''
+		executor = executor if executor is not None else default_executor()
+		loop = asyncio.get_running_loop()
+		dev = await loop.run_in_executor(executor, functools.partial(vnaclass.VNA, device_ip, device_ip_port, **kwargs))
+		return cls(dev, executor=executor)
+
+	def __getattr__(self, name):
+		if name == "vna":
+			raise AttributeError(name)
+		func = getattr(self.vna, name)
+		if not callable(func):
+			return func
+
+		interruptible = name in INTERRUPTIBLE
+
+		@functools.wraps(func)
+		async def wrapper(*args, **kwargs):
+			return await self.call(func, *args, interruptible=interruptible, **kwargs)
+		return wrapper
+
+	def __repr__(self):
+		return "<AsyncVNA wrapping %r>" % (self.vna, )
+
+	def interrupt(self):
+		''' Interrupt a measurement in flight on this unit, if there is one.
+
+			This does not go through the executor, so it is effective even when
+			every executor thread is busy.
+		'''
+		try:
+			self.vna.interruptMeasurement()
+		except vnaexceptions.VNA_Exception:
+			pass
+
+	async def interruptMeasurement(self):
+		''' Awaitable form of \ref interrupt().
+
+			The measurement being interrupted holds this unit's lock, so this must not
+			go through \ref call() like the other wrapped methods.
+		'''
+		self.interrupt()
+
+	async def call(self, func, *args, interruptible=False, **kwargs):
+		''' Run a blocking callable on the executor, holding this unit's lock.
+
+			If the calling task is cancelled, the unit is interrupted (if
+			`interruptible` is set), and the cancellation is only propagated once
+			`func` has returned.
+
+			Args:
+				func			-- Callable to run.
+				args			-- Positional arguments for `func`.
+				interruptible	-- (bool) Cancel by calling `interruptMeasurement()`.
+				kwargs			-- Keyword arguments for `func`.
+
+			Returns:
+				Return value of `func`.
+		'''
+		# Created lazily, so the lock binds to the loop that actually uses it.
+		if self.__lock is None:
+			self.__lock = asyncio.Lock()
+
+		async with self.__lock:
+			loop = asyncio.get_running_loop()
+			fut = loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+			try:
+				return await asyncio.shield(fut)
+			except asyncio.CancelledError:
+				# The call may still be queued when the cancel arrives, so keep
+				# interrupting until it has actually returned.
+				while not fut.done():
+					if interruptible:
+						self.interrupt()
+					await asyncio.wait([fut], timeout=0.05)
+				if not fut.cancelled():
+					fut.exception()
+				raise
+
+	async def sweeps(self, calibrated=False, count=None, depth=2):
+		''' Asynchronously iterate over sweeps from this unit.
+
+			The next measurement is started before the current sweep is yielded, so
+			acquisition overlaps with whatever the consumer does with the data. Sweep
+			data lives in a ring of `depth` preallocated buffers, and is only valid
+			until the next sweep is requested.
+
+			Closing the generator (or cancelling the task iterating over it)
+			interrupts the measurement in flight.
+
+			The task must already be started.
+
+			Args:
+				calibrated	-- (bool) Measure S-parameters with the DLL calibration
+				                    rather than the raw paths.
+				count		-- (int) Optional number of sweeps to acquire. Unlimited if not specified.
+				depth		-- (int) Number of buffers in the ring (>= 2).
+
+			Yields:
+				\ref VNA::vnaclass::Stream_Return items, as \ref VNA::vnaclass::VNA.stream() does.
+		'''
+		assert depth >= 2, "Overlapped acquisition needs at least two buffers!"
+		if calibrated:
+			paths   = vnaclass.CAL_PATHS
+			measure = self.vna.measure2PortCalibratedArray
+		else:
+			paths   = vnaclass.UNCAL_PATHS
+			measure = self.vna.measureUncalibratedArray
+
+		npts = await self.getNumberOfFrequencies()
+		buffers = [vna.SweepBuffer(len(paths), npts) for dummy in range(depth)]
+
+		def acquire(seq):
+			if count is not None and seq >= count:
+				return None
+			return asyncio.ensure_future(self.call(measure, buffers[seq % depth], interruptible=True))
+
+		seq = 0
+		pending = acquire(seq)
+		try:
+			while pending is not None:
+				await pending
+				timestamp = time.time()
+				current   = buffers[seq % depth]
+				pending   = acquire(seq + 1)
+				yield vnaclass.Stream_Return(seq, timestamp, current.data, paths)
+				seq += 1
+		finally:
+			if pending is not None:
+				pending.cancel()
+				try:
+					await pending
+				except (asyncio.CancelledError, vnaexceptions.VNA_Exception):
+					pass
+
+
+# end doxygen block
+## @}
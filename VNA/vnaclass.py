@@ -9,10 +9,21 @@
 ################################################################################
 from . import vnalibrary as vna
 from . import vnaexceptions
+from . import calutil
+from . import calfile
 import collections
-import pickle
+import hashlib
+import numpy as np
 import time
 import logging
+import itertools
+import os
+import threading
+import zipfile
+try:
+	import queue
+except ImportError:
+	import Queue as queue
 
 ##
 #  \addtogroup Python-OOP-API
@@ -29,6 +40,251 @@ import logging
 #  @{
 #
 
+## Names of the rows returned by \ref VNA.measure_uncal(), in order.
+UNCAL_PATHS = ('T1R1', 'T1R2', 'T2R1', 'T2R2', 'Ref')
+## Names of the rows returned by \ref VNA.measure_cal(), in order.
+CAL_PATHS   = ('S11', 'S21', 'S12', 'S22')
+
+Uncal_Scan_Return = collections.namedtuple("Scan_Return", UNCAL_PATHS)
+Cal_Scan_Return   = collections.namedtuple("Scan_Return", CAL_PATHS)
+
+## Return value of \ref VNA.measure_softcal()
+SoftCal_Return = collections.namedtuple("SoftCal_Return", ['raw', 'sparams'])
+
+## Return value of \ref VNA.measure_batch()
+Batch_Return = collections.namedtuple("Batch_Return", ['data', 'timestamps', 'paths'])
+
+## Directory \ref VNA.load_factory_cal() caches factory calibrations in. Can be overridden
+## with the `VNA_CAL_CACHE` environment variable.
+CAL_CACHE_DIR = os.environ.get("VNA_CAL_CACHE", os.path.join(os.path.expanduser("~"), ".openvna", "cal-cache"))
+
+## Bumped whenever the layout of the factory calibration cache files changes.
+CAL_CACHE_VERSION = 1
+
+## Hardware detail keys that must match between the cache and the connected unit.
+CAL_CACHE_HW_KEYS = ('serial_number', 'minimum_frequency', 'maximum_frequency', 'maximum_points', 'band_boundaries')
+
+def factory_cal_cache_path(serial_number, cache_dir=None):
+	''' Path of the cached factory calibration for the unit with serial number `serial_number`.
+	'''
+	return os.path.join(cache_dir or CAL_CACHE_DIR, "factory-cal-%s.npz" % serial_number)
+
+## Default number of calibrations a \ref CalLibrary holds before the least recently
+## used one is dropped.
+CAL_LIBRARY_SIZE = 16
+
+def sweep_plan(hoprate, attenuation, freqs):
+	''' Hashable key identifying a sweep configuration, for \ref CalLibrary lookups.
+
+		Args:
+			hoprate		-- (vna.HOP_x) Hop-rate of the sweep.
+			attenuation	-- (vna.ATTEN_x) Tx attenuation of the sweep.
+			freqs		-- Frequency points of the sweep, in MHz.
+
+		Returns:
+			`(hoprate, attenuation, points, digest)` tuple, where `digest` is a hash
+			of the frequency points.
+	'''
+	freqs = np.ascontiguousarray(freqs, dtype=np.float64)
+	return (int(hoprate), int(attenuation), freqs.shape[0], hashlib.sha1(freqs.tobytes()).hexdigest())
+
+## Entry held by a \ref CalLibrary. `freqs` is a float64 array and `terms` a 12 path
+## \ref VNA::vnalibrary::SweepBuffer, both ready to hand to `importCalibrationArray()`.
+CalLibrary_Entry = collections.namedtuple("CalLibrary_Entry", ['freqs', 'terms'])
+
+class CalLibrary(object):
+	''' In-memory set of calibrations, keyed by unit serial number and \ref sweep_plan().
+
+		Entries are converted to the layout the DLL imports from when they are added,
+		so activating one is a single `importCalibrationArray()` call. Once more than
+		`max_entries` calibrations are held, the least recently used one is dropped.
+
+		A library can be shared by any number of \ref VNA instances (and threads).
+	'''
+
+	def __init__(self, max_entries=CAL_LIBRARY_SIZE):
+		assert max_entries > 0, "The calibration library must be able to hold at least one entry!"
+		self.max_entries = max_entries
+		self.__entries   = collections.OrderedDict()
+		self.__lock      = threading.Lock()
+
+	def __len__(self):
+		with self.__lock:
+			return len(self.__entries)
+
+	def __contains__(self, key):
+		with self.__lock:
+			return key in self.__entries
+
+	def keys(self):
+		''' `(serial_number, plan)` keys currently held, least recently used first.
+		'''
+		with self.__lock:
+			return list(self.__entries.keys())
+
+	def add(self, serial_number, plan, freqs, terms):
+		''' Add (or replace) the calibration for `serial_number` and `plan`.
+
+			Args:
+				serial_number	-- Serial number of the unit the calibration belongs to.
+				plan			-- Sweep plan, from \ref sweep_plan().
+				freqs			-- `N` calibration frequencies, in MHz.
+				terms			-- `(12, N)` complex error terms (or a 12 path \ref VNA::vnalibrary::SweepBuffer),
+				                   in \ref exportCalibration() order.
+		'''
+		freqs = np.array(freqs, dtype=np.float64)
+		if isinstance(terms, vna.SweepBuffer):
+			terms = terms.data
+		buf = vna.SweepBuffer(12, freqs.shape[0])
+		buf.load(terms)
+		buf.pack()
+
+		key = (serial_number, plan)
+		with self.__lock:
+			self.__entries.pop(key, None)
+			self.__entries[key] = CalLibrary_Entry(freqs, buf)
+			while len(self.__entries) > self.max_entries:
+				self.__entries.popitem(last=False)
+
+	def get(self, serial_number, plan):
+		''' Look up the calibration for `serial_number` and `plan`, marking it as recently used.
+
+			Returns:
+				\ref CalLibrary_Entry, or None if there isn't one.
+		'''
+		key = (serial_number, plan)
+		with self.__lock:
+			entry = self.__entries.pop(key, None)
+			if entry is not None:
+				self.__entries[key] = entry
+			return entry
+
+	def discard(self, serial_number, plan=None):
+		''' Drop the calibration for `serial_number` and `plan`, or every calibration
+			for `serial_number` if `plan` is not specified.
+		'''
+		with self.__lock:
+			for key in list(self.__entries.keys()):
+				if key[0] == serial_number and (plan is None or key[1] == plan):
+					del self.__entries[key]
+
+	def clear(self):
+		with self.__lock:
+			self.__entries.clear()
+
+## Library \ref VNA instances use unless they are given another one.
+CAL_LIBRARY = CalLibrary()
+
+## Item yielded by \ref VNA.stream()
+Stream_Return = collections.namedtuple("Stream_Return", ['sequence', 'timestamp', 'data', 'paths'])
+
+
+class SweepStream(object):
+	''' Background acquisition worker with a small ring of reusable sweep buffers.
+
+		A dedicated thread keeps measuring into whichever buffers the consumer is
+		not currently holding, so the next sweep is already in flight while the
+		previous one is being processed. The consumer holds at most one buffer at
+		a time. It is handed back to the worker on the next \ref get() call.
+
+		Normally used through \ref VNA.stream(), rather than directly.
+	'''
+
+	def __init__(self, vna_dev, calibrated=False, depth=3, count=None):
+		''' Set up (but do not start) the acquisition worker.
+
+			Args:
+				vna_dev		-- Started \ref VNA (or \ref RAW_VNA) instance to measure from.
+				calibrated	-- (bool) Measure calibrated S-parameters rather than raw paths.
+				depth		-- (int) Number of buffers in the ring. Must be at least 2 for
+				                   acquisition to overlap with processing.
+				count		-- (int) Optional number of sweeps after which the worker stops.
+		'''
+		assert depth >= 2, "A sweep stream needs at least two buffers!"
+		self.vna        = vna_dev
+		self.calibrated = calibrated
+		self.count      = count
+
+		if calibrated:
+			self.paths   = CAL_PATHS
+			self.measure = vna_dev.measure2PortCalibratedArray
+		else:
+			self.paths   = UNCAL_PATHS
+			self.measure = vna_dev.measureUncalibratedArray
+
+		npts = vna_dev.getNumberOfFrequencies()
+		self.buffers = [vna.SweepBuffer(len(self.paths), npts) for dummy in range(depth)]
+
+		self.free  = queue.Queue()
+		self.ready = queue.Queue()
+		for idx in range(depth):
+			self.free.put(idx)
+
+		self.held   = None
+		self.halt   = threading.Event()
+		self.thread = threading.Thread(target=self.__worker, name="VNA-Stream")
+		self.thread.daemon = True
+
+	def start(self):
+		self.thread.start()
+
+	def __worker(self):
+		sequences = itertools.count() if self.count is None else range(self.count)
+		for seq in sequences:
+			idx = self.free.get()
+			if idx is None or self.halt.is_set():
+				break
+			try:
+				self.measure(self.buffers[idx])
+			except Exception as e:
+				if self.halt.is_set():
+					break
+				self.ready.put(("error", e))
+				return
+			self.ready.put(("sweep", (seq, time.time(), idx)))
+		self.ready.put(("done", None))
+
+	def get(self):
+		''' Return the next measured sweep, blocking until it is available.
+
+			The previously returned sweep's buffer is recycled by this call, so its
+			data must not be used afterwards (copy it if it needs to be kept).
+
+			Returns:
+				`Stream_Return(sequence, timestamp, data, paths)`, where `data` is a
+				`(paths, N)` complex array.
+
+			Raises:
+				StopIteration once `count` sweeps have been returned. Any exception
+				raised by the measurement in the worker thread is re-raised here.
+		'''
+		if self.held is not None:
+			self.free.put(self.held)
+			self.held = None
+
+		kind, value = self.ready.get()
+		if kind == "done":
+			raise StopIteration()
+		if kind == "error":
+			raise value
+
+		seq, timestamp, idx = value
+		self.held = idx
+		return Stream_Return(seq, timestamp, self.buffers[idx].data, self.paths)
+
+	def close(self):
+		''' Stop the worker, interrupting any measurement that is in flight.
+		'''
+		self.halt.set()
+		self.free.put(None)
+		while self.thread.is_alive():
+			try:
+				self.vna.interruptMeasurement()
+			except vnaexceptions.VNA_Exception:
+				pass
+			self.thread.join(0.05)
+
+
 class VNA(vna.RAW_VNA):
 	''' Higher-level object-oriented library for interfacing with one or
 		more Akela VNAs.
@@ -49,7 +305,7 @@ class VNA(vna.RAW_VNA):
 	'''
 
 
-	def __init__(self, device_ip, device_ip_port, vna_no=None, loglevel=logging.INFO):
+	def __init__(self, device_ip, device_ip_port, vna_no=None, loglevel=logging.INFO, cal_library=None):
 		''' Connect and initialize a remote VNA.
 
 			Sets up logging, creates a task instance to control the VNA,
@@ -69,6 +325,8 @@ class VNA(vna.RAW_VNA):
 				                         the VNA.
 				loglevel        -- (logging level) Set the log-level for the DLL interface. Defaults
 				                         to `logging.INFO` if not specified.
+				cal_library     -- (\ref CalLibrary) Calibration library \ref set_config() activates
+				                         calibrations from. Defaults to the shared \ref CAL_LIBRARY.
 
 			Returns:
 				Nothing
@@ -78,6 +336,9 @@ class VNA(vna.RAW_VNA):
 		# Call the parent-class initializer
 		super(VNA, self).__init__()
 
+		## Calibration library used by \ref set_config() and \ref store_cal().
+		self.cal_library = cal_library if cal_library is not None else CAL_LIBRARY
+
 		#! @cond
 		# (cond prevents doxygen from exposing a bunch of internal members)
 
@@ -112,8 +373,7 @@ class VNA(vna.RAW_VNA):
 
 		self.utilPingUnit()
 
-		# Get hardware details
-		self.__hwdetails = self.getHardwareDetails()
+		# Hardware details were fetched by initialize()
 		self.log.debug('HW Details:	')
 		for key, value in self.__hwdetails.items():
 			self.log.debug('%s %s', str(key).rjust(30), str(value).rjust(20))
@@ -123,10 +383,33 @@ class VNA(vna.RAW_VNA):
 		self.__calibration = {}
 		self.__calibration['factory'] = None
 
+		self.__staging = {}
+		self.__softcal = None
+
+		# Software calibration resampled onto the current sweep (dropped by `set_config()`),
+		# and per-thread correction scratch buffers.
+		self.__softcal_terms = None
+		self.__softcal_local = threading.local()
+
+		# Sweep plan \ref set_config() last activated a library calibration for. The
+		# library is only consulted again once the plan changes, so a calibration
+		# loaded, or cleared, explicitly since then is left alone.
+		self.__library_plan = None
+
 		#! @endcond
 
 
 
+	def initialize(self):
+		''' See \ref RAW_VNA.initialize(). Also refreshes the hardware details
+			this object keeps for the connected unit.
+		'''
+		super(VNA, self).initialize()
+		# The DLL downloads the hardware details as part of `initialize()`, so
+		# this is the only time they can change.
+		self.__hwdetails = self.getHardwareDetails()
+		self.__library_plan = None
+
 	def set_config(self, hoprate, attenuation, freq=None):
 		''' Configure a connected VNA with specified hoprate, attenuation
 			and (optional) linear sweep parameters.
@@ -143,6 +426,9 @@ class VNA(vna.RAW_VNA):
 				                    the requested parameters to the
 				                    allowable frequencies on actual hardware
 
+			If the resulting sweep plan differs from the previous one, and \ref cal_library
+			holds a calibration for this unit and the new plan, it is activated as well.
+
 			Returns:
 				Nothing
 		'''
@@ -159,21 +445,77 @@ class VNA(vna.RAW_VNA):
 
 		if freq is None:
 			self.log.info('No frequency specified to `set_config`')
-			return
-
-		# frequencies
-		assert len(freq) == 3, "You must pass a 3-tuple for the frequencies parameter."
-		freqMIN = freq[0]
-		freqMAX = freq[1]
-		freqNUM = freq[2]
-		assert (freqNUM > 0)
-
-		freq_setL = self.utilGenerateLinearSweep(freqMIN, freqMAX, freqNUM)
-		freq_checkN = self.getNumberOfFrequencies()
-		freq_checkL = self.getFrequencies()
-		# self.log.info('Frequencies:')
-		# self.log.info('		checkN-%s',freq_checkN)
-		# self.log.info('		checkL-%s',freq_checkL)
+		else:
+			# frequencies
+			assert len(freq) == 3, "You must pass a 3-tuple for the frequencies parameter."
+			freqMIN = freq[0]
+			freqMAX = freq[1]
+			freqNUM = freq[2]
+			assert (freqNUM > 0)
+
+			freq_setL = self.utilGenerateLinearSweep(freqMIN, freqMAX, freqNUM)
+			freq_checkN = self.getNumberOfFrequencies()
+			freq_checkL = self.getFrequencies()
+			# self.log.info('Frequencies:')
+			# self.log.info('		checkN-%s',freq_checkN)
+			# self.log.info('		checkL-%s',freq_checkL)
+
+		self.__softcal_terms = None
+		plan = self.sweep_plan()
+		if plan != self.__library_plan:
+			self.__library_plan = plan
+			self.activate_library_cal()
+
+	def sweep_plan(self):
+		''' \ref VNA::vnaclass::sweep_plan() of the current configuration.
+		'''
+		return sweep_plan(self.getHopRate(), self.getAttenuation(), self.getFrequencies())
+
+	def store_cal(self, freqs=None, terms=None):
+		r''' Add a calibration to \ref cal_library, for this unit and the current sweep plan.
+
+			Args:
+				freqs	-- Calibration frequencies, in MHz. If neither `freqs` nor `terms`
+				           are specified, the calibration currently in the DLL is stored.
+				terms	-- `(12, N)` complex error terms, in \ref exportCalibration() order.
+
+			Returns:
+				The sweep plan the calibration was stored under.
+
+			---
+
+			\exceptions \ref VNA_Exception_Bad_Cal if there is no calibration to store.
+		'''
+		if freqs is None and terms is None:
+			freqs = self.getCalibrationFrequencies()
+			terms = self.exportCalibrationArray()
+		plan = self.sweep_plan()
+		self.cal_library.add(self.__hwdetails['serial_number'], plan, freqs, terms)
+		return plan
+
+	def activate_library_cal(self):
+		''' Import the calibration \ref cal_library holds for this unit and the current
+			sweep plan, if there is one. Called by \ref set_config().
+
+			Returns:
+				True if a calibration was activated, False if the library has none.
+		'''
+		if not len(self.cal_library) or self.getNumberOfFrequencies() == 0:
+			return False
+		entry = self.cal_library.get(self.__hwdetails['serial_number'], self.sweep_plan())
+		if entry is None:
+			return False
+		self.importCalibrationArray(entry.freqs, entry.terms)
+		self.log.info("Calibration for the current sweep plan activated from the calibration library")
+		return True
+
+	def discard_library_cal(self, plan=None):
+		''' Drop the calibration \ref cal_library holds for this unit and `plan`, or
+			every calibration it holds for this unit if `plan` is not specified.
+
+			The calibration currently in the DLL is not affected.
+		'''
+		self.cal_library.discard(self.__hwdetails['serial_number'], plan)
 
 	# Force the doxygen generator to
 	# properly look at the parent class for
@@ -197,8 +539,7 @@ class VNA(vna.RAW_VNA):
 		# Measure each path + ref
 		ret = self.measureUncalibrated()
 
-		Scan_Return = collections.namedtuple("Scan_Return", ['T1R1', 'T1R2', 'T2R1', 'T2R2', 'Ref'])
-		return Scan_Return(*ret)
+		return Uncal_Scan_Return(*ret)
 
 		#return [measure_check, dict(Scan_Return(*nparr)._asdict())]
 
@@ -209,22 +550,298 @@ class VNA(vna.RAW_VNA):
 		# Measure each path + ref
 		ret = self.measure2PortCalibrated()
 
-		Scan_Return = collections.namedtuple("Scan_Return", ["S11", "S21", "S12", "S22"])
-		return Scan_Return(*ret)
+		return Cal_Scan_Return(*ret)
+
+	def measure_batch(self, count, calibrated=False, out=None):
+		''' Measure `count` consecutive sweeps into a single preallocated array.
+
+			The DLL writes each sweep into a reused staging buffer, which is then
+			packed straight into its slot of the output array, so the whole batch
+			is one allocation (or none, if `out` is passed in).
 
+			Args:
+				count		-- (int) Number of sweeps to measure.
+				calibrated	-- (bool) Measure S-parameters with the DLL calibration (\ref measure_cal)
+				                    rather than the raw paths (\ref measure_uncal).
+				out			-- (optional) `(count, paths, N)` complex128 array to fill in. `paths`
+				                    is 4 for calibrated measurements, 5 otherwise.
+
+			Returns:
+				`Batch_Return(data, timestamps, paths)`, where `data` is the filled
+				`(count, paths, N)` array, `timestamps` a `(count, )` array of the `time.time()`
+				at which each sweep completed, and `paths` the tuple of row names
+				(\ref CAL_PATHS or \ref UNCAL_PATHS).
+		'''
+
+		if calibrated:
+			paths   = CAL_PATHS
+			measure = self.measure2PortCalibratedArray
+		else:
+			paths   = UNCAL_PATHS
+			measure = self.measureUncalibratedArray
+
+		npts = self.getNumberOfFrequencies()
+		shape = (count, len(paths), npts)
+		if out is None:
+			out = np.empty(shape, dtype=np.complex128)
+		elif out.shape != shape or out.dtype != np.complex128:
+			raise ValueError("Batch output array must be complex128 with shape %s (got %s %s)" % (shape, out.dtype, out.shape))
+
+		staging = self.__staging_buffer(len(paths), npts)
+		timestamps = np.empty(count, dtype=np.float64)
+
+		for idx in range(count):
+			measure(staging, dest=out[idx])
+			timestamps[idx] = time.time()
+
+		return Batch_Return(out, timestamps, paths)
+
+	def set_software_cal(self, freqs=None, terms=None, interp='magphase'):
+		r''' Set the calibration used for software-side (numpy) correction.
+
+			With the software calibration, sweeps are always measured raw, and the
+			12-term correction is applied in python (see \ref measure_softcal() and
+			\ref apply_software_cal()). The raw data can therefore be kept, and
+			re-corrected later with a different calibration.
+
+			Args:
+				freqs	-- Array of `N` calibration frequencies in MHz. If neither `freqs` nor
+				           `terms` is given, the calibration currently loaded in the DLL is
+				           exported (\ref exportCalibrationArray()) and used.
+				terms	-- `(12, N)` complex error terms in \ref exportCalibration() order
+				           (e.g. from \ref VNA::calutil::generate_CALterms_batch()).
+				interp	-- (str) How the terms are resampled onto the sweep frequencies.
+				           See \ref VNA::calutil::interpCALterms(). Unlike there, this defaults
+				           to `'magphase'`: the error terms are dominated by cable delay, whose
+				           rotating phase real/imaginary interpolation tracks poorly whenever the
+				           sweep grid differs from the calibration grid. (`calutil` keeps `'reim'`
+				           so existing scripts get the same results.)
+
+			The terms are resampled onto the sweep once, when first used after this call or
+			after \ref set_config(). Sweep settings must therefore be changed through
+			\ref set_config() while a software calibration is in use.
+
+			---
+
+			\exceptions \ref VNA_Exception_Bad_Cal if no terms are given, and there is no DLL calibration.
+		'''
+		if freqs is None and terms is None:
+			freqs = self.getCalibrationFrequencies()
+			terms = self.exportCalibrationArray()
+
+		freqs = np.array(freqs, dtype=np.float64)
+		terms = np.array(terms, dtype=np.complex128)
+		if terms.shape != (12, freqs.shape[0]):
+			raise ValueError("Calibration terms must have shape (12, %s) (got %s)" % (freqs.shape[0], terms.shape))
+		self.__softcal = (freqs, terms, interp)
+		self.__softcal_terms = None
+
+	def apply_software_cal(self, raw, out=None):
+		r''' Correct raw sweeps with the software calibration.
+
+			Args:
+				raw		-- `(..., 5, N)` complex array of raw paths, in \ref UNCAL_PATHS order,
+				           measured with the current sweep settings (e.g. `measure_batch(n).data`).
+				out		-- (optional) `(..., 4, N)` complex array to write the S-parameters into.
+
+			Returns:
+				`(..., 4, N)` complex array of S-parameters, in \ref CAL_PATHS order.
+
+			---
+
+			\exceptions \ref VNA_Exception_Bad_Cal if no software calibration has been set.
+		'''
+		if self.__softcal is None:
+			raise vnaexceptions.VNA_Exception_Bad_Cal("No software calibration set!")
+
+		# Resampled once per sweep configuration, so only the correction itself runs per sweep.
+		terms = self.__softcal_terms
+		if terms is None:
+			freqs, cal_terms, interp = self.__softcal
+			terms = self.__softcal_terms = calutil.interpCALterms(freqs, cal_terms, self.getFrequencies(), mode=interp)
+
+		raw = np.asarray(raw)
+		shape = raw.shape[:-2] + (len(CAL_PATHS), raw.shape[-1])
+		if out is None:
+			out = np.empty(shape, dtype=np.complex128)
+		elif out.shape != shape:
+			raise ValueError("Output array must have shape %s (got %s)" % (shape, out.shape))
+
+		work_shape = (5, ) + raw.shape[:-2] + (raw.shape[-1], )
+		work = getattr(self.__softcal_local, "work", None)
+		if work is None or work.shape != work_shape:
+			work = self.__softcal_local.work = np.empty(work_shape, dtype=np.complex128)
+
+		T1R1, T1R2, T2R1, T2R2, Ref = np.moveaxis(raw, -2, 0)
+		calutil.applyCalibration_batch(terms, T1R1, T1R2, T2R1, T2R2, Ref, out=np.moveaxis(out, -2, 0), work=work)
+		return out
+
+	def measure_softcal(self):
+		r''' Measure a raw sweep, and correct it with the software calibration.
+
+			Returns:
+				`SoftCal_Return(raw, sparams)`, where `raw` is the `(5, N)` array of raw paths
+				(\ref UNCAL_PATHS) and `sparams` the `(4, N)` corrected S-parameters (\ref CAL_PATHS).
+
+			---
+
+			\exceptions \ref VNA_Exception_Bad_Cal if no software calibration has been set.
+		'''
+		if self.__softcal is None:
+			raise vnaexceptions.VNA_Exception_Bad_Cal("No software calibration set!")
+
+		npts = self.getNumberOfFrequencies()
+		raw = self.measureUncalibratedArray(self.__staging_buffer(len(UNCAL_PATHS), npts)).copy()
+		return SoftCal_Return(raw, self.apply_software_cal(raw))
+
+	def stream(self, calibrated=False, count=None, depth=3):
+		''' Stream sweeps from a background acquisition worker.
+
+			Returns a generator. Acquisition starts on the first iteration, and a
+			worker thread then keeps the next measurement in flight while the
+			consumer handles the current sweep, cycling through a ring of `depth`
+			preallocated buffers. When the generator is closed (explicitly, by
+			breaking out of a `for` loop over it, or by it being garbage collected),
+			the worker is stopped with \ref interruptMeasurement().
+
+			The task must already be started, and should not be reconfigured while
+			the stream is open.
+
+			Args:
+				calibrated	-- (bool) Measure S-parameters with the DLL calibration
+				                    rather than the raw paths.
+				count		-- (int) Optional number of sweeps to acquire. Unlimited if not specified.
+				depth		-- (int) Number of buffers in the ring (>= 2).
+
+			Yields:
+				`Stream_Return(sequence, timestamp, data, paths)`. `data` is a `(paths, N)`
+				complex array that is only valid until the next sweep is requested.
+
+			Example:
+
+				for sweep in vna.stream(calibrated=True):
+					process(sweep.data[1])	# S21
+					if done():
+						break
+		'''
+		acq = SweepStream(self, calibrated=calibrated, depth=depth, count=count)
+		acq.start()
+		try:
+			while True:
+				try:
+					sweep = acq.get()
+				except StopIteration:
+					return
+				yield sweep
+		finally:
+			acq.close()
+
+	def __staging_buffer(self, paths, npts):
+		# Reuse one staging buffer per path count, reallocating when the sweep changes length.
+		buf = self.__staging.get(paths)
+		if buf is None or buf.points != npts:
+			buf = vna.SweepBuffer(paths, npts)
+			self.__staging[paths] = buf
+		return buf
+
+
+	def load_factory_cal(self, cache_dir=None, refresh=False):
+		r''' Load the unit's factory calibration, from the local cache if possible.
+
+			Reading the calibration out of the PROM is slow, so the exported terms
+			(along with the unit's hardware details) are cached on disk, keyed by
+			serial number. If the cache file is missing, unreadable, or does not
+			match the connected hardware, the calibration is imported from the PROM
+			with \ref importFactoryCalibration() instead, and the cache is rewritten.
+
+			Args:
+				cache_dir	-- (string) Directory to keep the cache in. Defaults to \ref CAL_CACHE_DIR.
+				refresh		-- (bool) Ignore any cached copy, and reload from the PROM.
+
+			Returns:
+				`"cache"` or `"prom"`, depending on where the calibration was loaded from.
+
+			---
+
+			\exceptions \ref VNA_Exception_Bad_Cal if the embedded calibration is not present or invalid.
+		'''
+		path = factory_cal_cache_path(self.__hwdetails['serial_number'], cache_dir)
+
+		if not refresh and os.path.exists(path):
+			try:
+				freqs, terms = self.__read_cal_cache(path)
+				self.importCalibrationArray(freqs, terms)
+				self.log.info("Factory calibration loaded from cache file %s", path)
+				return "cache"
+			except (IOError, OSError, EOFError, KeyError, ValueError, zipfile.BadZipfile, vnaexceptions.VNA_Exception_Bad_Cal) as e:
+				# A truncated or corrupt cache (e.g. from a run killed mid-write) is
+				# discarded, so it is rebuilt from the PROM below.
+				self.log.warning("Cached factory calibration %s is invalid (%s). Loading from PROM.", path, e)
+				try:
+					os.remove(path)
+				except OSError:
+					pass
+
+		self.importFactoryCalibration()
+
+		try:
+			self.__write_cal_cache(path)
+		except (IOError, OSError) as e:
+			self.log.warning("Could not write factory calibration cache file %s: %s", path, e)
+		return "prom"
+
+	def __read_cal_cache(self, path):
+		with open(path, "rb") as fp:
+			cache = np.load(fp)
+
+			if int(cache['version']) != CAL_CACHE_VERSION:
+				raise ValueError("Cache version %s is not supported" % int(cache['version']))
+			for key in CAL_CACHE_HW_KEYS:
+				if not np.array_equal(cache[key], self.__hwdetails[key]):
+					raise vnaexceptions.VNA_Exception_Bad_Cal("Cached %s does not match the connected hardware!" % key)
+
+			freqs = cache['freqs']
+			terms = cache['terms']
+
+		if freqs.ndim != 1 or freqs.shape[0] == 0 or terms.shape != (12, freqs.shape[0]):
+			raise ValueError("Malformed calibration arrays")
+		if not (np.all(np.isfinite(freqs)) and np.all(np.isfinite(terms))):
+			raise ValueError("Non-finite calibration values")
+		return freqs, terms
+
+	def __write_cal_cache(self, path):
+		cache = dict((key, np.asarray(self.__hwdetails[key])) for key in self.__hwdetails)
+		cache['version'] = CAL_CACHE_VERSION
+		cache['freqs']   = self.getCalibrationFrequencies()
+		cache['terms']   = self.exportCalibrationArray()
+
+		dirpath = os.path.dirname(path)
+		if dirpath and not os.path.isdir(dirpath):
+			os.makedirs(dirpath)
+
+		# Write to a temporary file, then swap it into place, so a concurrent
+		# reader never sees a partial file.
+		tmppath = "%s.%s.tmp" % (path, os.getpid())
+		with open(tmppath, "wb") as fp:
+			np.savez(fp, **cache)
+		getattr(os, "replace", os.rename)(tmppath, path)
 
 	def save_dll_cal_auto(self):
 		addr = self.getIPAddress()
-		self.save_dll_cal("VNA-Cal-%s.pik" % (addr))
+		self.save_dll_cal("VNA-Cal-%s%s" % (addr, calfile.CALFILE_EXTENSION))
 
 	def load_dll_cal_auto(self):
 		addr = self.getIPAddress()
-		self.load_dll_cal("VNA-Cal-%s.pik" % (addr))
+		fname = "VNA-Cal-%s%s" % (addr, calfile.CALFILE_EXTENSION)
+		if not os.path.exists(fname) and os.path.exists("VNA-Cal-%s.pik" % (addr)):
+			# Calibrations saved before the binary format existed
+			fname = "VNA-Cal-%s.pik" % (addr)
+		self.load_dll_cal(fname)
 
 
 	def save_dll_cal(self, filepath):
-		''' Save the generated cal from the internal DLL calibration mechanism
-			to a local file.
+		r''' Save the generated cal from the internal DLL calibration mechanism
+			to a local file, in the binary format from \ref VNA::calfile.
 
 			Args:
 				filepath	--	(string) Local filesystem path where the cal
@@ -242,21 +859,23 @@ class VNA(vna.RAW_VNA):
 			raise vnaexceptions.VNA_Exception_Bad_Cal("No calibration to save!")
 
 		cal_f = self.getCalibrationFrequencies()
-		cal_p = self.exportCalibration()
-
-		cal = {
-				"time"     : time.time(),
-				"address"  : self.getIPAddress(),
-				"hardware" : self.getHardwareDetails(),
-				"cal_f"    : cal_f,
-				"cal_p"    : cal_p,
-		}
-		with open(filepath, "wb") as fp:
-			pickle.dump(cal, fp)
+		cal_p = self.exportCalibrationArray()
+
+		calfile.write_calfile(filepath, cal_f, cal_p,
+				serial_number = self.__hwdetails['serial_number'],
+				address       = self.getIPAddress(),
+				timestamp     = time.time(),
+				hardware      = self.__hwdetails,
+			)
 
 	def load_dll_cal(self, filepath, checkip=True, checkserial=True):
 		''' Load a calibration data-set from a save file.
 
+			Any format \ref VNA::calfile::import_calibration() understands can be loaded:
+			binary calibration files (memory-mapped), as well as the older pickle
+			(`.pik`), CSV and TDMS calibrations. The IP and serial checks are skipped
+			for formats that do not record them.
+
 			Args:
 				filepath	-- (string) Local filesystem path to where the
 										saved calibration is located.
@@ -267,18 +886,16 @@ class VNA(vna.RAW_VNA):
 
 		'''
 
-		with open(filepath, "rb") as fp:
-			cal = pickle.load(fp)
+		cal = calfile.import_calibration(filepath)
+		address = cal.header.get('address')
+		serial  = cal.header.get('serial_number')
 
-		if checkip and cal['address'] != self.getIPAddress():
+		if checkip and address is not None and address != self.getIPAddress():
 			raise vnaexceptions.VNA_Exception_Bad_Cal("Calibration remote IP does not match connected hardware!")
-		if checkserial and cal['hardware']['serial_number'] != self.getHardwareDetails()['serial_number']:
+		if checkserial and serial is not None and serial != self.__hwdetails['serial_number']:
 			raise vnaexceptions.VNA_Exception_Bad_Cal("Connected VNA serial number does not match calibration serial!")
 
-		cal_f = cal['cal_f']
-		cal_p = cal['cal_p']
-
-		self.importCalibration(cal_f, *cal_p)
+		self.importCalibrationArray(cal.freqs, cal.terms)
 
 
 # end doxygen block
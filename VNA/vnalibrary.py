@@ -75,7 +75,45 @@ def find_dll():
 		print("	", fpath)
 	raise ValueError("Could not find DLL/SO! Searched paths: '%s'" % locations)
 
-dll = ct.CDLL(find_dll())
+def _load_backend(backend=None):
+	''' Load the DLL backend that all the calls in this module go through.
+
+	This only runs once, when the module is imported, so the backend is picked
+	with the `VNA_BACKEND` environment variable, and can't be switched afterwards.
+
+	Args:
+		backend - Either "dll" (the real VNA DLL/SO, found with \ref find_dll()),
+		          or "sim" (the in-process simulator from \ref VNA::vnasim).
+		          If not specified, the `VNA_BACKEND` environment variable is used,
+		          defaulting to "dll".
+
+	Returns:
+		A ctypes `CDLL` instance, or a \ref VNA::vnasim::SimulatedDLL instance.
+	'''
+	if backend is None:
+		backend = os.environ.get("VNA_BACKEND", "dll")
+	backend = backend.lower()
+
+	if backend == "sim":
+		from . import vnasim
+		print("Using simulated VNA DLL backend")
+		return vnasim.SimulatedDLL()
+	elif backend == "dll":
+		return ct.CDLL(find_dll())
+	else:
+		raise ValueError("Unknown VNA backend: '%s'" % backend)
+
+dll = _load_backend()
+
+## Name of the active backend ("dll" or "sim").
+BACKEND = "dll" if isinstance(dll, ct.CDLL) else "sim"
+
+def dll_value(ctype, name):
+	''' Read the value of an exported constant from the active backend.
+	'''
+	if isinstance(dll, ct.CDLL):
+		return ctype.in_dll(dll, name).value
+	return ctype(dll.exported_value(name)).value
 
 import time
 import numpy as np
@@ -121,26 +159,26 @@ from . import vnaexceptions
 TaskHandle = ct.c_void_p # anonymous typedef
 
 ErrCode = ct.c_int #typedef
-ERR_OK 					= ErrCode.in_dll(dll, "ERR_OK").value
-ERR_BAD_ATTEN 			= ErrCode.in_dll(dll, "ERR_BAD_ATTEN").value
-ERR_BAD_CAL 			= ErrCode.in_dll(dll, "ERR_BAD_CAL").value
-ERR_BAD_HANDLE			= ErrCode.in_dll(dll, "ERR_BAD_HANDLE").value
-ERR_BAD_HOP 			= ErrCode.in_dll(dll, "ERR_BAD_HOP").value
-ERR_BAD_PATH 			= ErrCode.in_dll(dll, "ERR_BAD_PATH").value
-ERR_BAD_PROM 			= ErrCode.in_dll(dll, "ERR_BAD_PROM").value
-ERR_BYTES 				= ErrCode.in_dll(dll, "ERR_BYTES").value
-ERR_FREQ_OUT_OF_BOUNDS 	= ErrCode.in_dll(dll, "ERR_FREQ_OUT_OF_BOUNDS").value
-ERR_INTERRUPTED 		= ErrCode.in_dll(dll, "ERR_INTERRUPTED").value
-ERR_NO_RESPONSE 		= ErrCode.in_dll(dll, "ERR_NO_RESPONSE").value
-ERR_MISSING_IP 			= ErrCode.in_dll(dll, "ERR_MISSING_IP").value
-ERR_MISSING_PORT 		= ErrCode.in_dll(dll, "ERR_MISSING_PORT").value
-ERR_MISSING_HOP 		= ErrCode.in_dll(dll, "ERR_MISSING_HOP").value
-ERR_MISSING_ATTEN 		= ErrCode.in_dll(dll, "ERR_MISSING_ATTEN").value
-ERR_MISSING_FREQS 		= ErrCode.in_dll(dll, "ERR_MISSING_FREQS").value
-ERR_PROG_OVERFLOW 		= ErrCode.in_dll(dll, "ERR_PROG_OVERFLOW").value
-ERR_SOCKET 				= ErrCode.in_dll(dll, "ERR_SOCKET").value
-ERR_TOO_MANY_POINTS 	= ErrCode.in_dll(dll, "ERR_TOO_MANY_POINTS").value
-ERR_WRONG_STATE 		= ErrCode.in_dll(dll, "ERR_WRONG_STATE").value
+ERR_OK 					= dll_value(ErrCode, "ERR_OK")
+ERR_BAD_ATTEN 			= dll_value(ErrCode, "ERR_BAD_ATTEN")
+ERR_BAD_CAL 			= dll_value(ErrCode, "ERR_BAD_CAL")
+ERR_BAD_HANDLE			= dll_value(ErrCode, "ERR_BAD_HANDLE")
+ERR_BAD_HOP 			= dll_value(ErrCode, "ERR_BAD_HOP")
+ERR_BAD_PATH 			= dll_value(ErrCode, "ERR_BAD_PATH")
+ERR_BAD_PROM 			= dll_value(ErrCode, "ERR_BAD_PROM")
+ERR_BYTES 				= dll_value(ErrCode, "ERR_BYTES")
+ERR_FREQ_OUT_OF_BOUNDS 	= dll_value(ErrCode, "ERR_FREQ_OUT_OF_BOUNDS")
+ERR_INTERRUPTED 		= dll_value(ErrCode, "ERR_INTERRUPTED")
+ERR_NO_RESPONSE 		= dll_value(ErrCode, "ERR_NO_RESPONSE")
+ERR_MISSING_IP 			= dll_value(ErrCode, "ERR_MISSING_IP")
+ERR_MISSING_PORT 		= dll_value(ErrCode, "ERR_MISSING_PORT")
+ERR_MISSING_HOP 		= dll_value(ErrCode, "ERR_MISSING_HOP")
+ERR_MISSING_ATTEN 		= dll_value(ErrCode, "ERR_MISSING_ATTEN")
+ERR_MISSING_FREQS 		= dll_value(ErrCode, "ERR_MISSING_FREQS")
+ERR_PROG_OVERFLOW 		= dll_value(ErrCode, "ERR_PROG_OVERFLOW")
+ERR_SOCKET 				= dll_value(ErrCode, "ERR_SOCKET")
+ERR_TOO_MANY_POINTS 	= dll_value(ErrCode, "ERR_TOO_MANY_POINTS")
+ERR_WRONG_STATE 		= dll_value(ErrCode, "ERR_WRONG_STATE")
 
 ## @}
 
@@ -264,21 +302,21 @@ ErrCodeBOOK = 	{
 # doxygen doesn't understand.
 # @{
 HopRate = ct.c_int #typedef
-HOP_UNDEFINED 	= HopRate.in_dll(dll, "HOP_UNDEFINED").value
-#HOP_90K		= HopRate.in_dll(dll, "HOP_90K").value # This rate is currently unsupported
-HOP_45K			= HopRate.in_dll(dll, "HOP_45K").value
-HOP_30K 		= HopRate.in_dll(dll, "HOP_30K").value
-HOP_15K 		= HopRate.in_dll(dll, "HOP_15K").value
-HOP_7K 			= HopRate.in_dll(dll, "HOP_7K").value
-HOP_3K 			= HopRate.in_dll(dll, "HOP_3K").value
-HOP_2K 			= HopRate.in_dll(dll, "HOP_2K").value
-HOP_1K 			= HopRate.in_dll(dll, "HOP_1K").value
-HOP_550 		= HopRate.in_dll(dll, "HOP_550").value
-HOP_312 		= HopRate.in_dll(dll, "HOP_312").value
-HOP_156 		= HopRate.in_dll(dll, "HOP_156").value
-HOP_78 			= HopRate.in_dll(dll, "HOP_78").value
-HOP_39 			= HopRate.in_dll(dll, "HOP_39").value
-HOP_20 			= HopRate.in_dll(dll, "HOP_20").value
+HOP_UNDEFINED 	= dll_value(HopRate, "HOP_UNDEFINED")
+#HOP_90K		= dll_value(HopRate, "HOP_90K") # This rate is currently unsupported
+HOP_45K			= dll_value(HopRate, "HOP_45K")
+HOP_30K 		= dll_value(HopRate, "HOP_30K")
+HOP_15K 		= dll_value(HopRate, "HOP_15K")
+HOP_7K 			= dll_value(HopRate, "HOP_7K")
+HOP_3K 			= dll_value(HopRate, "HOP_3K")
+HOP_2K 			= dll_value(HopRate, "HOP_2K")
+HOP_1K 			= dll_value(HopRate, "HOP_1K")
+HOP_550 		= dll_value(HopRate, "HOP_550")
+HOP_312 		= dll_value(HopRate, "HOP_312")
+HOP_156 		= dll_value(HopRate, "HOP_156")
+HOP_78 			= dll_value(HopRate, "HOP_78")
+HOP_39 			= dll_value(HopRate, "HOP_39")
+HOP_20 			= dll_value(HopRate, "HOP_20")
 
 ## Dictionary for mapping hop-rate values to human-readable string representations of the value.
 HopRateBOOK =	{
@@ -319,39 +357,39 @@ HopRateBOOK =	{
 # @{
 #
 Attenuation = ct.c_int #typedef
-ATTEN_UNDEFINED	= Attenuation.in_dll(dll, "ATTEN_UNDEFINED").value
-ATTEN_0 		= Attenuation.in_dll(dll, "ATTEN_0").value
-ATTEN_1 		= Attenuation.in_dll(dll, "ATTEN_1").value
-ATTEN_2 		= Attenuation.in_dll(dll, "ATTEN_2").value
-ATTEN_3 		= Attenuation.in_dll(dll, "ATTEN_3").value
-ATTEN_4 		= Attenuation.in_dll(dll, "ATTEN_4").value
-ATTEN_5 		= Attenuation.in_dll(dll, "ATTEN_5").value
-ATTEN_6 		= Attenuation.in_dll(dll, "ATTEN_6").value
-ATTEN_7 		= Attenuation.in_dll(dll, "ATTEN_7").value
-ATTEN_8 		= Attenuation.in_dll(dll, "ATTEN_8").value
-ATTEN_9 		= Attenuation.in_dll(dll, "ATTEN_9").value
-ATTEN_10 		= Attenuation.in_dll(dll, "ATTEN_10").value
-ATTEN_11 		= Attenuation.in_dll(dll, "ATTEN_11").value
-ATTEN_12 		= Attenuation.in_dll(dll, "ATTEN_12").value
-ATTEN_13 		= Attenuation.in_dll(dll, "ATTEN_13").value
-ATTEN_14 		= Attenuation.in_dll(dll, "ATTEN_14").value
-ATTEN_15 		= Attenuation.in_dll(dll, "ATTEN_15").value
-ATTEN_16	 	= Attenuation.in_dll(dll, "ATTEN_16").value
-ATTEN_17 		= Attenuation.in_dll(dll, "ATTEN_17").value
-ATTEN_18 		= Attenuation.in_dll(dll, "ATTEN_18").value
-ATTEN_19 		= Attenuation.in_dll(dll, "ATTEN_19").value
-ATTEN_20 		= Attenuation.in_dll(dll, "ATTEN_20").value
-ATTEN_21 		= Attenuation.in_dll(dll, "ATTEN_21").value
-ATTEN_22 		= Attenuation.in_dll(dll, "ATTEN_22").value
-ATTEN_23 		= Attenuation.in_dll(dll, "ATTEN_23").value
-ATTEN_24 		= Attenuation.in_dll(dll, "ATTEN_24").value
-ATTEN_25 		= Attenuation.in_dll(dll, "ATTEN_25").value
-ATTEN_26 		= Attenuation.in_dll(dll, "ATTEN_26").value
-ATTEN_27 		= Attenuation.in_dll(dll, "ATTEN_27").value
-ATTEN_28 		= Attenuation.in_dll(dll, "ATTEN_28").value
-ATTEN_29 		= Attenuation.in_dll(dll, "ATTEN_29").value
-ATTEN_30 		= Attenuation.in_dll(dll, "ATTEN_30").value
-ATTEN_31 		= Attenuation.in_dll(dll, "ATTEN_31").value
+ATTEN_UNDEFINED	= dll_value(Attenuation, "ATTEN_UNDEFINED")
+ATTEN_0 		= dll_value(Attenuation, "ATTEN_0")
+ATTEN_1 		= dll_value(Attenuation, "ATTEN_1")
+ATTEN_2 		= dll_value(Attenuation, "ATTEN_2")
+ATTEN_3 		= dll_value(Attenuation, "ATTEN_3")
+ATTEN_4 		= dll_value(Attenuation, "ATTEN_4")
+ATTEN_5 		= dll_value(Attenuation, "ATTEN_5")
+ATTEN_6 		= dll_value(Attenuation, "ATTEN_6")
+ATTEN_7 		= dll_value(Attenuation, "ATTEN_7")
+ATTEN_8 		= dll_value(Attenuation, "ATTEN_8")
+ATTEN_9 		= dll_value(Attenuation, "ATTEN_9")
+ATTEN_10 		= dll_value(Attenuation, "ATTEN_10")
+ATTEN_11 		= dll_value(Attenuation, "ATTEN_11")
+ATTEN_12 		= dll_value(Attenuation, "ATTEN_12")
+ATTEN_13 		= dll_value(Attenuation, "ATTEN_13")
+ATTEN_14 		= dll_value(Attenuation, "ATTEN_14")
+ATTEN_15 		= dll_value(Attenuation, "ATTEN_15")
+ATTEN_16	 	= dll_value(Attenuation, "ATTEN_16")
+ATTEN_17 		= dll_value(Attenuation, "ATTEN_17")
+ATTEN_18 		= dll_value(Attenuation, "ATTEN_18")
+ATTEN_19 		= dll_value(Attenuation, "ATTEN_19")
+ATTEN_20 		= dll_value(Attenuation, "ATTEN_20")
+ATTEN_21 		= dll_value(Attenuation, "ATTEN_21")
+ATTEN_22 		= dll_value(Attenuation, "ATTEN_22")
+ATTEN_23 		= dll_value(Attenuation, "ATTEN_23")
+ATTEN_24 		= dll_value(Attenuation, "ATTEN_24")
+ATTEN_25 		= dll_value(Attenuation, "ATTEN_25")
+ATTEN_26 		= dll_value(Attenuation, "ATTEN_26")
+ATTEN_27 		= dll_value(Attenuation, "ATTEN_27")
+ATTEN_28 		= dll_value(Attenuation, "ATTEN_28")
+ATTEN_29 		= dll_value(Attenuation, "ATTEN_29")
+ATTEN_30 		= dll_value(Attenuation, "ATTEN_30")
+ATTEN_31 		= dll_value(Attenuation, "ATTEN_31")
 
 ## Dictionary for mapping attenuation values to human-readable string representations of the value.
 AttenuationBOOK = 	{
@@ -410,9 +448,9 @@ AttenuationBOOK = 	{
 # doxygen doesn't understand.
 # @{
 TaskState = ct.c_int #typedef
-TASK_UNINITIALIZED	= TaskState.in_dll(dll, "TASK_UNINITIALIZED").value
-TASK_STOPPED		= TaskState.in_dll(dll, "TASK_STOPPED").value
-TASK_STARTED 		= TaskState.in_dll(dll, "TASK_STARTED").value
+TASK_UNINITIALIZED	= dll_value(TaskState, "TASK_UNINITIALIZED")
+TASK_STOPPED		= dll_value(TaskState, "TASK_STOPPED")
+TASK_STARTED 		= dll_value(TaskState, "TASK_STARTED")
 
 ## Dictionary for mapping task-rates values to human-readable string representations of the value.
 TaskStateBOOK =	{
@@ -480,13 +518,13 @@ class HardwareDetails(ct.Structure):
 
 
 CalibrationStep = ct.c_int #typedef
-STEP_P1_OPEN  = CalibrationStep.in_dll(dll, "STEP_P1_OPEN").value
-STEP_P1_SHORT = CalibrationStep.in_dll(dll, "STEP_P1_SHORT").value
-STEP_P1_LOAD  = CalibrationStep.in_dll(dll, "STEP_P1_LOAD").value
-STEP_P2_OPEN  = CalibrationStep.in_dll(dll, "STEP_P2_OPEN").value
-STEP_P2_SHORT = CalibrationStep.in_dll(dll, "STEP_P2_SHORT").value
-STEP_P2_LOAD  = CalibrationStep.in_dll(dll, "STEP_P2_LOAD").value
-STEP_THRU     = CalibrationStep.in_dll(dll, "STEP_THRU").value
+STEP_P1_OPEN  = dll_value(CalibrationStep, "STEP_P1_OPEN")
+STEP_P1_SHORT = dll_value(CalibrationStep, "STEP_P1_SHORT")
+STEP_P1_LOAD  = dll_value(CalibrationStep, "STEP_P1_LOAD")
+STEP_P2_OPEN  = dll_value(CalibrationStep, "STEP_P2_OPEN")
+STEP_P2_SHORT = dll_value(CalibrationStep, "STEP_P2_SHORT")
+STEP_P2_LOAD  = dll_value(CalibrationStep, "STEP_P2_LOAD")
+STEP_THRU     = dll_value(CalibrationStep, "STEP_THRU")
 CalibrationStepBOOK =	{
 							STEP_P1_OPEN  : 'STEP_P1_OPEN',
 							STEP_P1_SHORT : 'STEP_P1_SHORT',
@@ -557,14 +595,15 @@ def ComplexDataFactory(data_len):
 					]
 
 		def __init__(self, real=None, imag=None):
-			# I/Q Data arrays
+			# I/Q Data arrays. as_ctypes() shares the numpy memory (and keeps it alive),
+			# which avoids unpacking the inputs element-by-element.
 			if real is not None:
-				bufferI = (ct.c_double * data_len)(*real)
+				bufferI = np.ctypeslib.as_ctypes(np.array(real, dtype=np.float64))
 			else:
 				bufferI = (ct.c_double * data_len)()
 
 			if imag is not None:
-				bufferQ = (ct.c_double * data_len)(*imag)
+				bufferQ = np.ctypeslib.as_ctypes(np.array(imag, dtype=np.float64))
 			else:
 				bufferQ = (ct.c_double * data_len)()
 
@@ -580,11 +619,11 @@ def ComplexDataFactory(data_len):
 
 
 		def toArray(self):
-			# Unpack the ctypes arrays
-			arr = np.array([self.I.contents[:], self.Q.contents[:]])
-
-			# And convert the two columns to a complex number
-			arr = np.array(arr[0,...] + 1j * arr[1,...])
+			# Copy the two ctypes arrays straight into a complex array,
+			# without going through python floats.
+			arr = np.empty(data_len, dtype=np.complex128)
+			arr.real = np.ctypeslib.as_array(self.I.contents)
+			arr.imag = np.ctypeslib.as_array(self.Q.contents)
 			return arr
 
 
@@ -601,6 +640,31 @@ def ComplexDataArrayFromNumpyArray(np_arr):
 	cdat = ComplexDataFactory(len(np_arr))(np_arr.real, np_arr.imag)
 	return cdat
 
+def ComplexDataFromIQBuffer(iq):
+	''' Build a \ref ComplexData struct whose I and Q pointers point into
+	an existing numpy array, rather then into freshly allocated ctypes arrays.
+
+	Anything the DLL writes through the struct therefore lands directly in `iq`.
+
+	Args:
+		iq - C-contiguous float64 numpy array with a shape of `(2, N)`.
+		     `iq[0]` is the I (real) array, `iq[1]` the Q (imaginary) array.
+
+	Returns:
+		Instance of `ComplexDataFactory(N)`. It holds a reference to `iq`.
+	'''
+	assert iq.dtype == np.float64 and iq.ndim == 2 and iq.shape[0] == 2
+	assert iq.flags['C_CONTIGUOUS']
+
+	data_len = iq.shape[1]
+	ptr_type = ct.POINTER(ct.c_double * data_len)
+
+	cdat = ComplexDataFactory(data_len)()
+	cdat.I = ct.cast(iq[0].ctypes.data, ptr_type)
+	cdat.Q = ct.cast(iq[1].ctypes.data, ptr_type)
+	cdat.iq_buffer = iq
+	return cdat
+
 
 # The following two-## comment has to be present.
 # it works around a bug in doxypypy
@@ -658,6 +722,69 @@ def DoubleArrayFactory(data_len):
 
 
 
+class SweepBuffer(object):
+	''' Caller-owned, reusable storage for the arrays filled in by a measurement
+	(or calibration export) call.
+
+	The DLL writes a separate I and Q double array for every path. Those are
+	allocated once here, as a single `(paths, 2, N)` float64 block, and the
+	\ref ComplexData structs handed to the DLL point straight into it, so a
+	measurement into an existing buffer allocates nothing. \ref pack() then
+	converts the I/Q block into the contiguous `(paths, N)` complex array `data`,
+	again in place.
+
+	Members:
+		paths   - Number of paths (5 for uncalibrated, 4 for calibrated, 12 for calibration terms).
+		points  - Number of frequency points, `N`.
+		iq      - `(paths, 2, N)` float64 array the DLL writes into. `iq[p, 0]` is I, `iq[p, 1]` is Q.
+		data    - `(paths, N)` complex128 array, updated by \ref pack().
+		structs - List of `paths` \ref ComplexData structs pointing into `iq`.
+
+	Note that the same buffer should not be passed to two measurements that are
+	in flight at the same time.
+	'''
+
+	def __init__(self, paths, data_len):
+		assert (data_len > 0), "Sweep buffers have to have a non-zero length!"
+		self.paths   = paths
+		self.points  = data_len
+		self.iq      = np.zeros((paths, 2, data_len), dtype=np.float64)
+		self.data    = np.zeros((paths, data_len), dtype=np.complex128)
+		self.structs = [ComplexDataFromIQBuffer(self.iq[idx]) for idx in range(paths)]
+
+	def __repr__(self):
+		return "<SweepBuffer - %s paths x %s points>" % (self.paths, self.points)
+
+	def check(self, paths, data_len):
+		''' Raise a ValueError if the buffer does not have the requested shape.
+		'''
+		if self.paths != paths or self.points != data_len:
+			raise ValueError("Sweep buffer shape (%s, %s) does not match the required (%s, %s)!" %
+					(self.paths, self.points, paths, data_len))
+
+	def pack(self, dest=None):
+		''' Convert the I/Q data in `iq` to complex values in `data`.
+
+		Args:
+			dest - Optional `(paths, N)` complex array to write into instead of `data`.
+
+		Returns:
+			`data` (or `dest`, if specified)
+		'''
+		if dest is None:
+			dest = self.data
+		dest.real[...] = self.iq[:, 0, :]
+		dest.imag[...] = self.iq[:, 1, :]
+		return dest
+
+	def load(self, values):
+		''' Fill `iq` from a sequence of `paths` complex arrays (or a `(paths, N)` complex array).
+		'''
+		assert len(values) == self.paths
+		for idx, value in enumerate(values):
+			self.iq[idx, 0, :] = np.real(value)
+			self.iq[idx, 1, :] = np.imag(value)
+
 
 
 # -------------------------OVERVIEW---------------------------------------
@@ -697,15 +824,115 @@ def DoubleArrayFactory(data_len):
 # ------------------------------------------------------------------------
 
 
+## \addtogroup FunctionTable-Py
+#
+# Foreign-function prototypes for every DLL call used by \ref RAW_VNA.
+#
+# Rather than re-assigning `argtypes` and `restype` on the shared DLL function
+# objects on every call, the prototypes are bound once, when the backend is loaded.
+#
+# Functions whose argument (or return) types depend on the length of the sweep
+# or calibration get a separate function object per array length. Those are
+# created on first use, and cached.
+#
+# @{
+
+## Prototypes for the DLL functions with a fixed signature, as `name -> (argtypes, restype)`.
+PROTOTYPES = {
+	"versionString"                     : ([],                                   ct.c_char_p),
+	"createTask"                        : ([],                                   TaskHandle),
+	"deleteTask"                        : ([TaskHandle],                         None),
+	"initialize"                        : ([TaskHandle, ct.c_void_p, ct.c_void_p], ErrCode),
+	"start"                             : ([TaskHandle],                         ErrCode),
+	"stop"                              : ([TaskHandle],                         ErrCode),
+	"setIPAddress"                      : ([TaskHandle, ct.c_char_p],            ErrCode),
+	"setIPPort"                         : ([TaskHandle, ct.c_int],               ErrCode),
+	"setTimeout"                        : ([TaskHandle, ct.c_uint],              ErrCode),
+	"setHopRate"                        : ([TaskHandle, HopRate],                ErrCode),
+	"setAttenuation"                    : ([TaskHandle, Attenuation],            ErrCode),
+	"getState"                          : ([TaskHandle],                         TaskState),
+	"getTimeout"                        : ([TaskHandle],                         ct.c_uint),
+	"getIPAddress"                      : ([TaskHandle],                         ct.c_char_p),
+	"getIPPort"                         : ([TaskHandle],                         ct.c_int),
+	"getHopRate"                        : ([TaskHandle],                         HopRate),
+	"getAttenuation"                    : ([TaskHandle],                         Attenuation),
+	"getNumberOfFrequencies"            : ([TaskHandle],                         ct.c_uint),
+	"getHardwareDetails"                : ([TaskHandle],                         HardwareDetails),
+	"utilNearestLegalFreq"              : ([TaskHandle, ct.POINTER(ct.c_double)], ErrCode),
+	"utilFixLinearSweepLimits"          : ([TaskHandle, ct.POINTER(ct.c_double), ct.POINTER(ct.c_double), ct.c_uint], ErrCode),
+	"utilPingUnit"                      : ([TaskHandle],                         ErrCode),
+	"utilGenerateLinearSweep"           : ([TaskHandle, ct.c_double, ct.c_double, ct.c_uint], ErrCode),
+	"measureCalibrationStep"            : ([TaskHandle, CalibrationStep],        ErrCode),
+	"interruptMeasurement"              : ([TaskHandle],                         ErrCode),
+	"clearCalibration"                  : ([TaskHandle],                         ErrCode),
+	"isCalibrationComplete"             : ([TaskHandle],                         ct.c_bool),
+	"hasFactoryCalibration"             : ([TaskHandle],                         ct.c_bool),
+	"importFactoryCalibration"          : ([TaskHandle],                         ErrCode),
+	"getCalibrationNumberOfFrequencies" : ([TaskHandle],                         ct.c_uint),
+}
+
+## Prototypes for the DLL functions whose types depend on an array length `N`,
+## as `name -> function(N) -> (argtypes, restype)`.
+ARRAY_PROTOTYPES = {
+	"setFrequencies"            : lambda N: ([TaskHandle, DoubleArrayFactory(N), ct.c_uint], ErrCode),
+	"getFrequencies"            : lambda N: ([TaskHandle, ct.POINTER(ct.c_double*N), ct.c_int], ErrCode),
+	"measureUncalibrated"       : lambda N: ([TaskHandle] + [ComplexDataFactory(N)] * 5, ErrCode),
+	"measure2PortCalibrated"    : lambda N: ([TaskHandle] + [ComplexDataFactory(N)] * 4, ErrCode),
+	"getCalibrationFrequencies" : lambda N: ([TaskHandle], ct.POINTER(ct.c_double*N)),
+	"exportCalibration"         : lambda N: ([TaskHandle] + [ComplexDataFactory(N)] * 12, ErrCode),
+	"importCalibration"         : lambda N: ([TaskHandle, ct.POINTER(ct.c_double), ct.c_uint] + [ComplexDataFactory(N)] * 12, ErrCode),
+}
+
+class FunctionTable(object):
+	''' Prototyped foreign functions for one loaded DLL backend.
+
+	Fixed-signature functions are plain attributes (e.g. `functions.getState`).
+	Array-length dependent functions are fetched with \ref array().
+	'''
+
+	def __init__(self, lib):
+		self.lib = lib
+		self.__arrays = {}
+
+		for name, (argtypes, restype) in PROTOTYPES.items():
+			func = self.__new_function(name)
+			func.argtypes = argtypes
+			func.restype  = restype
+			setattr(self, name, func)
+
+	def __new_function(self, name):
+		# Each call returns an independent function object, so prototypes
+		# for different array lengths do not clobber each other.
+		if isinstance(self.lib, ct.CDLL):
+			return self.lib._FuncPtr((name, self.lib))
+		return self.lib.function(name)
+
+	def array(self, name, data_len):
+		''' Get the function `name`, prototyped for arrays of length `data_len`.
+		'''
+		key = (name, data_len)
+		func = self.__arrays.get(key)
+		if func is None:
+			argtypes, restype = ARRAY_PROTOTYPES[name](data_len)
+			func = self.__new_function(name)
+			func.argtypes = argtypes
+			func.restype  = restype
+			self.__arrays[key] = func
+		return func
+
+## The \ref FunctionTable for the active backend.
+functions = FunctionTable(dll)
+
+## @}
+
+
 def versionString():
 	''' Returns a string describing the version of the DLL and its components.
 
 	Returns:
 		String describing the VNA DLL components and version numbers.
 	'''
-	tmp = dll.versionString
-	tmp.argtypes = []
-	tmp.restype = ct.c_char_p
+	tmp = functions.versionString
 	return tmp().decode('ascii')
 
 
@@ -726,15 +953,29 @@ class RAW_VNA(object):
 			Nothing
 
 		'''
-		tmp = dll.createTask
-		tmp.argtypes = []
-		tmp.restype = TaskHandle
+		tmp = functions.createTask
 		self.__task = tmp()
 
+		# Cached getNumberOfFrequencies() value, so the measurement calls don't
+		# need to query it every sweep. Reset by every call that can change the sweep.
+		self.__npts = None
+
 	def __del__(self):
 		if self.__task:
 			self.deleteTask()
 
+	def __sweep_points(self):
+		if self.__npts is None:
+			self.__npts = self.getNumberOfFrequencies()
+		return self.__npts
+
+	def __check_state_return(self, ret):
+		# handleReturnCode(), with the task state in the exception message.
+		# The state is only fetched when there is actually an error to report.
+		if ret != ERR_OK:
+			state = TaskStateBOOK.get(self.getState(), "Unknown")
+			handleReturnCode(ret, message="Current state = '%s'" % state)
+
 
 	def deleteTask(self):
 		''' Deletes the Task object. If the caller does
@@ -749,16 +990,14 @@ class RAW_VNA(object):
 			Nothing
 
 		'''
-		tmp = dll.deleteTask
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = None
+		tmp = functions.deleteTask
 		tmp(self.__task)
 
 		self.__task = None
 
 
 	def initialize(self):
-		''' Attempts to talk to the unit specified by the Task's IP address, and download
+		r''' Attempts to talk to the unit specified by the Task's IP address, and download
 		its details. If it succeeds the Task enters the TASK_STOPPED state.
 
 		Args:
@@ -776,14 +1015,13 @@ class RAW_VNA(object):
 		\exception ERR_BAD_PROM if the unit returned hardware details that this DLL doesn't understand
 		\exception ERR_WRONG_STATE if the Task is not in the TASK_UNINITIALIZED state
 		'''
-		tmp = dll.initialize
-		tmp.argtypes = [TaskHandle, ct.c_void_p, ct.c_void_p]
-		tmp.restype = ErrCode
+		tmp = functions.initialize
 		ret = tmp(self.__task, 0, 0)
+		self.__npts = None
 		handleReturnCode(ret)
 
 	def start(self):
-		''' Attempts to program the VNA using the settings stored in the Task object. If it
+		r''' Attempts to program the VNA using the settings stored in the Task object. If it
 		succeeds the Task enters the TASK_STARTED state.
 
 		Args:
@@ -804,17 +1042,13 @@ class RAW_VNA(object):
 		\exception ERR_PROG_OVERFLOW if the size of the program is too large for the hardware's memory
 				(this can happen if there are too many frequencies)
 		'''
-		tmp = dll.start
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ErrCode
+		tmp = functions.start
 		ret = tmp(self.__task)
-
-		state = TaskStateBOOK[self.getState()]
-		handleReturnCode(ret, message="Current state = '%s'" % state)
+		self.__check_state_return(ret)
 
 
 	def stop(self):
-		''' Puts the Task object into the TASK_STOPPED state.
+		r''' Puts the Task object into the TASK_STOPPED state.
 
 		Args:
 			Nothing
@@ -827,16 +1061,13 @@ class RAW_VNA(object):
 		\exception ERR_WRONG_STATE if the Task is not in the TASK_STARTED state
 
 		'''
-		tmp = dll.stop
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ErrCode
+		tmp = functions.stop
 		ret = tmp(self.__task)
-		state = TaskStateBOOK[self.getState()]
-		handleReturnCode(ret, message="Current state = '%s'" % state)
+		self.__check_state_return(ret)
 
 
 	def setIPAddress(self, ipv4):
-		''' Sets the IPv4 address on which to communicate with the unit. The ipv4 parameter is copied
+		r''' Sets the IPv4 address on which to communicate with the unit. The ipv4 parameter is copied
 		into the Task's memory. On success the Task's state will be TASK_UNINITIALIZED.
 		Example: `setIPAddress(t, "192.168.1.197");`
 
@@ -852,9 +1083,7 @@ class RAW_VNA(object):
 		\exception ERR_WRONG_STATE if the Task is not in the TASK_UNINITIALIZED or TASK_STOPPED state
 
 		'''
-		tmp = dll.setIPAddress
-		tmp.argtypes = [TaskHandle, ct.c_char_p]
-		tmp.restype = ErrCode
+		tmp = functions.setIPAddress
 
 		# Work on py3k and 2k
 		try:
@@ -863,11 +1092,12 @@ class RAW_VNA(object):
 			addr = bytes(ipv4)
 
 		ret = tmp(self.__task, addr)
+		self.__npts = None
 		handleReturnCode(ret)
 
 
 	def setIPPort(self, port):
-		''' Sets the port on which to communicate with the unit. Values should be >= 1024.
+		r''' Sets the port on which to communicate with the unit. Values should be >= 1024.
 		On success the Task's state will be TASK_UNINITIALIZED.
 
 
@@ -883,10 +1113,9 @@ class RAW_VNA(object):
 		\exception ERR_WRONG_STATE if the Task is not in the TASK_UNINITIALIZED or TASK_STOPPED state
 
 		'''
-		tmp = dll.setIPPort
-		tmp.argtypes = [TaskHandle, ct.c_int]
-		tmp.restype = ErrCode
+		tmp = functions.setIPPort
 		ret = tmp(self.__task, port)
+		self.__npts = None
 		handleReturnCode(ret)
 
 
@@ -906,9 +1135,7 @@ class RAW_VNA(object):
 			Nothing
 
 		'''
-		tmp = dll.setTimeout
-		tmp.argtypes = [TaskHandle, ct.c_uint]
-		tmp.restype = ErrCode
+		tmp = functions.setTimeout
 
 		# setTimeout ALWAYS returns ERR_OK, Check it anyways
 		ret = tmp(self.__task, timeout)
@@ -917,7 +1144,7 @@ class RAW_VNA(object):
 
 
 	def setHopRate(self, rate):
-		''' Set the frequency hopping rate. See the values defined above.
+		r''' Set the frequency hopping rate. See the values defined above.
 
 		Args:
 			rate - An instance of \ref HopRateSettings-Py.
@@ -931,15 +1158,13 @@ class RAW_VNA(object):
 		\exception ERR_WRONG_STATE if the Task is not in the TASK_UNINITIALIZED or TASK_STOPPED state
 
 		'''
-		tmp = dll.setHopRate
-		tmp.argtypes = [TaskHandle, HopRate]
-		tmp.restype = ErrCode
+		tmp = functions.setHopRate
 		ret = tmp(self.__task, rate)
 		handleReturnCode(ret)
 
 
 	def setAttenuation(self, atten):
-		''' Set the attenuation amount. See the values defined above.
+		r''' Set the attenuation amount. See the values defined above.
 
 		Args:
 			t - Task-Handle
@@ -954,15 +1179,13 @@ class RAW_VNA(object):
 		\exception ERR_WRONG_STATE if the Task is not in the TASK_UNINITIALIZED or TASK_STOPPED state
 
 		'''
-		tmp = dll.setAttenuation
-		tmp.argtypes = [TaskHandle, Attenuation]
-		tmp.restype = ErrCode
+		tmp = functions.setAttenuation
 		ret = tmp(self.__task, atten)
 		handleReturnCode(ret)
 
 
 	def setFrequencies(self, freqs, N):
-		''' Set the frequencies to measure during each sweep. Units are MHz. The freqs parameter
+		r''' Set the frequencies to measure during each sweep. Units are MHz. The freqs parameter
 		is an array of length N. Note that the VNA frequency generation hardware has fixed
 		precision and so the generated frequency may not be exactly equal to the requested
 		frequency. This function silently converts all requested frequencies to frequencies
@@ -997,10 +1220,9 @@ class RAW_VNA(object):
 		\exception ERR_TOO_MANY_POINTS if N is larger than the maximum allowed (see \ref HardwareDetails)
 
 		'''
-		tmp = dll.setFrequencies
-		tmp.argtypes = [TaskHandle, DoubleArrayFactory(N), ct.c_uint]
-		tmp.restype = ErrCode
+		tmp = functions.array("setFrequencies", N)
 		ret = tmp(self.__task, freqs, N)
+		self.__npts = None
 		handleReturnCode(ret)
 
 
@@ -1013,9 +1235,7 @@ class RAW_VNA(object):
 		Returns:
 			Returns one of the values defined in \ref TaskState-Py.
 		'''
-		tmp = dll.getState
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = TaskState
+		tmp = functions.getState
 		ret = tmp(self.__task)
 		return ret
 
@@ -1031,9 +1251,7 @@ class RAW_VNA(object):
 		Returns:
 			Integer timeout in milliseconds
 		'''
-		tmp = dll.getTimeout
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ct.c_uint
+		tmp = functions.getTimeout
 		ret = tmp(self.__task)
 		return ret
 
@@ -1047,9 +1265,7 @@ class RAW_VNA(object):
 			VNA IP Address or `None` if no IP has been set.
 
 		'''
-		tmp = dll.getIPAddress
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ct.c_char_p
+		tmp = functions.getIPAddress
 		ret = tmp(self.__task)
 		if ret:
 			ret = ret.decode("ascii")
@@ -1066,9 +1282,7 @@ class RAW_VNA(object):
 			Configured communication port. Defaults to 0 if not set.
 
 		'''
-		tmp = dll.getIPPort
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ct.c_int
+		tmp = functions.getIPPort
 		ret = tmp(self.__task)
 		return ret
 
@@ -1083,9 +1297,7 @@ class RAW_VNA(object):
 			If no rate has yet been set, this function returns HOP_UNDEFINED.
 
 		'''
-		tmp = dll.getHopRate
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = HopRate
+		tmp = functions.getHopRate
 		ret = tmp(self.__task)
 		return ret
 
@@ -1100,9 +1312,7 @@ class RAW_VNA(object):
 			If no rate has yet been set, this function returns ATTEN_UNDEFINED.
 
 		'''
-		tmp = dll.getAttenuation
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = Attenuation
+		tmp = functions.getAttenuation
 		ret = tmp(self.__task)
 		return ret
 
@@ -1120,9 +1330,7 @@ class RAW_VNA(object):
 			If no frequencies have been set, this function defaults to returning 0.
 
 		'''
-		tmp = dll.getNumberOfFrequencies
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ct.c_uint
+		tmp = functions.getNumberOfFrequencies
 		ret = tmp(self.__task)
 		return ret
 
@@ -1139,20 +1347,16 @@ class RAW_VNA(object):
 				If no frequencies have been set, this function returns 0.
 
 		'''
-		npts = self.getNumberOfFrequencies()
-		retarr = (ct.c_double*npts)()
+		npts = self.__sweep_points()
+		if not npts:
+			return np.empty([0])
 
-		tmp = dll.getFrequencies
-		tmp.argtypes = [TaskHandle, ct.POINTER(ct.c_double*npts), ct.c_int]
+		retarr = np.empty(npts, dtype=np.float64)
 
-		tmp.restype = ErrCode
-		ret = tmp(self.__task, ct.byref(retarr), npts)
+		tmp = functions.array("getFrequencies", npts)
+		ret = tmp(self.__task, ct.cast(retarr.ctypes.data, ct.POINTER(ct.c_double*npts)), npts)
 		handleReturnCode(ret)
 
-		if retarr:
-			retarr = np.array(retarr[:])
-		else:
-			retarr = np.empty([0])
 		return retarr
 
 
@@ -1170,14 +1374,12 @@ class RAW_VNA(object):
 			If the Task has not yet been initialized, the returned dict has all values set to 0.
 
 		'''
-		tmp = dll.getHardwareDetails
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = HardwareDetails
+		tmp = functions.getHardwareDetails
 		ret = tmp(self.__task)
 		return ret.to_dict()
 
 	def utilNearestLegalFreq(self, target_freq):
-		''' Adjusts a requested frequency, in MHz, to the nearest able to be generated by the
+		r''' Adjusts a requested frequency, in MHz, to the nearest able to be generated by the
 		VNA hardware. This is not available in the TASK_UNINITIALIZED state.
 
 		TODO: VALIDATE THIS!
@@ -1198,16 +1400,14 @@ class RAW_VNA(object):
 		'''
 
 		freq = ct.c_double(target_freq)
-		tmp = dll.utilNearestLegalFreq
-		tmp.argtypes = [TaskHandle, ct.POINTER(ct.c_double)]
-		tmp.restype = ErrCode
+		tmp = functions.utilNearestLegalFreq
 		ret = tmp(self.__task, ct.pointer(freq) )
 		handleReturnCode(ret)
 
-		return freq.val
+		return freq.value
 
 	def utilFixLinearSweepLimits(self, target_start_freq, target_end_freq, N):
-		''' Adjusts the start and end of a requested linear sweep with N points such that all
+		r''' Adjusts the start and end of a requested linear sweep with N points such that all
 		frequencies in the sweep will land on exactly generateable values, and the inter-point
 		spacing is constant across the entire scan. Unequal spacing can	cause doppler noise in
 		your data.
@@ -1240,9 +1440,7 @@ class RAW_VNA(object):
 		start_freq = ct.c_double(target_start_freq)
 		end_freq   = ct.c_double(target_end_freq)
 
-		tmp = dll.utilFixLinearSweepLimits
-		tmp.argtypes = [TaskHandle, ct.POINTER(ct.c_double), ct.POINTER(ct.c_double), ct.c_uint]
-		tmp.restype = ErrCode
+		tmp = functions.utilFixLinearSweepLimits
 		ret = tmp(self.__task, ct.pointer(start_freq), ct.pointer(end_freq), N )
 		handleReturnCode(ret)
 
@@ -1250,7 +1448,7 @@ class RAW_VNA(object):
 
 
 	def utilPingUnit(self):
-		''' Sends an "are you there" message to the unit.
+		r''' Sends an "are you there" message to the unit.
 
 		Note that this function should not be
 		called while a frequency sweep is ongoing, because it causes that sweep to prematurely
@@ -1277,15 +1475,13 @@ class RAW_VNA(object):
 		\exception ERR_MISSING_PORT if no port has been set
 
 		'''
-		tmp = dll.utilPingUnit
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ErrCode
+		tmp = functions.utilPingUnit
 		ret = tmp(self.__task)
 		handleReturnCode(ret)
 
 
 	def utilGenerateLinearSweep(self, startFreq, endFreq, N):
-		''' Generates a linear sweep with the requested parameters.
+		r''' Generates a linear sweep with the requested parameters.
 
 		Note that the start and end
 		frequency will be adjusted as documented in utilFixLinearSweepLimits() so that all
@@ -1310,15 +1506,14 @@ class RAW_VNA(object):
 		\exception ERR_TOO_MANY_POINTS if N is larger than the maximum allowed (see HardwareDetails)
 
 		'''
-		tmp = dll.utilGenerateLinearSweep
-		tmp.argtypes = [TaskHandle, ct.c_double, ct.c_double, ct.c_uint]
-		tmp.restype = ErrCode
+		tmp = functions.utilGenerateLinearSweep
 		ret = tmp(self.__task, startFreq, endFreq, N)
+		self.__npts = None
 		handleReturnCode(ret)
 
 
 	def measureUncalibrated(self):
-		''' Measures the paths through the VNA, without applying calibration.
+		r''' Measures the paths through the VNA, without applying calibration.
 
 		All 5 paths are always measured.
 
@@ -1348,36 +1543,47 @@ class RAW_VNA(object):
 
 		'''
 
-		N = self.getNumberOfFrequencies()
+		return tuple(self.measureUncalibratedArray())
 
-		T1R1 = ComplexDataFactory(N)()
-		T1R2 = ComplexDataFactory(N)()
-		T2R1 = ComplexDataFactory(N)()
-		T2R2 = ComplexDataFactory(N)()
-		Ref  = ComplexDataFactory(N)()
+	def measureUncalibratedArray(self, out=None, dest=None):
+		r''' Measures the paths through the VNA, without applying calibration, into
+		a preallocated (and reusable) \ref SweepBuffer.
 
+		This is the allocation-free version of \ref measureUncalibrated(). The DLL
+		writes directly into `out.iq`, which is then packed into `out.data`.
 
-		tmp = dll.measureUncalibrated
-		tmp.argtypes = [
-							TaskHandle,
-							ComplexDataFactory(N),
-							ComplexDataFactory(N),
-							ComplexDataFactory(N),
-							ComplexDataFactory(N),
-							ComplexDataFactory(N)
-						]
-		tmp.restype = ErrCode
+		Args:
+			out - \ref SweepBuffer with 5 paths and \ref getNumberOfFrequencies() points.
+			      If not specified, a new buffer is allocated.
+			dest - Optional `(5, N)` complex array to pack the result into, in place
+			       of `out.data` (e.g. one row of a larger preallocated array).
+
+		Returns:
+			`out.data` (or `dest`) - `(5, N)` complex numpy array. Rows are T1R1, T1R2, T2R1, T2R2, Ref.
+			The array is owned by `out`, and is overwritten by the next measurement into `out`.
 
-		ret = tmp(self.__task, T1R1, T1R2, T2R1, T2R2, Ref)
+		---
+
+		\exception ValueError if `out` does not match the current sweep.
+		Otherwise, as for \ref measureUncalibrated().
+
+		'''
 
-		state = TaskStateBOOK[self.getState()]
-		handleReturnCode(ret, message="Current state = '%s'" % state)
-		return (T1R1.toArray(), T1R2.toArray(), T2R1.toArray(), T2R2.toArray(), Ref.toArray())
+		N = self.__sweep_points()
+		if out is None:
+			out = SweepBuffer(5, N)
+		out.check(5, N)
+
+		tmp = functions.array("measureUncalibrated", N)
+
+		ret = tmp(self.__task, *out.structs)
+		self.__check_state_return(ret)
+		return out.pack(dest)
 
 
 
 	def measure2PortCalibrated(self):
-		''' Measures the S-parameter of the connected device, applying the current calibration.
+		r''' Measures the S-parameter of the connected device, applying the current calibration.
 
 		This command measures all 5 paths, as every path is required to properly apply the
 		calibration.
@@ -1409,26 +1615,47 @@ class RAW_VNA(object):
 
 		'''
 
-		N = self.getNumberOfFrequencies()
+		return tuple(self.measure2PortCalibratedArray())
+
+	def measure2PortCalibratedArray(self, out=None, dest=None):
+		r''' Measures the S-parameters of the connected device, applying the current
+		calibration, into a preallocated (and reusable) \ref SweepBuffer.
+
+		This is the allocation-free version of \ref measure2PortCalibrated().
+
+		Args:
+			out - \ref SweepBuffer with 4 paths and \ref getNumberOfFrequencies() points.
+			      If not specified, a new buffer is allocated.
+			dest - Optional `(4, N)` complex array to pack the result into, in place
+			       of `out.data` (e.g. one row of a larger preallocated array).
+
+		Returns:
+			`out.data` (or `dest`) - `(4, N)` complex numpy array. Rows are S11, S21, S12, S22.
+			The array is owned by `out`, and is overwritten by the next measurement into `out`.
+
+		---
+
+		\exception ValueError if `out` does not match the current sweep.
+		Otherwise, as for \ref measure2PortCalibrated().
+
+		'''
 
-		S11 = ComplexDataFactory(N)()
-		S21 = ComplexDataFactory(N)()
-		S12 = ComplexDataFactory(N)()
-		S22 = ComplexDataFactory(N)()
+		N = self.__sweep_points()
+		if out is None:
+			out = SweepBuffer(4, N)
+		out.check(4, N)
 
-		tmp = dll.measure2PortCalibrated
-		tmp.argtypes = [TaskHandle, ComplexDataFactory(N), ComplexDataFactory(N), ComplexDataFactory(N), ComplexDataFactory(N)]
-		tmp.restype = ErrCode
-		ret = tmp(self.__task, S11, S21, S12, S22)
+		tmp = functions.array("measure2PortCalibrated", N)
+		ret = tmp(self.__task, *out.structs)
 
 		handleReturnCode(ret)
 
-		return (S11.toArray(), S21.toArray(), S12.toArray(), S22.toArray())
+		return out.pack(dest)
 
 
 
 	def measureCalibrationStep(self, step):
-		''' Measures the paths necessary to get data for the requested calibration step.
+		r''' Measures the paths necessary to get data for the requested calibration step.
 
 		Note that this function blocks while the measurement is being performed. Use the
 		interruptMeasurement() function to prematurely halt a slow measurement.
@@ -1452,16 +1679,14 @@ class RAW_VNA(object):
 		\exception ERR_INTERRUPTED if the measurement was interrupted
 
 		'''
-		tmp = dll.measureCalibrationStep
-		tmp.argtypes = [TaskHandle, CalibrationStep]
-		tmp.restype = ErrCode
+		tmp = functions.measureCalibrationStep
 		ret = tmp(self.__task, step)
 
 		handleReturnCode(ret)
 
 
 	def interruptMeasurement(self):
-		''' Interrupts one of the measurement functions while it is waiting for data.
+		r''' Interrupts one of the measurement functions while it is waiting for data.
 
 		Since the measurement functions are blocking, this function must be called
 		from a different thread. This function returns immediately, however the
@@ -1476,9 +1701,7 @@ class RAW_VNA(object):
 		\exception ERR_WRONG_STATE if the Task is not in the TASK_STARTED state
 
 		'''
-		tmp = dll.interruptMeasurement
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ErrCode
+		tmp = functions.interruptMeasurement
 		ret = tmp(self.__task)
 
 		handleReturnCode(ret)
@@ -1498,9 +1721,7 @@ class RAW_VNA(object):
 		Will never throw an exception
 
 		'''
-		tmp = dll.clearCalibration
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ErrCode
+		tmp = functions.clearCalibration
 		ret = tmp(self.__task)
 		handleReturnCode(ret)
 
@@ -1515,9 +1736,7 @@ class RAW_VNA(object):
 			True if the task has calibration parameters. False if it does not.
 
 		'''
-		tmp = dll.isCalibrationComplete
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ct.c_bool
+		tmp = functions.isCalibrationComplete
 		ret = tmp(self.__task)
 		return ret
 
@@ -1532,14 +1751,12 @@ class RAW_VNA(object):
 			True if the connected VNA has a factory calibration in it's PROM. False if it does not.
 
 		'''
-		tmp = dll.hasFactoryCalibration
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ct.c_bool
+		tmp = functions.hasFactoryCalibration
 		ret = tmp(self.__task)
 		return ret
 
 	def importFactoryCalibration(self):
-		''' Load the calibration from the VNA's embedded PROM into the current task.
+		r''' Load the calibration from the VNA's embedded PROM into the current task.
 
 		Args:
 			None
@@ -1552,9 +1769,7 @@ class RAW_VNA(object):
 			\exception ERR_WRONG_STATE if the task is not in the TASK_STOPPED or TASK_STARTED state
 
 		'''
-		tmp = dll.importFactoryCalibration
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ErrCode
+		tmp = functions.importFactoryCalibration
 		ret = tmp(self.__task)
 		if ret == ERR_BAD_CAL:
 			raise vnaexceptions.VNA_Exception_Bad_Cal("The embedded VNA calibration is either damaged, or not present.")
@@ -1573,9 +1788,7 @@ class RAW_VNA(object):
 
 
 		'''
-		tmp = dll.getCalibrationNumberOfFrequencies
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ct.c_uint
+		tmp = functions.getCalibrationNumberOfFrequencies
 		ret = tmp(self.__task)
 		return ret
 
@@ -1593,20 +1806,18 @@ class RAW_VNA(object):
 		'''
 
 		N = self.getCalibrationNumberOfFrequencies()
-		tmp = dll.getCalibrationFrequencies
-		tmp.argtypes = [TaskHandle]
-		tmp.restype = ct.POINTER(ct.c_double*N)
+		tmp = functions.array("getCalibrationFrequencies", N)
 
 		ret = tmp(self.__task)
 		if ret:
-			ret = np.array(ret.contents[:])
+			ret = np.ctypeslib.as_array(ret.contents).copy()
 		else:
 			ret = np.empty([0])
 		return ret
 
 
 	def exportCalibration(self):
-		''' Retreives the calibration arrays from the current task.
+		r''' Retreives the calibration arrays from the current task.
 
 		Note that to fully contain a calibration the caller must also get the frequency list
 		and number of frequencies.
@@ -1643,44 +1854,42 @@ class RAW_VNA(object):
 
 		'''
 
-		N = self.getCalibrationNumberOfFrequencies()
+		return tuple(self.exportCalibrationArray())
+
+	def exportCalibrationArray(self, out=None):
+		r''' Retreives the calibration arrays from the current task into a
+		preallocated (and reusable) \ref SweepBuffer.
+
+		Args:
+			out - \ref SweepBuffer with 12 paths and \ref getCalibrationNumberOfFrequencies() points.
+			      If not specified, a new buffer is allocated.
+
+		Returns:
+			`out.data` - `(12, N)` complex numpy array. Rows are in the order
+			returned by \ref exportCalibration().
+
+		---
+
+		\exception ERR_BAD_CAL if isCalibrationComplete() returns false
+		\exception ValueError if `out` does not match the calibration length.
 
-		e00      = ComplexDataFactory(N)()
-		e11      = ComplexDataFactory(N)()
-		e10e01   = ComplexDataFactory(N)()
-		e30      = ComplexDataFactory(N)()
-		e22      = ComplexDataFactory(N)()
-		e10e32   = ComplexDataFactory(N)()
-		ep33     = ComplexDataFactory(N)()
-		ep22     = ComplexDataFactory(N)()
-		ep12ep32 = ComplexDataFactory(N)()
-		ep03     = ComplexDataFactory(N)()
-		ep11     = ComplexDataFactory(N)()
-		ep23ep01 = ComplexDataFactory(N)()
-
-		tmp = dll.exportCalibration
-		tmp.argtypes = [TaskHandle] + [ComplexDataFactory(N)] * 12
-		tmp.restype = ErrCode
-		ret = tmp(self.__task, e00, e11, e10e01, e30, e22, e10e32, ep33, ep22, ep12ep32, ep03, ep11, ep23ep01)
+		'''
+
+		N = self.getCalibrationNumberOfFrequencies()
+		if N == 0:
+			raise vnaexceptions.VNA_Exception_Bad_Cal("No calibration to export!")
+		if out is None:
+			out = SweepBuffer(12, N)
+		out.check(12, N)
+
+		tmp = functions.array("exportCalibration", N)
+		ret = tmp(self.__task, *out.structs)
 		handleReturnCode(ret)
 
-		return (
-					e00.toArray(),
-					e11.toArray(),
-					e10e01.toArray(),
-					e30.toArray(),
-					e22.toArray(),
-					e10e32.toArray(),
-					ep33.toArray(),
-					ep22.toArray(),
-					ep12ep32.toArray(),
-					ep03.toArray(),
-					ep11.toArray(),
-					ep23ep01.toArray()
-			)
+		return out.pack()
 
 	def importCalibration(self, freqs, e00, e11, e10e01, e30, e22, e10e32, ep33, ep22, ep12ep32, ep03, ep11, ep23ep01):
-		''' Imports calibration coefficients from caller provided arrays.
+		r''' Imports calibration coefficients from caller provided arrays.
 
 		Note that these frequencies do not have to be exactly generateable by the hardware.
 		At import an interpolated calibration is generated that matches the current sweep settings.
@@ -1722,38 +1931,43 @@ class RAW_VNA(object):
 		assert N == len(e00)  == len(e11)  == len(e10e01)   == len(e30)  == len(e22)  == len(e10e32) \
 				 == len(ep33) == len(ep22) == len(ep12ep32) == len(ep03) == len(ep11) == len(ep23ep01)
 
-		carr_freqs    = (ct.c_double * N)(*freqs)
-		carr_e00      = ComplexDataArrayFromNumpyArray(e00)
-		carr_e11      = ComplexDataArrayFromNumpyArray(e11)
-		carr_e10e01   = ComplexDataArrayFromNumpyArray(e10e01)
-		carr_e30      = ComplexDataArrayFromNumpyArray(e30)
-		carr_e22      = ComplexDataArrayFromNumpyArray(e22)
-		carr_e10e32   = ComplexDataArrayFromNumpyArray(e10e32)
-		carr_ep33     = ComplexDataArrayFromNumpyArray(ep33)
-		carr_ep22     = ComplexDataArrayFromNumpyArray(ep22)
-		carr_ep12ep32 = ComplexDataArrayFromNumpyArray(ep12ep32)
-		carr_ep03     = ComplexDataArrayFromNumpyArray(ep03)
-		carr_ep11     = ComplexDataArrayFromNumpyArray(ep11)
-		carr_ep23ep01 = ComplexDataArrayFromNumpyArray(ep23ep01)
-
-		tmp = dll.importCalibration
-		tmp.argtypes = [TaskHandle, ct.POINTER(ct.c_double), ct.c_uint] + [ComplexDataFactory(N)] * 12
-		tmp.restype = ErrCode
+		terms = SweepBuffer(12, N)
+		terms.load((e00, e11, e10e01, e30, e22, e10e32, ep33, ep22, ep12ep32, ep03, ep11, ep23ep01))
+		self.importCalibrationArray(freqs, terms)
+
+	def importCalibrationArray(self, freqs, terms):
+		r''' Imports calibration coefficients from a \ref SweepBuffer (or a `(12, N)` complex array).
+
+		This is the array version of \ref importCalibration(). Passing a \ref SweepBuffer
+		that already holds the terms (e.g. one filled by \ref exportCalibrationArray())
+		hands its memory to the DLL directly, without any conversion.
+
+		Args:
+			freqs - Array of `N` frequency points for the calibration data, in Mhz.
+			terms - \ref SweepBuffer with 12 paths, or a `(12, N)` complex array, with
+			        rows in the order taken by \ref importCalibration().
+
+		---
+
+		\exception ERR_BAD_CAL if any of the array pointers are null
+		\exception ERR_WRONG_STATE if the Task is not in the TASK_STOPPED or TASK_STARTED state
+
+		'''
+
+		freqs = np.ascontiguousarray(freqs, dtype=np.float64)
+		N = freqs.shape[0]
+
+		if not isinstance(terms, SweepBuffer):
+			values = terms
+			terms = SweepBuffer(12, N)
+			terms.load(values)
+		terms.check(12, N)
+
+		tmp = functions.array("importCalibration", N)
 		ret = tmp(self.__task,
-				carr_freqs,
+				freqs.ctypes.data_as(ct.POINTER(ct.c_double)),
 				N,
-				carr_e00,
-				carr_e11,
-				carr_e10e01,
-				carr_e30,
-				carr_e22,
-				carr_e10e32,
-				carr_ep33,
-				carr_ep22,
-				carr_ep12ep32,
-				carr_ep03,
-				carr_ep11,
-				carr_ep23ep01)
+				*terms.structs)
 		handleReturnCode(ret)
 
 
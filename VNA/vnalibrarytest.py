@@ -2,7 +2,13 @@
 
 
 from . import vnalibrary as vnal
+from . import vnaclass
+from . import vnasim
+from . import calutil
+from . import calfile
+from . import archive
 
+import collections
 import numpy as np
 import time
 import unittest
@@ -92,6 +98,11 @@ class TestVnaNoHardwarePresent(unittest.TestCase):
 		self.assertEqual(val, 155)
 
 
+# The remaining test-cases talk to a physical unit, which the simulated
+# backend cannot stand in for (they check that specific unit's details).
+requires_hardware = unittest.skipIf(vnal.BACKEND == "sim", "Requires physical VNA hardware")
+
+@requires_hardware
 class TestVnaCommsHardwarePresent(unittest.TestCase):
 
 	def setUp(self):
@@ -109,6 +120,7 @@ class TestVnaCommsHardwarePresent(unittest.TestCase):
 		pass
 
 
+@requires_hardware
 class TestVnaHardwarePresent(unittest.TestCase):
 
 	def setUp(self):
@@ -215,6 +227,7 @@ class TestVnaHardwarePresent(unittest.TestCase):
 	def test_ping_unit(self):
 		self.vna.utilPingUnit()
 
+@requires_hardware
 class TestVnaAcquisition(unittest.TestCase):
 
 	def setUp(self):
@@ -296,6 +309,1284 @@ class TestVnaAcquisition(unittest.TestCase):
 
 
 
+@unittest.skipIf(vnal.BACKEND != "sim", "Requires the simulated backend (VNA_BACKEND=sim)")
+class TestVnaSimulator(unittest.TestCase):
+
+	def setUp(self):
+		vnal.dll.time_scale = 0
+		self.vna = vnal.RAW_VNA()
+
+		self.vna.setIPAddress("192.168.1.207")
+		self.vna.setIPPort(1026)
+		self.vna.initialize()
+
+		self.vna.setAttenuation(vnal.ATTEN_0)
+		self.vna.setHopRate(vnal.HOP_45K)
+		self.vna.utilGenerateLinearSweep(400, 1500, 256)
+
+	def tearDown(self):
+		vnal.dll.time_scale = 1.0
+
+	def test_state_machine(self):
+		self.assertEqual(self.vna.getState(), vnal.TASK_STOPPED)
+		self.assertRaises(vnal.vnaexceptions.VNA_Exception_Wrong_State, self.vna.measureUncalibrated)
+		self.vna.start()
+		self.assertEqual(self.vna.getState(), vnal.TASK_STARTED)
+		self.assertRaises(vnal.vnaexceptions.VNA_Exception_Wrong_State, self.vna.setIPAddress, "192.168.1.208")
+		self.vna.stop()
+		self.vna.setIPAddress("192.168.1.208")
+		self.assertEqual(self.vna.getState(), vnal.TASK_UNINITIALIZED)
+
+	def test_legal_frequencies(self):
+		start, stop = self.vna.utilFixLinearSweepLimits(400, 1500, 8)
+		self.vna.utilGenerateLinearSweep(400, 1500, 8)
+		freqs = self.vna.getFrequencies()
+		self.assertEqual(freqs[0], start)
+		self.assertEqual(freqs[-1], stop)
+		self.assertTrue(np.allclose(np.diff(freqs), np.diff(freqs)[0]))
+		self.assertEqual(self.vna.utilNearestLegalFreq(freqs[3]), freqs[3])
+		self.assertRaises(vnal.vnaexceptions.VNA_Exception_Freq_Out_Of_Bounds, self.vna.utilGenerateLinearSweep, 100, 1500, 8)
+
+	def test_full_span_sweep(self):
+		# The demo app's default sweep covers the whole hardware range.
+		vna = vnaclass.VNA("192.168.1.207", 1026)
+		for count in (256, 1024, 7):
+			vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=[375, 6050, count])
+			freqs = vna.getFrequencies()
+			self.assertEqual(freqs.shape[0], count)
+			self.assertGreaterEqual(freqs[0], 375)
+			self.assertLessEqual(freqs[-1], 6050)
+
+	def test_sweep_timing(self):
+		vnal.dll.time_scale = 1.0
+		self.vna.setHopRate(vnal.HOP_7K)
+		self.vna.start()
+		then = time.time()
+		self.vna.measureUncalibrated()
+		# One pass per transmitting port at 7000 hops/second
+		self.assertGreaterEqual(time.time() - then, 2 * 256 / 7000.0)
+
+	def test_factory_calibration(self):
+		self.vna.start()
+		self.assertFalse(self.vna.isCalibrationComplete())
+		self.assertTrue(self.vna.hasFactoryCalibration())
+		self.vna.importFactoryCalibration()
+		self.assertTrue(self.vna.isCalibrationComplete())
+
+		S11, S21, S12, S22 = self.vna.measure2PortCalibrated()
+		expect = vnal.dll.dut(self.vna.getFrequencies())
+		for measured, actual in zip((S11, S21, S12, S22), expect):
+			self.assertTrue(np.allclose(measured, actual, atol=1e-2))
+
+	def test_solt_calibration(self):
+		self.vna.start()
+		for step in vnal.CalibrationStepBOOK:
+			self.vna.measureCalibrationStep(step)
+		self.assertTrue(self.vna.isCalibrationComplete())
+		self.assertEqual(self.vna.getCalibrationNumberOfFrequencies(), 256)
+
+		S11, S21, S12, S22 = self.vna.measure2PortCalibrated()
+		expect = vnal.dll.dut(self.vna.getFrequencies())
+		self.assertTrue(np.allclose(S21, expect[1], atol=1e-2))
+
+	def test_sweep_buffer_reuse(self):
+		self.vna.start()
+		buf = vnal.SweepBuffer(5, 256)
+		first = self.vna.measureUncalibratedArray(buf)
+		self.assertIs(first, buf.data)
+		self.assertEqual(first.shape, (5, 256))
+		self.assertTrue(np.all(first[4] != 0))
+
+		T1R1 = first[0].copy()
+		second = self.vna.measureUncalibratedArray(buf)
+		self.assertIs(second, first)
+		self.assertFalse(np.array_equal(T1R1, second[0]))
+
+		self.assertRaises(ValueError, self.vna.measureUncalibratedArray, vnal.SweepBuffer(5, 128))
+		self.assertRaises(ValueError, self.vna.measure2PortCalibratedArray, vnal.SweepBuffer(5, 256))
+
+	def test_calibration_array_roundtrip(self):
+		self.vna.importFactoryCalibration()
+		freqs = self.vna.getCalibrationFrequencies()
+		terms = self.vna.exportCalibrationArray()
+		self.assertEqual(terms.shape, (12, freqs.shape[0]))
+
+		self.vna.clearCalibration()
+		self.vna.importCalibrationArray(freqs[::2], terms[:, ::2])
+		self.assertTrue(np.array_equal(self.vna.exportCalibrationArray(), terms[:, ::2]))
+
+		self.vna.importCalibration(freqs, *terms)
+		self.assertTrue(all(np.array_equal(a, b) for a, b in zip(self.vna.exportCalibration(), terms)))
+		self.assertTrue(np.array_equal(self.vna.getCalibrationFrequencies(), freqs))
+
+	def test_prototypes_bound_once(self):
+		self.vna.start()
+		func = vnal.functions.array("measureUncalibrated", 256)
+		argtypes = func.argtypes
+		self.vna.measureUncalibratedArray()
+		self.assertIs(vnal.functions.array("measureUncalibrated", 256), func)
+		self.assertIs(func.argtypes, argtypes)
+		self.assertIsNot(vnal.functions.array("measureUncalibrated", 128), func)
+
+		# A sweep change must be picked up by the cached point count.
+		self.vna.stop()
+		self.vna.utilGenerateLinearSweep(400, 1500, 128)
+		self.vna.start()
+		self.assertEqual(self.vna.measureUncalibratedArray().shape, (5, 128))
+
+	def test_measure_batch(self):
+		vna = vnaclass.VNA("192.168.1.210", 1026)
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+		vna.start()
+
+		batch = vna.measure_batch(3)
+		self.assertEqual(batch.data.shape, (3, 5, 64))
+		self.assertEqual(batch.paths, vnaclass.UNCAL_PATHS)
+		self.assertTrue(np.all(np.diff(batch.timestamps) >= 0))
+		self.assertFalse(np.array_equal(batch.data[0], batch.data[1]))
+
+		vna.importFactoryCalibration()
+		out = np.zeros((2, 4, 64), dtype=np.complex128)
+		batch = vna.measure_batch(2, calibrated=True, out=out)
+		self.assertIs(batch.data, out)
+		expect = vnal.dll.dut(vna.getFrequencies())
+		self.assertTrue(np.allclose(out[:, 1], expect[1], atol=1e-2))
+
+		self.assertRaises(ValueError, vna.measure_batch, 2, out=out)
+		vna.stop()
+
+	def test_stream(self):
+		vna = vnaclass.VNA("192.168.1.210", 1026)
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+		vna.start()
+
+		sweeps = [(sweep.sequence, sweep.data.copy()) for sweep in vna.stream(count=4)]
+		self.assertEqual([seq for seq, data in sweeps], [0, 1, 2, 3])
+		self.assertEqual(sweeps[0][1].shape, (5, 64))
+		self.assertFalse(np.array_equal(sweeps[0][1], sweeps[3][1]))
+
+		# Closing the stream mid-sweep interrupts the in-flight measurement.
+		vnal.dll.time_scale = 0.2
+		stream = vna.stream(depth=2)
+		first = next(stream)
+		self.assertEqual(first.paths, vnaclass.UNCAL_PATHS)
+		start = time.time()
+		stream.close()
+		self.assertLess(time.time() - start, 0.5)
+		self.assertEqual(vna.getState(), vnal.TASK_STARTED)
+
+		vnal.dll.time_scale = 0
+		vnal.dll.inject_error("measureUncalibrated", "ERR_NO_RESPONSE")
+		self.assertRaises(vnal.vnaexceptions.VNA_Exception_No_Response, list, vna.stream(count=3))
+		vna.stop()
+
+	def test_async_front_end(self):
+		try:
+			import asyncio
+			from . import vnaasync
+		except (ImportError, SyntaxError):
+			raise unittest.SkipTest("asyncio front-end needs Python 3.7+")
+
+		async def run():
+			dev = await vnaasync.AsyncVNA.connect("192.168.1.211", 1026)
+			await dev.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+			await dev.start()
+
+			raw = await dev.measureUncalibrated()
+			self.assertEqual(len(raw), 5)
+
+			seqs = []
+			async for sweep in dev.sweeps(count=3):
+				self.assertEqual(sweep.data.shape, (5, 64))
+				seqs.append(sweep.sequence)
+			self.assertEqual(seqs, [0, 1, 2])
+
+			# Cancellation aborts a long sweep through interruptMeasurement()
+			vnal.dll.time_scale = 100.0
+			task = asyncio.ensure_future(dev.measure_uncal())
+			await asyncio.sleep(0.05)
+			start = time.time()
+			task.cancel()
+			with self.assertRaises(asyncio.CancelledError):
+				await task
+			self.assertLess(time.time() - start, 1.0)
+
+			# So does awaiting interruptMeasurement() while the sweep holds the unit.
+			task = asyncio.ensure_future(dev.measure_uncal())
+			await asyncio.sleep(0.05)
+			start = time.time()
+			await asyncio.wait_for(dev.interruptMeasurement(), 1.0)
+			with self.assertRaises(vnal.vnaexceptions.VNA_Exception_Interrupted):
+				await task
+			self.assertLess(time.time() - start, 1.0)
+			vnal.dll.time_scale = 0
+
+			self.assertEqual(await dev.getState(), vnal.TASK_STARTED)
+			self.assertEqual(len(await dev.measure_uncal()), 5)
+			await dev.stop()
+
+		asyncio.run(run())
+
+	def test_fleet(self):
+		from . import fleet
+		units = {}
+		for num in range(4):
+			unit = vnaclass.VNA("192.168.1.%s" % (220 + num), 1026)
+			unit.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 32))
+			unit.start()
+			units["unit-%s" % num] = unit
+
+		# One unit hangs. It must be interrupted and failed, without holding up the others.
+		hung = vnal.dll.unit_for("192.168.1.223", 1026)
+		hung.stall = 30.0
+		try:
+			with fleet.Fleet(units, workers=2, sweep_timeout=0.3) as pool:
+				for name in ["unit-0", "unit-1", "unit-2"]:
+					seqs = [sweep.sequence for sweep in pool.stream(name, count=5, timeout=5)]
+					self.assertEqual(seqs, list(range(5)))
+
+				self.assertRaises(vnal.vnaexceptions.VNA_Exception_No_Response, pool.get, "unit-3", 5)
+				stats = pool.stats()
+				self.assertEqual(stats.failed, ["unit-3"])
+				self.assertEqual(stats.per_unit["unit-3"], 0)
+				self.assertGreaterEqual(stats.sweeps, 15)
+				self.assertGreater(stats.rate, 0)
+		finally:
+			hung.stall = 0.0
+
+		# An interrupt that didn't come from the watchdog is not reported as a timeout.
+		hung.stall = 30.0
+		try:
+			with fleet.Fleet({"unit-3" : units["unit-3"]}, workers=1, sweep_timeout=30) as pool:
+				while pool.units["unit-3"].started is None:
+					time.sleep(0.01)
+				time.sleep(0.05)
+				units["unit-3"].interruptMeasurement()
+				self.assertRaises(vnal.vnaexceptions.VNA_Exception_Interrupted, pool.get, "unit-3", 5)
+		finally:
+			hung.stall = 0.0
+
+		seen = collections.Counter()
+		with fleet.Fleet(list(units.values()), workers=3, callback=lambda name, sweep: seen.update([name])) as pool:
+			self.assertEqual(pool.sweep_timeout, fleet.SWEEP_TIMEOUT)
+			while sum(seen.values()) < 40:
+				time.sleep(0.01)
+		self.assertEqual(len(seen), 4)
+		self.assertIn("192.168.1.220:1026", seen)
+
+		for unit in units.values():
+			self.assertEqual(unit.getState(), vnal.TASK_STARTED)
+			unit.stop()
+
+	def test_fleet_connect(self):
+		from . import fleet
+		addresses = [("192.168.1.%s" % (230 + num), 1026) for num in range(6)]
+		seen = []
+		vnal.dll.time_scale = 0.05
+		vnal.dll.inject_error("initialize", "ERR_NO_RESPONSE")
+
+		start = time.time()
+		units = fleet.connect(addresses, progress=lambda *args: seen.append(args))
+		elapsed = time.time() - start
+		vnal.dll.time_scale = 0
+
+		# Serially, this would take 6 * init_delay * time_scale = 0.6 seconds
+		self.assertLess(elapsed, 0.4)
+		self.assertEqual(len(units.ready), 5)
+		self.assertEqual(len(units.failed), 1)
+		failed = list(units.failed.values())[0]
+		self.assertIsInstance(failed, vnal.vnaexceptions.VNA_Exception_No_Response)
+		self.assertEqual([done for name, done, total, error in seen], list(range(1, 7)))
+		self.assertEqual(list(units.ready), [name for name in ["%s:%s" % addr for addr in addresses] if name not in units.failed])
+		for unit in units.ready.values():
+			self.assertEqual(unit.getState(), vnal.TASK_STOPPED)
+
+	def test_factory_cal_cache(self):
+		import os
+		import shutil
+		import tempfile
+		cache_dir = tempfile.mkdtemp()
+		try:
+			vna = vnaclass.VNA("192.168.1.212", 1026)
+			vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+			self.assertEqual(vna.load_factory_cal(cache_dir), "prom")
+			from_prom = vna.exportCalibrationArray().copy()
+
+			serial = vna.getHardwareDetails()['serial_number']
+			path = vnaclass.factory_cal_cache_path(serial, cache_dir)
+			self.assertTrue(os.path.exists(path))
+
+			vna = vnaclass.VNA("192.168.1.212", 1026)
+			vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+			self.assertEqual(vna.load_factory_cal(cache_dir), "cache")
+			self.assertTrue(np.array_equal(vna.exportCalibrationArray(), from_prom))
+			vna.start()
+			expect = vnal.dll.dut(vna.getFrequencies())
+			self.assertTrue(np.allclose(vna.measure_cal().S21, expect[1], atol=1e-2))
+			vna.stop()
+
+			# A different unit never picks up this unit's cache.
+			other = vnaclass.VNA("192.168.1.213", 1026)
+			shutil.copy(path, vnaclass.factory_cal_cache_path(other.getHardwareDetails()['serial_number'], cache_dir))
+			self.assertEqual(other.load_factory_cal(cache_dir), "prom")
+
+			with open(path, "wb") as fp:
+				fp.write(b"garbage")
+			self.assertEqual(vna.load_factory_cal(cache_dir), "prom")
+			self.assertEqual(vna.load_factory_cal(cache_dir), "cache")
+
+			# A cache cut short (e.g. by a run killed while writing it) falls back to
+			# the PROM, and is rebuilt.
+			with open(path, "rb") as fp:
+				whole = fp.read()
+			for size in (len(whole) // 2, len(whole) - 1):
+				with open(path, "wb") as fp:
+					fp.write(whole[:size])
+				self.assertEqual(vna.load_factory_cal(cache_dir), "prom")
+				self.assertEqual(os.path.getsize(path), len(whole))
+				self.assertEqual(vna.load_factory_cal(cache_dir), "cache")
+		finally:
+			shutil.rmtree(cache_dir)
+
+	def test_software_cal(self):
+		import os
+		import shutil
+		import tempfile
+		vna = vnaclass.VNA("192.168.1.214", 1026)
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+		vna.start()
+		self.assertRaises(vnal.vnaexceptions.VNA_Exception_Bad_Cal, vna.measure_softcal)
+
+		vna.importFactoryCalibration()
+		vna.set_software_cal()
+		expect = vnal.dll.dut(vna.getFrequencies())
+		ret = vna.measure_softcal()
+		self.assertEqual(ret.raw.shape, (5, 64))
+		for idx in range(4):
+			self.assertTrue(np.allclose(ret.sparams[idx], expect[idx], atol=1e-2))
+
+		batch = vna.measure_batch(3)
+		out = np.empty((3, 4, 64), dtype=np.complex128)
+		self.assertIs(vna.apply_software_cal(batch.data, out=out), out)
+		self.assertTrue(np.allclose(out[:, 1], expect[1], atol=1e-2))
+
+		# The sweep grid is only looked up again after the sweep is reconfigured.
+		calls = []
+		get_frequencies = vna.getFrequencies
+		vna.getFrequencies = lambda: calls.append(1) or get_frequencies()
+		for dummy in range(3):
+			vna.apply_software_cal(batch.data, out=out)
+		self.assertEqual(calls, [])
+		vna.stop()
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(500, 1400, 32))
+		del calls[:]
+		vna.start()
+		for dummy in range(3):
+			sparams = vna.measure_softcal().sparams
+		self.assertEqual(len(calls), 1)
+		del vna.getFrequencies
+		self.assertTrue(np.allclose(sparams[1], vnal.dll.dut(vna.getFrequencies())[1], atol=1e-2))
+		vna.stop()
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+		vna.start()
+
+		# Record raw, then re-correct offline with the calibration.
+		archive = tempfile.mkdtemp()
+		try:
+			fnames = []
+			for num in range(3):
+				fnames.append(os.path.join(archive, "run%s.npz" % num))
+				calutil.save_raw_sweeps(fnames[-1], vna.getFrequencies(), vna.measure_batch(2).data, serial=num)
+			cal_f, cal_terms = vna.getCalibrationFrequencies(), vna.exportCalibrationArray()
+			outnames = calutil.recorrect_raw_sweeps(fnames, cal_f, cal_terms, workers=2)
+			self.assertEqual(outnames, [os.path.join(archive, "run%s_cal.npz" % num) for num in range(3)])
+			with np.load(outnames[2]) as dat:
+				self.assertEqual(dat['sparams'].shape, (2, 4, 64))
+				self.assertEqual(int(dat['serial']), 2)
+				self.assertTrue(np.allclose(dat['sparams'][:, 1], expect[1], atol=1e-2))
+		finally:
+			shutil.rmtree(archive)
+		vna.stop()
+
+	def test_calibration_files(self):
+		import os
+		import pickle
+		import shutil
+		import tempfile
+		dirpath = tempfile.mkdtemp()
+		try:
+			vna = vnaclass.VNA("192.168.1.215", 1026)
+			vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+			vna.importFactoryCalibration()
+			cal_f, cal_p = vna.getCalibrationFrequencies(), vna.exportCalibrationArray().copy()
+			serial = vna.getHardwareDetails()['serial_number']
+
+			fname = os.path.join(dirpath, "cal.vnacal")
+			vna.save_dll_cal(fname)
+			cal = calfile.read_calfile(fname)
+			self.assertIsInstance(cal.terms, np.memmap)
+			self.assertEqual(cal.header['serial_number'], serial)
+			self.assertEqual(cal.header['address'], "192.168.1.215")
+			self.assertTrue(np.array_equal(cal.freqs, cal_f))
+			self.assertTrue(np.array_equal(cal.terms, cal_p))
+			self.assertEqual(cal.header['terms_offset'] % 64, 0)
+
+			vna.clearCalibration()
+			vna.load_dll_cal(fname)
+			self.assertTrue(np.array_equal(vna.exportCalibrationArray(), cal_p))
+
+			other = vnaclass.VNA("192.168.1.216", 1026)
+			self.assertRaises(vnal.vnaexceptions.VNA_Exception_Bad_Cal, other.load_dll_cal, fname)
+			other.load_dll_cal(fname, checkip=False, checkserial=False)
+
+			# Older formats
+			pikname = os.path.join(dirpath, "cal.pik")
+			with open(pikname, "wb") as fp:
+				pickle.dump({"time": 1.0, "address": "192.168.1.215", "hardware": vna.getHardwareDetails(),
+						"cal_f": cal_f, "cal_p": tuple(cal_p)}, fp)
+			csvname = os.path.join(dirpath, "cal.csv")
+			cols = [cal_f] + [part for term in cal_p for part in (term.real, term.imag)]
+			np.savetxt(csvname, np.array(cols).T, delimiter=",", header="Freq,...", comments="")
+
+			for src in [pikname, csvname]:
+				cal = calfile.import_calibration(src)
+				self.assertTrue(np.allclose(cal.terms, cal_p, rtol=1e-12, atol=0))
+				converted = calfile.convert_calibration(src, os.path.join(dirpath, "converted.vnacal"))
+				self.assertTrue(np.array_equal(converted.terms, cal.terms))
+			self.assertEqual(calfile.import_calibration(pikname).header['serial_number'], serial)
+
+			# Headers that parse, but do not describe the data blocks.
+			import json
+			badname = os.path.join(dirpath, "bad.vnacal")
+			for header in [{"freqs_offset": 512, "terms_offset": 1024}, {"points": "8", "freqs_offset": 512, "terms_offset": 1024},
+					{"points": 8, "freqs_offset": None, "terms_offset": 1024}, {"points": 8, "freqs_offset": 512, "terms_offset": 520}, [8]]:
+				blob = json.dumps(header).encode("utf-8")
+				with open(badname, "wb") as fp:
+					fp.write(calfile._PREFIX.pack(calfile.CALFILE_MAGIC, calfile.CALFILE_VERSION, len(blob)) + blob + b"\x00" * 4096)
+				self.assertRaises(vnal.vnaexceptions.VNA_Exception_Bad_Cal, calfile.read_calfile, badname)
+
+			with open(fname, "r+b") as fp:
+				fp.truncate(200)
+			self.assertRaises(vnal.vnaexceptions.VNA_Exception_Bad_Cal, calfile.read_calfile, fname)
+			self.assertRaises(vnal.vnaexceptions.VNA_Exception_Bad_Cal, calfile.read_calfile, csvname)
+		finally:
+			shutil.rmtree(dirpath)
+
+	def test_calibration_library(self):
+		library = vnaclass.CalLibrary(max_entries=2)
+		vna = vnaclass.VNA("192.168.1.217", 1026, cal_library=library)
+		serial = vna.getHardwareDetails()['serial_number']
+
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+		self.assertFalse(vna.activate_library_cal())
+		vna.importFactoryCalibration()
+		plan_a = vna.store_cal()
+		cal_a = vna.exportCalibrationArray().copy()
+		self.assertIn((serial, plan_a), library)
+
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(1000, 3000, 128))
+		cal_f = vna.getFrequencies()
+		cal_b = np.ones((12, 128), dtype=np.complex128)
+		plan_b = vna.store_cal(cal_f, cal_b)
+		self.assertNotEqual(plan_a, plan_b)
+
+		# Switching configuration swaps the matching calibration in.
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+		self.assertTrue(np.array_equal(vna.exportCalibrationArray(), cal_a))
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(1000, 3000, 128))
+		self.assertTrue(np.array_equal(vna.exportCalibrationArray(), cal_b))
+		self.assertTrue(np.array_equal(vna.getCalibrationFrequencies(), cal_f))
+
+		# A different hop rate is a different plan.
+		vna.set_config(vnal.HOP_15K, vnal.ATTEN_0)
+		self.assertFalse(vna.activate_library_cal())
+
+		# Least recently used entries are dropped once the library is full.
+		vna.store_cal(cal_f, cal_b)
+		self.assertEqual(len(library), 2)
+		self.assertNotIn((serial, plan_a), library)
+		self.assertIn((serial, plan_b), library)
+
+		library.discard(serial)
+		self.assertEqual(len(library), 0)
+
+	def test_cleared_library_calibration(self):
+		library = vnaclass.CalLibrary()
+		vna = vnaclass.VNA("192.168.1.217", 1026, cal_library=library)
+
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+		vna.importFactoryCalibration()
+		vna.store_cal()
+
+		# Re-applying the same plan leaves an explicitly cleared calibration alone.
+		vna.clearCalibration()
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+		self.assertFalse(vna.isCalibrationComplete())
+
+		# Once the library copy is discarded, switching away and back doesn't restore it either.
+		vna.discard_library_cal()
+		self.assertEqual(len(library), 0)
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(1000, 3000, 128))
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+		self.assertFalse(vna.isCalibrationComplete())
+
+		# An explicitly loaded calibration also survives re-applying the plan it was loaded under.
+		vna.store_cal(vna.getFrequencies(), np.ones((12, 64), dtype=np.complex128))
+		vna.importFactoryCalibration()
+		factory = vna.exportCalibrationArray().copy()
+		vna.set_config(vnal.HOP_45K, vnal.ATTEN_0, freq=(400, 1500, 64))
+		self.assertTrue(np.array_equal(vna.exportCalibrationArray(), factory))
+
+	def test_error_injection(self):
+		self.vna.start()
+		vnal.dll.inject_error("measureUncalibrated", "ERR_NO_RESPONSE")
+		self.assertRaises(vnal.vnaexceptions.VNA_Exception_No_Response, self.vna.measureUncalibrated)
+		self.assertEqual(len(self.vna.measureUncalibrated()), 5)
+
+
+
+class TestCalUtil(unittest.TestCase):
+
+	def setUp(self):
+		# Three units' worth of standards, measured through each unit's error model.
+		self.freqs = np.linspace(400, 1500, 128)
+		self.terms = np.array([vnasim.error_terms(self.freqs, serial) for serial in (101, 202, 303)]).swapaxes(0, 1)
+		zero, one = np.zeros_like(self.freqs), np.ones_like(self.freqs)
+
+		def measure(s11, s21, s12, s22):
+			return vnasim.apply_error_model(self.terms[:, :, None, :], s11, s21, s12, s22)
+
+		self.std = {}
+		for name, gamma in [("open", one), ("short", -one), ("load", zero)]:
+			self.std[name] = measure(gamma, zero, zero, gamma)
+		self.std["thru"] = measure(zero, one, one, zero)
+
+	def standards(self):
+		o, s, l, t = self.std["open"], self.std["short"], self.std["load"], self.std["thru"]
+		return (o[0], s[0], l[0], o[3], s[3], l[3], l[1], l[2], t[0], t[1], t[2], t[3])
+
+	def test_batch_solt(self):
+		terms = calutil.generate_CALterms_batch(*self.standards())
+		self.assertEqual(terms.shape, (12, 3, 1, 128))
+		self.assertTrue(np.allclose(terms[:, :, 0], self.terms))
+
+		out = np.zeros_like(terms)
+		self.assertIs(calutil.generate_CALterms_batch(*self.standards(), out=out), out)
+		self.assertRaises(ValueError, calutil.generate_CALterms_batch, *self.standards(), out=out[:, :2])
+
+	def test_batch_correction(self):
+		dut = vnasim.default_dut(self.freqs)
+		# (3 units, 5 sweeps, N) raw data, with the reference path not normalized.
+		ref = np.exp(2j * np.pi * np.arange(5))[None, :, None] * 1000.0
+		measured = [path * ref for path in vnasim.apply_error_model(self.terms[:, :, None, :], *dut)]
+		measured = [np.broadcast_to(path, (3, 5, 128)) for path in measured]
+		ref = np.broadcast_to(ref, (3, 5, 128))
+
+		out = np.empty((4, 3, 5, 128), dtype=np.complex128)
+		ret = calutil.applyCalibration_batch(self.terms[:, :, None, :], *measured, R=ref, out=out)
+		self.assertIs(ret, out)
+		for idx in range(4):
+			self.assertTrue(np.allclose(out[idx], dut[idx]))
+
+		# The one-sweep-at-a-time path agrees, for every parameter.
+		legacy_terms = [self.freqs] + [self.terms[calutil.CALTERM_ORDER.index(name), 0] for name in
+				['EDF', 'EDR', 'ESF', 'ESR', 'ERF', 'ERR', 'EXF', 'EXR', 'ELF', 'ELR', 'ETF', 'ETR']]
+		single = calutil.applyCalibration(legacy_terms, self.freqs, *[path[0, 0] for path in measured + [ref]])
+		for idx in range(4):
+			self.assertTrue(np.allclose(single[idx], dut[idx]))
+
+	def test_interpolation_cache(self):
+		calutil.clear_interp_cache()
+		cal_f = self.freqs[::4]
+		cal_terms = list(self.terms[:, 0, ::4])
+		legacy_terms = [cal_f] + [cal_terms[calutil.CALTERM_ORDER.index(name)] for name in calutil.CALTERM_ORDER_SOLT]
+		freq = np.linspace(450, 1450, 200)
+		raw = vnasim.apply_error_model(vnasim.error_terms(freq, 101), *vnasim.default_dut(freq))
+		ref = np.ones_like(freq)
+
+		calls = []
+		original = calutil.interpData
+		def counting(*args):
+			calls.append(args)
+			return original(*args)
+		calutil.interpData = counting
+		try:
+			first = calutil.applyCalibration(legacy_terms, freq, *(raw + (ref, )))
+			self.assertEqual(len(calls), 24)
+			second = calutil.applyCalibration(legacy_terms, freq, *(raw + (ref, )))
+			self.assertEqual(len(calls), 24)
+			self.assertTrue(np.array_equal(first.S21, second.S21))
+
+			calutil.applyCalibration(legacy_terms, freq[:100], *[path[:100] for path in raw + (ref, )])
+			self.assertEqual(len(calls), 48)
+		finally:
+			calutil.interpData = original
+
+		expect = vnasim.error_terms(freq, 101)
+		# The terms are mostly delay, which mag/phase interpolation tracks far better.
+		for mode, atol in [('reim', 5e-3), ('magphase', 1e-9)]:
+			terms = calutil.interpCALterms(cal_f, cal_terms, freq, mode=mode)
+			self.assertFalse(terms.flags.writeable)
+			self.assertTrue(np.allclose(terms, expect, rtol=0, atol=atol))
+
+		calutil.INTERP_CACHE_SIZE, size = 2, calutil.INTERP_CACHE_SIZE
+		try:
+			for count in range(3, 8):
+				calutil.interpCALterms(cal_f, cal_terms, freq[:count])
+			self.assertEqual(len(calutil._interp_cache), 2)
+		finally:
+			calutil.INTERP_CACHE_SIZE = size
+			calutil.clear_interp_cache()
+
+		# Cached by content, so a calibration changed in place is resampled again.
+		terms = calutil.interpCALterms(cal_f, cal_terms, freq)
+		cal_terms[0] = cal_terms[0] * 2
+		self.assertTrue(np.allclose(calutil.interpCALterms(cal_f, cal_terms, freq)[0], terms[0] * 2))
+
+		# Resampling, evicting and clearing from several threads at once.
+		import threading
+		errors = []
+		def worker(seed):
+			try:
+				for num in range(50):
+					count = 3 + (seed + num) % 6
+					calutil.interpCALterms(cal_f, cal_terms, freq[:count])
+					if num % 7 == seed:
+						calutil.clear_interp_cache()
+			except Exception as e:
+				errors.append(e)
+		calutil.INTERP_CACHE_SIZE, size = 2, calutil.INTERP_CACHE_SIZE
+		try:
+			threads = [threading.Thread(target=worker, args=(seed, )) for seed in range(4)]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+		finally:
+			calutil.INTERP_CACHE_SIZE = size
+			calutil.clear_interp_cache()
+		self.assertEqual(errors, [])
+
+	def write_labview_csv(self, fname, npts, seed=0):
+		import csv
+		rng = np.random.RandomState(seed)
+		graphs = rng.standard_normal((4, npts, 2))
+		props = [("Start", 375.0), ("Stop", 6000.0), ("Points", npts), ("Hop", 45.0), ("Atten", 0.0), ("Ports", 2.0)]
+		with open(fname, "w", newline='') as fp:
+			writer = csv.writer(fp)
+			writer.writerow(["Stimulus", ""] + sum([["Graph %s" % num, "", ""] for num in range(4)], []))
+			for row in range(npts):
+				stim = list(props[row - 1]) if 1 <= row <= 6 else ["", ""]
+				cells = sum([["sig%s" % num if row == 0 else ""] + [repr(float(val)) for val in graphs[num, row]] for num in range(4)], [])
+				writer.writerow(stim + cells)
+		return graphs, dict(props)
+
+	def test_labview_csv_reader(self):
+		import os
+		import shutil
+		import tempfile
+		dirpath = tempfile.mkdtemp()
+		try:
+			fname = os.path.join(dirpath, "CAL_p1_o_a.csv")
+			graphs, props = self.write_labview_csv(fname, 300)
+
+			fast = calutil.read_labview_CSV(fname)
+			slow = calutil._read_labview_CSV_rows(fname)
+			self.assertEqual(fast.props, props)
+			self.assertEqual(fast.props, slow.props)
+			self.assertEqual(fast.data_names, ["sig0", "sig1", "sig2", "sig3"])
+			self.assertEqual(fast.data_names, slow.data_names)
+			for idx in range(4):
+				self.assertTrue(np.array_equal(fast.data[idx], slow.data[idx]))
+				self.assertTrue(np.array_equal(fast.data[idx], graphs[idx]))
+
+			self.assertFalse(os.path.exists(fname + ".npz"))
+			calutil.read_labview_CSV(fname, cache=True)
+			self.assertTrue(os.path.exists(fname + ".npz"))
+			cached = calutil._read_labview_sidecar(fname)
+			self.assertEqual(cached.props, props)
+			self.assertTrue(np.array_equal(cached.data[3], graphs[3]))
+
+			# Rewriting the CSV invalidates the sidecar.
+			graphs, props = self.write_labview_csv(fname, 200, seed=1)
+			self.assertIsNone(calutil._read_labview_sidecar(fname))
+			self.assertTrue(np.array_equal(calutil.read_labview_CSV(fname, cache=True).data[0], graphs[0]))
+			self.assertTrue(np.array_equal(calutil._read_labview_sidecar(fname).data[0], graphs[0]))
+		finally:
+			shutil.rmtree(dirpath)
+
+	def test_catalog_index(self):
+		import os
+		import shutil
+		import tempfile
+		import threading
+		dirpath = tempfile.mkdtemp() + os.sep
+		try:
+			names = ["CAL_p1_o_a.csv", "CAL_p1_s_a.csv", "CAL_p1p2_t_u.csv", "CAL_p1_o_s11.csv", "notes.txt"]
+			for num, name in enumerate(names):
+				self.write_labview_csv(dirpath + name, 50, seed=num)
+
+			plain = calutil.catalog_dirpath(dirpath)
+			indexed = calutil.catalog_dirpath(dirpath, index=True)
+			self.assertEqual(sorted(plain.files), indexed.files)
+			self.assertEqual(len(indexed.files), 3)
+			self.assertEqual(indexed.ports[indexed.files.index(dirpath + "CAL_p1p2_t_u.csv")], [1, 2])
+
+			entries, changed = calutil.update_catalog_index(dirpath)
+			self.assertEqual(changed, [])
+			self.write_labview_csv(dirpath + "CAL_p1_s_a.csv", 60, seed=9)
+			os.remove(dirpath + "CAL_p1_o_s11.csv")
+			entries, changed = calutil.update_catalog_index(dirpath)
+			self.assertEqual(changed, ["CAL_p1_s_a.csv"])
+			self.assertEqual(len(entries), 3)
+
+			serial = calutil.catalog_labview_to_CALdict(indexed, calutil.generate_rawDict([1, 2], caltype='SOLT'))
+			pooled = calutil.catalog_labview_to_CALdict(indexed, calutil.generate_rawDict([1, 2], caltype='SOLT'), workers=2)
+			self.assertTrue(np.array_equal(serial['p1p2']['t']['u'].signal, pooled['p1p2']['t']['u'].signal))
+			self.assertTrue(np.array_equal(serial['p1']['s']['a'].ref, pooled['p1']['s']['a'].ref))
+
+			seen = []
+			stop = threading.Event()
+			watcher = threading.Thread(target=calutil.watch_catalog, args=(dirpath, lambda fname, dat: seen.append(fname)),
+					kwargs={'interval': 0.02, 'stop': stop})
+			watcher.start()
+			try:
+				time.sleep(0.1)
+				self.write_labview_csv(dirpath + "CAL_p2_l_b.csv", 50)
+				for dummy in range(100):
+					if seen:
+						break
+					time.sleep(0.02)
+			finally:
+				stop.set()
+				watcher.join()
+			self.assertEqual(seen, [dirpath + "CAL_p2_l_b.csv"])
+
+			# Files the index already knows about (because something else catalogued
+			# the directory first) are still picked up.
+			seen = []
+			stop = threading.Event()
+			watcher = threading.Thread(target=calutil.watch_catalog, args=(dirpath, lambda fname, dat: seen.append(fname)),
+					kwargs={'interval': 0.2, 'stop': stop})
+			watcher.start()
+			try:
+				time.sleep(0.05)
+				self.write_labview_csv(dirpath + "CAL_p2_o_b.csv", 50)
+				calutil.catalog_dirpath(dirpath, index=True)
+				for dummy in range(100):
+					if seen:
+						break
+					time.sleep(0.02)
+			finally:
+				stop.set()
+				watcher.join()
+			self.assertEqual(seen, [dirpath + "CAL_p2_o_b.csv"])
+		finally:
+			shutil.rmtree(dirpath)
+
+
+class TestSweepArchive(unittest.TestCase):
+
+	def setUp(self):
+		import tempfile
+		self.dirpath = tempfile.mkdtemp()
+		self.freqs = np.linspace(400, 1500, 32)
+
+	def tearDown(self):
+		import shutil
+		shutil.rmtree(self.dirpath)
+
+	def sweep(self, seq, paths=5, npts=32):
+		return np.arange(paths * npts).reshape(paths, npts) * (1 + 1j) + seq
+
+	def test_recorder(self):
+		import os
+		rec = archive.SweepRecorder(self.dirpath, capacity=4, max_segments=3)
+		cfg = rec.register_config(self.freqs, vnaclass.UNCAL_PATHS)
+		self.assertEqual(cfg, archive.config_id(self.freqs, vnaclass.UNCAL_PATHS))
+		self.assertNotEqual(cfg, archive.config_id(self.freqs, vnaclass.CAL_PATHS))
+
+		for seq in range(6):
+			values = self.sweep(seq)
+			if seq % 2:
+				# Sequences of rows are accepted as well as arrays.
+				values = vnaclass.Uncal_Scan_Return(*values)
+			rec.append(cfg, 1000 + seq % 2, values, timestamp=100.0 + seq)
+
+		segments = archive.list_segments(self.dirpath)
+		self.assertEqual([seq for seq, prefix, path in segments], [0, 1])
+		seg = archive.Segment(segments[0][2])
+		self.assertEqual(seg.count(), 4)
+		self.assertEqual(seg.header["paths"], list(vnaclass.UNCAL_PATHS))
+		self.assertTrue(np.array_equal(seg.freqs, self.freqs))
+		self.assertTrue(np.array_equal(seg.timestamps[:4], [100, 101, 102, 103]))
+		self.assertTrue(np.array_equal(seg.serials[:4], [1000, 1001, 1000, 1001]))
+		self.assertTrue(np.all(seg.configs[:4] == cfg))
+		self.assertTrue(np.array_equal(seg.data[3], self.sweep(3)))
+		self.assertFalse(seg.data.flags.writeable)
+
+		# A partially filled segment is readable while still being written.
+		seg = archive.Segment(segments[1][2])
+		self.assertEqual(seg.count(), 2)
+		self.assertTrue(np.array_equal(seg.data[1], self.sweep(5)))
+
+		# Each configuration gets its own segment.
+		other = rec.register_config(self.freqs[:16], vnaclass.CAL_PATHS)
+		rec.append(other, 1000, self.sweep(0, paths=4, npts=16))
+		self.assertEqual(len(archive.list_segments(self.dirpath)), 3)
+
+		# Rollover keeps the number of segments bounded, dropping the oldest.
+		for seq in range(8):
+			rec.append(cfg, 1000, self.sweep(seq))
+		rec.close()
+		segments = archive.list_segments(self.dirpath)
+		self.assertEqual(len(segments), 3)
+		self.assertEqual([seq for seq, prefix, path in segments], [2, 3, 4])
+
+		# A new recorder continues the numbering.
+		with archive.SweepRecorder(self.dirpath, capacity=4) as rec:
+			rec.append(rec.register_config(self.freqs, vnaclass.UNCAL_PATHS), 1000, self.sweep(0))
+		self.assertEqual(archive.list_segments(self.dirpath)[-1][0], 5)
+
+		with open(segments[0][2], "r+b") as fp:
+			fp.truncate(100)
+		self.assertRaises(ValueError, archive.Segment, segments[0][2])
+
+		# A partial or malformed header is a bad segment too, and the archive scan skips it.
+		import json
+		good = archive.Segment(segments[1][2]).header
+		path = segments[1][2]
+		with open(path, "rb") as fp:
+			prefix = fp.read(archive._PREFIX.size)
+		header_len = archive._PREFIX.unpack(prefix)[2]
+		total = len(archive.SweepArchive(self.dirpath))
+		for change in [{"capacity" : None}, {"points" : "8"}, {"paths" : None}, {"paths" : [1, 2]},
+				{"config" : True}, {"data_offset" : 24}, {"serials_offset" : good["freqs_offset"]}, None]:
+			header = None
+			if change is not None:
+				header = dict((key, value) for key, value in good.items() if change.get(key, 0) is not None)
+				header.update((key, value) for key, value in change.items() if value is not None)
+			blob = json.dumps(header).encode("utf-8")
+			with open(path, "r+b") as fp:
+				fp.seek(archive._PREFIX.size)
+				fp.write(blob + b" " * (header_len - len(blob)))
+			self.assertRaises(ValueError, archive.Segment, path)
+			self.assertEqual(len(archive.SweepArchive(self.dirpath)), total - 4)
+
+	def test_reader(self):
+		rec = archive.SweepRecorder(self.dirpath, capacity=8)
+		cfg = rec.register_config(self.freqs, vnaclass.UNCAL_PATHS)
+		for seq in range(10):
+			# Two units, sharing the recorder round-robin.
+			rec.append(cfg, 100 + seq % 2, self.sweep(seq), timestamp=1000.0 + seq)
+		rec.flush()
+
+		arc = archive.SweepArchive(self.dirpath)
+		self.assertEqual(len(arc), 10)
+		self.assertEqual(arc.units(), set([100, 101]))
+		self.assertEqual(arc.time_range(), (1000.0, 1009.0))
+		self.assertEqual(list(arc.configs().keys()), [cfg])
+
+		parts = arc.select(start=1002, stop=1006)
+		self.assertEqual([list(part.timestamps) for part in parts], [[1002, 1003, 1004, 1005]])
+		self.assertTrue(np.shares_memory(parts[0].data, arc.segments()[0].data))
+
+		# One unit, one frequency band: still views.
+		parts = arc.select(serial=101, fmin=self.freqs[4], fmax=self.freqs[9])
+		self.assertEqual([list(part.serials) for part in parts], [[101] * 4, [101]])
+		self.assertTrue(np.array_equal(parts[0].freqs, self.freqs[4:10]))
+		self.assertTrue(np.array_equal(parts[0].data[1], self.sweep(3)[:, 4:10]))
+		self.assertTrue(np.array_equal(parts[1].data[0], self.sweep(9)[:, 4:10]))
+		self.assertTrue(all(np.shares_memory(part.data, seg.data) for part, seg in zip(parts, arc.segments())))
+
+		self.assertEqual(arc.select(serial=102), [])
+		self.assertEqual(arc.select(start=2000), [])
+		self.assertEqual(arc.select(config=cfg + 1), [])
+
+		# New sweeps show up on refresh.
+		rec.append(cfg, 102, self.sweep(10), timestamp=1010.0)
+		rec.flush()
+		arc.refresh()
+		self.assertEqual(len(arc), 11)
+		self.assertEqual(len(arc.select(serial=102)), 1)
+		rec.close()
+
+	def test_replay(self):
+		with archive.SweepRecorder(self.dirpath, capacity=4) as rec:
+			wide   = rec.register_config(self.freqs, vnaclass.UNCAL_PATHS)
+			narrow = rec.register_config(self.freqs[:8], vnaclass.CAL_PATHS)
+			for seq in range(6):
+				# Alternate configurations, which end up in different segments.
+				if seq % 2:
+					rec.append(narrow, 7, self.sweep(seq, paths=4, npts=8), timestamp=seq * 0.02)
+				else:
+					rec.append(wide, 7, self.sweep(seq), timestamp=seq * 0.02)
+
+		arc = archive.SweepArchive(self.dirpath)
+		replay = archive.SweepReplay(arc, speed=None)
+		self.assertEqual(len(replay), 6)
+		sweeps = list(replay)
+		self.assertEqual([sweep.timestamp for sweep in sweeps], [seq * 0.02 for seq in range(6)])
+		self.assertEqual(sweeps[1].paths, vnaclass.CAL_PATHS)
+		self.assertEqual(sweeps[1].config, narrow)
+		self.assertTrue(np.array_equal(sweeps[4].data, self.sweep(4)))
+		self.assertTrue(np.array_equal(sweeps[5].freqs, self.freqs[:8]))
+
+		# Paced playback takes (recorded time span / speed).
+		replay = archive.SweepReplay(arc, speed=2.0, config=wide)
+		start = time.time()
+		self.assertEqual(len(list(replay)), 3)
+		self.assertGreaterEqual(time.time() - start, 0.08 / 2.0 - 0.005)
+
+		replay = archive.SweepReplay(arc, speed=None, loop=True, config=narrow)
+		self.assertEqual([next(replay).timestamp for dummy in range(5)], [0.02, 0.06, 0.1, 0.02, 0.06])
+
+		self.assertRaises(StopIteration, next, archive.SweepReplay(arc, serial=8, loop=True))
+
+	def test_recorrect_archive(self):
+		import os
+		terms = vnasim.error_terms(self.freqs, 321)
+		dut = vnasim.default_dut(self.freqs)
+		ref = 0.5 * np.exp(1j * self.freqs / 100)
+		raw = [val * ref for val in vnasim.apply_error_model(terms, *dut)] + [ref]
+
+		with archive.SweepRecorder(os.path.join(self.dirpath, "raw"), capacity=4) as rec:
+			cfg = rec.register_config(self.freqs, vnaclass.UNCAL_PATHS)
+			for seq in range(6):
+				rec.append(cfg, 321, raw, timestamp=float(seq))
+
+		count = calutil.recorrect_archive(os.path.join(self.dirpath, "raw"), os.path.join(self.dirpath, "cal"),
+				self.freqs, terms, chunk=3, start=1)
+		self.assertEqual(count, 5)
+		parts = archive.SweepArchive(os.path.join(self.dirpath, "cal")).select()
+		self.assertEqual(parts[0].paths, vnaclass.CAL_PATHS)
+		self.assertEqual(list(np.concatenate([part.timestamps for part in parts])), [1, 2, 3, 4, 5])
+		for part in parts:
+			self.assertTrue(np.all(part.serials == 321))
+			for sweep in part.data:
+				self.assertTrue(np.allclose(sweep, dut, atol=1e-9))
+
+		# More corrected segments than a recorder keeps by default are all kept.
+		total = archive.MAX_SEGMENTS + 6
+		with archive.SweepRecorder(os.path.join(self.dirpath, "raw"), capacity=16) as rec:
+			cfg = rec.register_config(self.freqs, vnaclass.UNCAL_PATHS)
+			for seq in range(6, total):
+				rec.append(cfg, 321, raw, timestamp=float(seq))
+		count = calutil.recorrect_archive(os.path.join(self.dirpath, "raw"), os.path.join(self.dirpath, "long"),
+				self.freqs, terms, capacity=1)
+		self.assertEqual(count, total)
+		self.assertEqual(len(archive.SweepArchive(os.path.join(self.dirpath, "long"))), total)
+
+
+class TestAppProcessing(unittest.TestCase):
+	''' The GUI's Qt-free sweep processing, from `app/vnathread.py`.
+	'''
+
+	def setUp(self):
+		try:
+			import app.vnathread
+		except ImportError as e:
+			raise unittest.SkipTest("app/ is not importable: %s" % e)
+		self.vt = app.vnathread
+
+	def reference_fft(self, data, start_f, stop_f):
+		# `VnaThread.get_fft()` as it was before `TimeDomainPlan`.
+		data_len = data.shape[0]
+		data = np.multiply(data, np.hanning(data_len))
+		step_val = abs(start_f - stop_f) / data_len
+		start_padding = max(int(start_f / step_val), 0)
+		startsize = start_padding + data_len
+		sizes = [128, 256, 512, 1024, 2048, 4096, 8192]
+		start_idx, output_size = 0, 0
+		while output_size < startsize and start_idx < len(sizes):
+			output_size = sizes[start_idx]
+			start_idx += 1
+		arr = np.pad(data, (start_padding, max(output_size - startsize, 0)), mode='constant')
+		fft_data = np.absolute(np.fft.ifft(arr)[:int(output_size / 2)])
+		pts = np.arange(fft_data.shape[0])
+		return fft_data, pts * (1 / (len(pts) * step_val * 1e6 * 2)) * 1e9
+
+	def test_time_domain_plan(self):
+		rng = np.random.RandomState(7)
+		for npts, start_f, stop_f in [(64, 400, 1500), (256, 375, 6050), (1024, 375, 6050), (4000, 5000, 6000)]:
+			rows = rng.randn(3, npts) + 1j * rng.randn(3, npts)
+			plan = self.vt.TimeDomainPlan(npts, start_f, stop_f)
+			out = plan.transform(rows, out=plan.output(3))
+			for row, mag in zip(rows, out):
+				ref, axis = self.reference_fft(row, start_f, stop_f)
+				self.assertEqual(mag.shape, ref.shape)
+				self.assertTrue(np.allclose(mag, ref))
+				self.assertTrue(np.allclose(plan.time_axis, axis))
+
+			# Already windowed rows go through `inverse()`, and the output buffer is reused.
+			again = plan.inverse([row * plan.window for row in rows], out=plan.output(3))
+			self.assertTrue(np.shares_memory(out, again))
+			self.assertTrue(np.allclose(again[0], self.reference_fft(rows[0], start_f, stop_f)[0]))
+
+		thread = self.vt.VnaThread(0, None, None)
+		thread.start_f, thread.stop_f = 400, 1500
+		row = rows[0][:64]
+		mag, axis = thread.get_fft(row, 64)
+		ref, ref_axis = self.reference_fft(row, 400, 1500)
+		self.assertTrue(np.allclose(mag, ref))
+		self.assertTrue(np.allclose(axis, ref_axis))
+		self.assertIs(thread.fft_plan(64), thread.fft_plan(64))
+
+	def test_sweep_graph(self):
+		calls = collections.Counter()
+		def stage(name, func):
+			def run(ctx, paths, *inputs):
+				calls[name] += 1
+				calls[name, tuple(paths)] += 1
+				return func(ctx, paths, *inputs)
+			return run
+
+		graph = self.vt.SweepGraph()
+		graph.add_stage("ratio",  stage("ratio",  lambda ctx, paths: [ctx[path] for path in paths]))
+		graph.add_stage("double", stage("double", lambda ctx, paths, vals: [val * 2 for val in vals]), inputs=("ratio", ))
+		graph.add_stage("plus",   stage("plus",   lambda ctx, paths, vals: [val + 1 for val in vals]), inputs=("double", ))
+		graph.add_stage("unused", stage("unused", lambda ctx, paths, vals: [val - 1 for val in vals]), inputs=("ratio", ))
+
+		# Nothing subscribed, nothing computed.
+		self.assertEqual(graph.run({}), {})
+		self.assertEqual(sum(calls.values()), 0)
+
+		# Shared inputs are computed once per sweep, for the union of the paths that need them.
+		graph.subscribe("a", [("plus", "S21")])
+		graph.subscribe("b", [("double", "S21"), ("double", "S11")])
+		values = graph.run({"S11" : 1, "S21" : 10, "S12" : 100})
+		self.assertEqual(values, {"ratio" : {"S11" : 1, "S21" : 10}, "double" : {"S11" : 2, "S21" : 20}, "plus" : {"S21" : 21}})
+		self.assertEqual(calls["ratio"], 1)
+		self.assertEqual(calls["double", ("S11", "S21")], 1)
+		self.assertEqual(calls["plus", ("S21", )], 1)
+		self.assertEqual(calls["unused"], 0)
+
+		# The plan is cached until the subscriptions change.
+		plan = graph.plan()
+		self.assertIs(graph.plan(), plan)
+		graph.run({"S11" : 1, "S21" : 10})
+		self.assertEqual(calls["ratio"], 2)
+		graph.unsubscribe("b")
+		self.assertIsNot(graph.plan(), plan)
+		self.assertEqual(graph.plan(), [("ratio", ["S21"]), ("double", ["S21"]), ("plus", ["S21"])])
+
+		# The VnaThread graph only runs the transform for the displayed FFT paths.
+		graph = self.vt.build_sweep_graph()
+		graph.subscribe("gui", self.vt.display_outputs(["S11", "S21 FFT"]))
+		self.assertEqual(graph.plan(), [("ratio", ["S11", "S21"]), ("logmag", ["S11"]), ("ifft", ["S21"]), ("peak", ["S21"])])
+
+	def connected_thread(self, address):
+		import queue
+		thread = self.vt.VnaThread(0, queue.Queue(), queue.Queue())
+		thread.start_f, thread.stop_f, thread.npts_s = 400, 1500, 64
+		thread.dispatch(("connect", (address, 1026)))
+		self.assertEqual(thread.response_queue.get_nowait(), ("connect", True))
+		return thread
+
+	def responses(self, thread):
+		ret = []
+		while not thread.response_queue.empty():
+			ret.append(thread.response_queue.get_nowait())
+		return ret
+
+	@unittest.skipIf(vnal.BACKEND != "sim", "Requires the simulated backend (VNA_BACKEND=sim)")
+	def test_sweep_epochs(self):
+		import shutil
+		import tempfile
+		cache_dir = tempfile.mkdtemp()
+		default_cache_dir, vnaclass.CAL_CACHE_DIR = vnaclass.CAL_CACHE_DIR, cache_dir
+		vnal.dll.time_scale = 0
+		thread = self.connected_thread("192.168.1.230")
+		try:
+			thread.dispatch(("run", True))
+			for dummy in range(3):
+				thread.get_data()
+
+			# Announced once, before the first sweep that uses it.
+			epochs = [value for kind, value in self.responses(thread) if kind == "config"]
+			self.assertEqual(len(epochs), 1)
+			first = epochs[0]
+			self.assertEqual(first.epoch, 1)
+			self.assertEqual(first.freqs.shape, (64, ))
+			self.assertFalse(first.freqs.flags.writeable)
+			self.assertEqual((first.hoprate, first.attenuation), (vnal.HOP_45K, vnal.ATTEN_0))
+			self.assertIsNotNone(first.cal_id)
+			self.assertTrue(np.array_equal(first.time_axis, thread.fft_plan(64).time_axis))
+			self.assertEqual(thread.ring.read_latest().epoch, 1)
+
+			# Reprogramming the unit starts a new epoch.
+			thread.dispatch(("sweep", (128, 400, 1500)))
+			thread.get_data()
+			thread.get_data()
+			epochs = [value for kind, value in self.responses(thread) if kind == "config"]
+			self.assertEqual([(epoch.epoch, epoch.freqs.shape[0]) for epoch in epochs], [(2, 128)])
+			latest = thread.ring.read_latest()
+			self.assertEqual((latest.epoch, latest.comp.shape[1]), (2, 128))
+
+			# So does a calibration change, and a cleared calibration stays cleared.
+			thread.dispatch(("cal_data", "CAL_CLEAR"))
+			thread.get_data()
+			thread.dispatch(("sweep", (128, 400, 1500)))
+			thread.get_data()
+			epochs = [value for kind, value in self.responses(thread) if kind == "config"]
+			self.assertEqual([(epoch.epoch, epoch.cal_id) for epoch in epochs], [(3, None), (4, None)])
+		finally:
+			thread.shutdown()
+			vnal.dll.time_scale = 1.0
+			vnaclass.CAL_CACHE_DIR = default_cache_dir
+			shutil.rmtree(cache_dir)
+
+	@unittest.skipIf(vnal.BACKEND != "sim", "Requires the simulated backend (VNA_BACKEND=sim)")
+	def test_record_replay(self):
+		import shutil
+		import tempfile
+		dirpath = tempfile.mkdtemp()
+		cache_dir = tempfile.mkdtemp()
+		default_cache_dir, vnaclass.CAL_CACHE_DIR = vnaclass.CAL_CACHE_DIR, cache_dir
+		vnal.dll.time_scale = 0
+		live = self.connected_thread("192.168.1.231")
+		try:
+			live.npts_s = 128
+			live.dispatch(("record", dirpath))
+			live.dispatch(("run", True))
+			recorded = []
+			for dummy in range(5):
+				live.get_data()
+				recorded.append(live.ring.read_latest().comp.copy())
+			live.dispatch(("record", None))
+			self.assertEqual(len(archive.SweepArchive(dirpath, prefix="vna-0")), 5)
+
+			# Replaying on the same panel stops the live task, and leaves its sweep settings alone.
+			live.dispatch(("replay", (dirpath, None)))
+			self.assertEqual(live.vna.getState(), vnal.TASK_STOPPED)
+			self.responses(live)
+			for expected in recorded + recorded[:1]:
+				live.get_data()
+				got = live.ring.read_latest()
+				self.assertTrue(np.allclose(got.comp, expected))
+			epochs = [value for kind, value in self.responses(live) if kind == "config"]
+			self.assertEqual(len(epochs), 1)
+			self.assertEqual((epochs[0].hoprate, epochs[0].cal_id, epochs[0].freqs.shape[0]), (None, None, 128))
+			self.assertEqual((live.npts_s, live.start_f, live.stop_f), (128, 400, 1500))
+			live.dispatch(("replay", None))
+
+			# Another panel only replays its own recordings, unless told otherwise.
+			other = self.vt.VnaThread(1, live.command_queue, live.response_queue)
+			other.dispatch(("replay", dirpath))
+			self.assertIsNone(other.replay)
+			other.dispatch(("replay", (dirpath, None, "vna-0")))
+			other.dispatch(("run", True))
+			other.get_data()
+			self.assertTrue(np.allclose(other.ring.read_latest().comp, recorded[0]))
+		finally:
+			live.shutdown()
+			vnal.dll.time_scale = 1.0
+			vnaclass.CAL_CACHE_DIR = default_cache_dir
+			shutil.rmtree(cache_dir)
+			shutil.rmtree(dirpath)
+
+	def test_frame_scheduler(self):
+		now = [100.0]
+		last = {"tick" : 100.0, "busy" : 0.0}
+		frames = self.vt.FrameScheduler(min_interval=10.0, max_interval=200.0, budget=0.5, smoothing=1.0, clock=lambda: now[0])
+		self.assertEqual(frames.interval, 1000 / 30.0)
+
+		def frame(busy, skipped=0, after=None):
+			# One timer tick that fires `after` ms after the previous one (on time by
+			# default), and renders for `busy` ms.
+			if after is None:
+				after = max(frames.interval, last["busy"])
+			now[0] = last["tick"] + after / 1000.0
+			tick = frames.tick()
+			now[0] += busy / 1000.0
+			last.update(tick=tick[0], busy=busy)
+			return frames.rendered(tick, skipped)
+
+		# Cheap frames run at the fastest rate allowed.
+		self.assertEqual(frame(1.0), 10.0)
+		self.assertEqual(frame(2.0, skipped=3), 10.0)
+		self.assertEqual((frames.drawn, frames.dropped), (2, 3))
+
+		# A slow render backs the interval off, so rendering uses at most `budget` of it.
+		self.assertAlmostEqual(frame(40.0), 80.0)
+		# A tick that fires late (Qt busy painting) counts the delay towards the render cost.
+		self.assertAlmostEqual(frame(10.0, after=100.0), 60.0)
+		# Clamped to `max_interval`.
+		self.assertEqual(frame(500.0), 200.0)
+		# And it speeds back up once rendering gets cheap again.
+		frames.restarted()
+		last.update(tick=now[0], busy=0.0)
+		self.assertEqual(frame(1.0), 10.0)
+
+		frames.skip(2)
+		self.assertEqual((frames.drawn, frames.dropped), (6, 5))
+
+		# Smoothing averages the cost over several frames.
+		frames = self.vt.FrameScheduler(min_interval=1.0, budget=1.0, smoothing=0.5, clock=lambda: now[0])
+		costs = [frame(20.0) for dummy in range(3)]
+		self.assertEqual([round(cost, 6) for cost in costs], [10.0, 15.0, 17.5])
+
+		# With smoothing, a tick can run past the interval. That delays the next tick by
+		# itself, which is not counted as lateness.
+		frame(80.0)
+		self.assertLess(frames.interval, 80.0)
+		cost = frames.cost
+		frame(0.0)
+		self.assertAlmostEqual(frames.cost, cost / 2)
+
+	def epoch(self, num, npts=16, keep=8):
+		return self.vt.SweepEpoch(num, np.linspace(400, 1500, npts), np.arange(keep, dtype=np.float64), None, None, None)
+
+	def test_sweep_ring(self):
+		ring = self.vt.SweepRing(capacity=3)
+		ring.configure(self.epoch(1))
+		self.assertIsNone(ring.read_latest())
+
+		def write(value):
+			slot = ring.begin()
+			slot.comp[:] = value
+			slot.comp_paths = ("S11", )
+			ring.publish(slot, float(value))
+
+		write(1)
+		write(2)
+		got = ring.read_latest()
+		self.assertEqual((got.seq, got.epoch, got.timestamp, got.comp_paths), (1, 1, 2.0, ("S11", )))
+		self.assertTrue(np.all(got.comp == 2))
+		self.assertIsNone(ring.read_latest(got.seq, into=got))
+
+		# The reader's slot is reused, and the ring's slots are its own.
+		write(3)
+		again = ring.read_latest(got.seq, into=got)
+		self.assertIs(again, got)
+		self.assertEqual(again.seq, 2)
+		self.assertFalse(any(again is slot or np.shares_memory(again.comp, slot.comp) for slot in ring.slots))
+
+		# A slot the writer reuses while it is being copied is not returned.
+		ring_slots = list(ring.slots)
+		class Overwritten(self.vt.SweepSlot):
+			def __setattr__(inner, name, value):
+				super(Overwritten, inner).__setattr__(name, value)
+				# Set by `read_latest()` between picking the slot and copying it.
+				if name == "timestamp" and value:
+					for num in range(ring.capacity):
+						write(10 + num)
+		write(4)
+		self.assertIsNone(ring.read_latest(again.seq, into=Overwritten(16, 8)))
+		got = ring.read_latest(again.seq)
+		self.assertEqual(got.seq, 6)
+		self.assertTrue(np.all(got.comp == 12))
+		self.assertEqual([slot is ring_slots[idx] for idx, slot in enumerate(ring.slots)], [True] * 3)
+
+		# A new epoch with the same shape keeps the slots, a new shape replaces them.
+		ring.configure(self.epoch(2))
+		self.assertEqual([slot is ring_slots[idx] for idx, slot in enumerate(ring.slots)], [True] * 3)
+		ring.configure(self.epoch(3, npts=32, keep=16))
+		self.assertEqual(ring.slots[0].comp.shape, (4, 32))
+		write(5)
+		got = ring.read_latest(6, into=got)
+		self.assertEqual((got.seq, got.epoch, got.comp.shape, got.fft.shape), (7, 3, (4, 32), (4, 16)))
+
 
 # TODO: MOAR TESTS -
 # setFrequencies
@@ -0,0 +1,901 @@
+################################################################################
+#### vnasim.py		--	In-process simulation of the VNA DLL				####
+####																		####
+####	Drop-in replacement for the ctypes `CDLL` handle used by			####
+####	vnalibrary.py, so the whole stack can be exercised and				####
+####	benchmarked without hardware on the network.						####
+####																		####
+####	Select it by setting the environment variable `VNA_BACKEND=sim`	####
+####	before `import VNA`.												####
+####																		####
+################################################################################
+import ctypes as ct
+import os
+import threading
+import time
+import zlib
+
+import numpy as np
+
+##
+#  \addtogroup Python-Simulator
+#
+#  \section sim-brief Simulated VNA DLL backend
+#
+#  This module implements the subset of the VNA DLL exports that
+#  \ref VNA::vnalibrary::RAW_VNA uses, entirely in python.
+#
+#  The simulator follows the same task state machine as the DLL
+#  (TASK_UNINITIALIZED -> TASK_STOPPED -> TASK_STARTED), blocks in the
+#  measurement calls for as long as the configured hop-rate would take,
+#  snaps frequencies to a fixed synthesizer grid, carries an embedded
+#  "factory" calibration per unit, and generates raw data by pushing a
+#  configurable device-under-test through a 12-term error model. Calibrated
+#  measurements therefore return (approximately) the DUT S-parameters.
+#
+#  Tunables are attributes on the \ref SimulatedDLL instance (`VNA.dll`):
+#
+#     Attribute      |  Function                                                  |
+#    ----------------|------------------------------------------------------------|
+#    `time_scale`    | Multiplier on every simulated delay. `0` disables sleeping |
+#    `init_delay`    | Seconds `initialize()` takes (before `time_scale`)         |
+#    `prom_delay`    | Seconds `importFactoryCalibration()` takes                 |
+#    `noise`         | Standard deviation of the additive noise, relative to Ref  |
+#    `fault_rate`    | Probability that a unit-facing call returns ERR_NO_RESPONSE|
+#    `dut`           | Callable `dut(freqs_mhz) -> (S11, S21, S12, S22)`          |
+#
+#  `time_scale` also picks up the `VNA_SIM_TIME_SCALE` environment variable.
+#
+#  Individual units (see \ref SimulatedDLL.unit_for()) have a `stall` attribute:
+#  extra seconds every measurement on that unit blocks for, regardless of
+#  `time_scale`. This simulates a unit that has stopped responding.
+#
+#  @{
+#
+
+## Values returned for the DLL's exported enum constants.
+EXPORTED_VALUES = {
+	"ERR_OK"                 : 0,
+	"ERR_BAD_ATTEN"          : 1,
+	"ERR_BAD_CAL"            : 2,
+	"ERR_BAD_HANDLE"         : 3,
+	"ERR_BAD_HOP"            : 4,
+	"ERR_BAD_PATH"           : 5,
+	"ERR_BAD_PROM"           : 6,
+	"ERR_BYTES"              : 7,
+	"ERR_FREQ_OUT_OF_BOUNDS" : 8,
+	"ERR_INTERRUPTED"        : 9,
+	"ERR_NO_RESPONSE"        : 10,
+	"ERR_MISSING_IP"         : 11,
+	"ERR_MISSING_PORT"       : 12,
+	"ERR_MISSING_HOP"        : 13,
+	"ERR_MISSING_ATTEN"      : 14,
+	"ERR_MISSING_FREQS"      : 15,
+	"ERR_PROG_OVERFLOW"      : 16,
+	"ERR_SOCKET"             : 17,
+	"ERR_TOO_MANY_POINTS"    : 18,
+	"ERR_WRONG_STATE"        : 19,
+
+	"HOP_UNDEFINED"          : 0,
+	"HOP_45K"                : 1,
+	"HOP_30K"                : 2,
+	"HOP_15K"                : 3,
+	"HOP_7K"                 : 4,
+	"HOP_3K"                 : 5,
+	"HOP_2K"                 : 6,
+	"HOP_1K"                 : 7,
+	"HOP_550"                : 8,
+	"HOP_312"                : 9,
+	"HOP_156"                : 10,
+	"HOP_78"                 : 11,
+	"HOP_39"                 : 12,
+	"HOP_20"                 : 13,
+
+	"ATTEN_UNDEFINED"        : -1,
+
+	"TASK_UNINITIALIZED"     : 0,
+	"TASK_STOPPED"           : 1,
+	"TASK_STARTED"           : 2,
+
+	"STEP_P1_OPEN"           : 0,
+	"STEP_P1_SHORT"          : 1,
+	"STEP_P1_LOAD"           : 2,
+	"STEP_P2_OPEN"           : 3,
+	"STEP_P2_SHORT"          : 4,
+	"STEP_P2_LOAD"           : 5,
+	"STEP_THRU"              : 6,
+}
+for _atten in range(32):
+	EXPORTED_VALUES["ATTEN_%s" % _atten] = _atten
+
+_V = EXPORTED_VALUES
+
+## Frequency hops per second for each hop-rate setting.
+HOP_RATE_HZ = {
+	_V["HOP_45K"] : 45000,
+	_V["HOP_30K"] : 30000,
+	_V["HOP_15K"] : 15000,
+	_V["HOP_7K"]  : 7000,
+	_V["HOP_3K"]  : 3000,
+	_V["HOP_2K"]  : 2000,
+	_V["HOP_1K"]  : 1000,
+	_V["HOP_550"] : 550,
+	_V["HOP_312"] : 312,
+	_V["HOP_156"] : 156,
+	_V["HOP_78"]  : 78,
+	_V["HOP_39"]  : 39,
+	_V["HOP_20"]  : 20,
+}
+
+## Synthesizer step size, in MHz. Every generated frequency is a multiple of this.
+FREQ_RESOLUTION = 100.0 / 2**20
+
+## Extra time (in seconds) spent on every band change within a sweep.
+BAND_SWITCH_TIME = 50e-6
+
+## Hardware description reported by every simulated unit (serial number aside).
+SIM_HARDWARE = {
+	"minimum_frequency"         : 375,
+	"maximum_frequency"         : 6050,
+	"maximum_points"            : 4001,
+	"band_boundaries"           : [3000, 1500, 750, 0, 0, 0, 0, 0],
+	"number_of_band_boundaries" : 3,
+}
+
+## Number of frequency points stored in the embedded factory calibration.
+FACTORY_CAL_POINTS = 512
+
+## Calibration steps that must all be measured for a SOLT calibration to complete.
+CAL_STEPS = (
+	_V["STEP_P1_OPEN"], _V["STEP_P1_SHORT"], _V["STEP_P1_LOAD"],
+	_V["STEP_P2_OPEN"], _V["STEP_P2_SHORT"], _V["STEP_P2_LOAD"],
+	_V["STEP_THRU"],
+)
+
+# Calls that talk to the unit over the network, and can therefore
+# fail with ERR_NO_RESPONSE when fault injection is active.
+_UNIT_CALLS = set([
+	"initialize",
+	"start",
+	"utilPingUnit",
+	"measureUncalibrated",
+	"measure2PortCalibrated",
+	"measureCalibrationStep",
+	"importFactoryCalibration",
+])
+
+
+def snap_frequency(freq):
+	''' Round a frequency (MHz, scalar or array) onto the simulated synthesizer grid.
+	'''
+	return np.round(np.asarray(freq, dtype=np.float64) / FREQ_RESOLUTION) * FREQ_RESOLUTION
+
+
+def default_dut(freqs):
+	''' Default simulated device-under-test: a slightly mismatched 2 ns line with 3 dB loss.
+
+	Args:
+		freqs - Numpy array of frequencies in MHz.
+
+	Returns:
+		(S11, S21, S12, S22) numpy complex arrays.
+	'''
+	w = 2j * np.pi * freqs * 1e-3 # rad/ns
+	s21 = 0.707 * np.exp(-w * 2.0)
+	s11 = 0.05  * np.exp(-w * 0.35)
+	return s11, s21, s21.copy(), s11 * np.exp(-w * 0.1)
+
+
+def error_terms(freqs, serial):
+	''' Smooth, per-unit 12-term error model.
+
+	Args:
+		freqs  - Numpy array of frequencies in MHz.
+		serial - Unit serial number. Seeds the per-unit variation.
+
+	Returns:
+		(12, N) complex numpy array, ordered as the \ref exportCalibration() tuple
+		(e00, e11, e10e01, e30, e22, e10e32, ep33, ep22, ep23ep32, ep03, ep11, ep23ep01).
+	'''
+	rng = np.random.RandomState(serial)
+	mags   = np.array([0.03, 0.10, 0.80, 0.001, 0.08, 0.70, 0.03, 0.10, 0.80, 0.001, 0.08, 0.70])
+	delays = np.array([0.2,  0.5,  1.5,  0.1,   0.4,  2.5,  0.2,  0.5,  1.5,  0.1,   0.4,  2.5])
+	mags   = mags   * rng.uniform(0.9, 1.1, size=12)
+	delays = delays * rng.uniform(0.8, 1.2, size=12)
+	phase  = rng.uniform(-np.pi, np.pi, size=12)
+
+	f_ghz = np.asarray(freqs, dtype=np.float64)[None, :] * 1e-3
+	rolloff = 1.0 - 0.03 * f_ghz
+	return mags[:, None] * rolloff * np.exp(1j * (phase[:, None] - 2 * np.pi * f_ghz * delays[:, None]))
+
+
+def apply_error_model(terms, s11, s21, s12, s22):
+	''' Distort actual S-parameters with a 12-term error model.
+
+	This is the forward model that \ref VNA::calutil::applyCalibration() inverts.
+
+	Returns:
+		(S11M, S21M, S12M, S22M) measured ratios.
+	'''
+	e00, e11, e10e01, e30, e22, e10e32, ep33, ep22, ep23ep32, ep03, ep11, ep23ep01 = terms
+	ds = s11 * s22 - s21 * s12
+	d_f = 1 - e11 * s11 - e22 * s22 + e11 * e22 * ds
+	d_r = 1 - ep11 * s11 - ep22 * s22 + ep11 * ep22 * ds
+
+	s11m = e00 + e10e01 * (s11 - e22 * ds) / d_f
+	s21m = e30 + e10e32 * s21 / d_f
+	s22m = ep33 + ep23ep32 * (s22 - ep11 * ds) / d_r
+	s12m = ep03 + ep23ep01 * s12 / d_r
+	return s11m, s21m, s12m, s22m
+
+
+def remove_error_model(terms, s11m, s21m, s12m, s22m):
+	''' Inverse of \ref apply_error_model(). Same math as the DLL's calibrated measurement.
+	'''
+	e00, e11, e10e01, e30, e22, e10e32, ep33, ep22, ep23ep32, ep03, ep11, ep23ep01 = terms
+	s11n = (s11m - e00)  / e10e01
+	s21n = (s21m - e30)  / e10e32
+	s12n = (s12m - ep03) / ep23ep01
+	s22n = (s22m - ep33) / ep23ep32
+
+	d = (1 + s11n * e11) * (1 + s22n * ep22) - s21n * s12n * e22 * ep11
+	s11 = (s11n * (1 + s22n * ep22) - e22 * s21n * s12n) / d
+	s21 = s21n * (1 + s22n * (ep22 - e22)) / d
+	s12 = s12n * (1 + s11n * (e11 - ep11)) / d
+	s22 = (s22n * (1 + s11n * e11) - ep11 * s21n * s12n) / d
+	return s11, s21, s12, s22
+
+
+def solve_solt(std):
+	''' Compute the 12 error terms from ideal SOLT standard measurements.
+
+	Args:
+		std - dict mapping "p1_open", "p1_short", "p1_load", "p2_open", "p2_short",
+		      "p2_load", "fw_leak", "rv_leak", "thru" to measured ratios. "thru" is a
+		      (S11M, S21M, S12M, S22M) tuple, the rest are single arrays.
+
+	Returns:
+		(12, N) complex numpy array in \ref exportCalibration() order.
+	'''
+	o1, s1, l1 = std["p1_open"], std["p1_short"], std["p1_load"]
+	o2, s2, l2 = std["p2_open"], std["p2_short"], std["p2_load"]
+	t11, t21, t12, t22 = std["thru"]
+
+	e00  = l1
+	e11  = (o1 + s1 - 2 * e00) / (o1 - s1)
+	e10e01 = -2 * (o1 - e00) * (s1 - e00) / (o1 - s1)
+	ep33 = l2
+	ep22 = (o2 + s2 - 2 * ep33) / (o2 - s2)
+	ep23ep32 = -2 * (o2 - ep33) * (s2 - ep33) / (o2 - s2)
+
+	e30  = std["fw_leak"]
+	ep03 = std["rv_leak"]
+
+	a = t11 - e00
+	e22 = a / (e10e01 + e11 * a)
+	a = t22 - ep33
+	ep11 = a / (ep23ep32 + ep22 * a)
+
+	e10e32   = (t21 - e30)  * (1 - e11 * e22)
+	ep23ep01 = (t12 - ep03) * (1 - ep22 * ep11)
+
+	return np.array([e00, e11, e10e01, e30, e22, e10e32, ep33, ep22, ep23ep32, ep03, ep11, ep23ep01])
+
+
+def _view(obj, count):
+	''' Numpy view onto the memory behind a ctypes array, a pointer, or a `byref()` argument.
+	'''
+	obj = getattr(obj, "_obj", obj)
+	if isinstance(obj, ct._Pointer):
+		if issubclass(obj._type_, ct.Array):
+			obj = obj.contents
+		else:
+			return np.ctypeslib.as_array(obj, shape=(count, ))
+	return np.ctypeslib.as_array(obj)[:count]
+
+
+def _write_complex(cdata, values):
+	''' Write a complex numpy array into a \ref ComplexData struct.
+	'''
+	count = values.shape[0]
+	_view(cdata.I, count)[:] = values.real
+	_view(cdata.Q, count)[:] = values.imag
+
+
+def _read_complex(cdata, count):
+	''' Read a \ref ComplexData struct out into a complex numpy array.
+	'''
+	return _view(cdata.I, count) + 1j * _view(cdata.Q, count)
+
+
+class SimFunction(object):
+	''' Stand-in for a ctypes foreign function.
+
+	Like a ctypes function pointer it carries mutable `argtypes`/`restype`
+	attributes. They are not used for marshalling, with the exception that
+	a dict return value is converted into `restype` when that is a ctypes
+	Structure (this is how \ref HardwareDetails comes back).
+	'''
+	def __init__(self, sim, name, func):
+		self.__name__ = name
+		self.sim      = sim
+		self.func     = func
+		self.argtypes = None
+		self.restype  = ct.c_int
+
+	def __call__(self, *args):
+		if self.__name__ in _UNIT_CALLS:
+			fault = self.sim.pop_fault(self.__name__)
+			if fault is not None:
+				return fault
+
+		ret = self.func(*args)
+		if isinstance(ret, dict) and isinstance(self.restype, type) and issubclass(self.restype, ct.Structure):
+			ret = self.restype(**ret)
+		return ret
+
+	def __repr__(self):
+		return "<SimFunction %s>" % self.__name__
+
+
+class SimUnit(object):
+	''' A single simulated piece of hardware, identified by its IP and port.
+	'''
+	def __init__(self, address, port, serial):
+		self.address = address
+		self.port    = port
+		self.serial  = serial
+		self.stall   = 0.0
+
+		self.factory_cal_freqs = snap_frequency(np.linspace(SIM_HARDWARE["minimum_frequency"],
+		                                                    SIM_HARDWARE["maximum_frequency"],
+		                                                    FACTORY_CAL_POINTS))
+		self.factory_cal_terms = error_terms(self.factory_cal_freqs, serial)
+
+	def details(self):
+		ret = dict(SIM_HARDWARE)
+		ret["serial_number"] = self.serial
+		ret["band_boundaries"] = (ct.c_int * 8)(*SIM_HARDWARE["band_boundaries"])
+		return ret
+
+
+class SimTask(object):
+	''' Per-`createTask()` state.
+	'''
+	def __init__(self, seed):
+		self.state     = _V["TASK_UNINITIALIZED"]
+		self.address   = None
+		self.port      = 0
+		self.timeout   = 150
+		self.hop       = _V["HOP_UNDEFINED"]
+		self.atten     = _V["ATTEN_UNDEFINED"]
+		self.freqs     = np.empty(0)
+		self.unit      = None
+
+		self.model_terms = None
+
+		self.cal_freqs  = np.empty(0)
+		self.cal_terms  = None
+		self.cal_sweep  = None
+		self.cal_steps  = {}
+		self.cal_buffer = None
+
+		self.interrupt = threading.Event()
+		self.rng       = np.random.RandomState(seed)
+
+	def sweep_terms(self):
+		''' Calibration terms interpolated onto the current sweep, cached until either changes.
+		'''
+		if self.cal_sweep is None:
+			terms = np.empty((12, self.freqs.shape[0]), dtype=np.complex128)
+			for idx in range(12):
+				terms[idx].real = np.interp(self.freqs, self.cal_freqs, self.cal_terms[idx].real)
+				terms[idx].imag = np.interp(self.freqs, self.cal_freqs, self.cal_terms[idx].imag)
+			self.cal_sweep = terms
+		return self.cal_sweep
+
+	def set_calibration(self, freqs, terms):
+		self.cal_freqs  = np.array(freqs, dtype=np.float64)
+		self.cal_terms  = np.array(terms, dtype=np.complex128)
+		self.cal_sweep  = None
+		self.cal_buffer = None
+
+	def clear_calibration(self):
+		self.cal_freqs  = np.empty(0)
+		self.cal_terms  = None
+		self.cal_sweep  = None
+		self.cal_steps  = {}
+		self.cal_buffer = None
+
+
+class SimulatedDLL(object):
+	''' Python implementation of the VNA DLL exports.
+
+	Instances expose one attribute per DLL function (see \ref SimFunction), plus
+	\ref exported_value() in place of the DLL's exported constants.
+	'''
+
+	EXPORTS = [
+		"versionString",
+		"createTask", "deleteTask",
+		"initialize", "start", "stop",
+		"setIPAddress", "setIPPort", "setTimeout", "setHopRate", "setAttenuation", "setFrequencies",
+		"getState", "getTimeout", "getIPAddress", "getIPPort", "getHopRate", "getAttenuation",
+		"getNumberOfFrequencies", "getFrequencies", "getHardwareDetails",
+		"utilNearestLegalFreq", "utilFixLinearSweepLimits", "utilPingUnit", "utilGenerateLinearSweep",
+		"measureUncalibrated", "measure2PortCalibrated", "measureCalibrationStep", "interruptMeasurement",
+		"clearCalibration", "isCalibrationComplete", "hasFactoryCalibration", "importFactoryCalibration",
+		"getCalibrationNumberOfFrequencies", "getCalibrationFrequencies",
+		"exportCalibration", "importCalibration",
+	]
+
+	def __init__(self):
+		self.time_scale = float(os.environ.get("VNA_SIM_TIME_SCALE", "1.0"))
+		self.init_delay = 2.0
+		self.prom_delay = 1.0
+		self.noise      = 1e-4
+		self.fault_rate = 0.0
+		self.dut        = default_dut
+
+		self.tasks  = {}
+		self.units  = {}
+		self.faults = {}
+
+		self.__lock       = threading.Lock()
+		self.__next_task  = 1
+		self.__fault_rng  = np.random.RandomState(0)
+
+		for name in self.EXPORTS:
+			setattr(self, name, self.function(name))
+
+	def __repr__(self):
+		return "<SimulatedDLL - %s tasks, %s units>" % (len(self.tasks), len(self.units))
+
+	def function(self, name):
+		''' A new, independently prototyped, function object for export `name`.
+		'''
+		return SimFunction(self, name, getattr(self, "_sim_" + name))
+
+	# ------------------------------------------------------------------
+	# Simulator control
+	# ------------------------------------------------------------------
+
+	def exported_value(self, name):
+		''' Value of an exported DLL constant (the simulated equivalent of `ctype.in_dll()`).
+		'''
+		return EXPORTED_VALUES[name]
+
+	def inject_error(self, function, error, count=1):
+		''' Make the next `count` calls to DLL function `function` fail with `error`.
+
+		Args:
+			function - DLL function name, e.g. "measureUncalibrated".
+			error    - Error name, e.g. "ERR_NO_RESPONSE".
+			count    - Number of calls to fail.
+		'''
+		with self.__lock:
+			self.faults.setdefault(function, []).extend([_V[error]] * count)
+
+	def pop_fault(self, function):
+		with self.__lock:
+			queued = self.faults.get(function)
+			if queued:
+				return queued.pop(0)
+			if self.fault_rate and self.__fault_rng.random_sample() < self.fault_rate:
+				return _V["ERR_NO_RESPONSE"]
+		return None
+
+	def unit_for(self, address, port):
+		''' Get (creating if needed) the simulated unit at `address`:`port`.
+
+		Serial numbers are derived from the address, so they are stable between runs.
+		'''
+		key = (address, port)
+		with self.__lock:
+			if key not in self.units:
+				serial = 100 + zlib.crc32(("%s:%s" % key).encode("ascii")) % 9000
+				self.units[key] = SimUnit(address, port, serial)
+			return self.units[key]
+
+	def sweep_time(self, task, sweeps=1):
+		''' Time, in seconds, a measurement of `sweeps` passes over the task's frequency list takes.
+		'''
+		npts = task.freqs.shape[0]
+		bands = np.digitize(task.freqs, SIM_HARDWARE["band_boundaries"][:SIM_HARDWARE["number_of_band_boundaries"]])
+		band_changes = int(np.count_nonzero(np.diff(bands))) if npts > 1 else 0
+		per_pass = float(npts) / HOP_RATE_HZ[task.hop] + band_changes * BAND_SWITCH_TIME
+		return per_pass * sweeps
+
+	def _sleep(self, seconds):
+		if seconds * self.time_scale > 0:
+			time.sleep(seconds * self.time_scale)
+
+	def _task(self, handle):
+		return self.tasks.get(handle)
+
+	def _acquire(self, task, dut, sweeps=2):
+		''' Block for the simulated sweep time, then return raw measured ratios and the reference.
+
+		Returns:
+			(err, (S11M, S21M, S12M, S22M), Ref)
+		'''
+		task.interrupt.clear()
+		duration = self.sweep_time(task, sweeps) * self.time_scale + task.unit.stall
+		if duration > 0 and task.interrupt.wait(duration):
+			return _V["ERR_INTERRUPTED"], None, None
+		if task.interrupt.is_set():
+			return _V["ERR_INTERRUPTED"], None, None
+
+		freqs = task.freqs
+		npts = freqs.shape[0]
+		if task.model_terms is None:
+			# The unit's "actual" error terms on the current sweep grid.
+			task.model_terms = error_terms(freqs, task.unit.serial)
+		ratios = apply_error_model(task.model_terms, *dut)
+
+		w = 2j * np.pi * freqs * 1e-3
+		atten_db = max(task.atten, 0)
+		ref = 1000.0 * 10 ** (-atten_db / 20.0) * np.exp(-w * 1.0)
+
+		out = []
+		for ratio in ratios:
+			noise = task.rng.standard_normal(npts) + 1j * task.rng.standard_normal(npts)
+			out.append(ratio + noise * self.noise)
+		return _V["ERR_OK"], tuple(out), ref
+
+	# ------------------------------------------------------------------
+	# DLL exports
+	# ------------------------------------------------------------------
+
+	def _sim_versionString(self):
+		return b"VNADLL Simulator 2.0 (python)"
+
+	def _sim_createTask(self):
+		with self.__lock:
+			handle = self.__next_task
+			self.__next_task += 1
+			self.tasks[handle] = SimTask(handle)
+		return handle
+
+	def _sim_deleteTask(self, handle):
+		with self.__lock:
+			self.tasks.pop(handle, None)
+
+	def _sim_initialize(self, handle, callback, user):
+		task = self._task(handle)
+		if task is None:
+			return _V["ERR_BAD_HANDLE"]
+		if task.state != _V["TASK_UNINITIALIZED"]:
+			return _V["ERR_WRONG_STATE"]
+		if not task.address:
+			return _V["ERR_MISSING_IP"]
+		if not task.port:
+			return _V["ERR_MISSING_PORT"]
+
+		self._sleep(self.init_delay)
+		task.unit  = self.unit_for(task.address, task.port)
+		task.state = _V["TASK_STOPPED"]
+		return _V["ERR_OK"]
+
+	def _sim_start(self, handle):
+		task = self._task(handle)
+		if task.state != _V["TASK_STOPPED"]:
+			return _V["ERR_WRONG_STATE"]
+		if task.hop == _V["HOP_UNDEFINED"]:
+			return _V["ERR_MISSING_HOP"]
+		if task.atten == _V["ATTEN_UNDEFINED"]:
+			return _V["ERR_MISSING_ATTEN"]
+		if not task.freqs.shape[0]:
+			return _V["ERR_MISSING_FREQS"]
+		task.state = _V["TASK_STARTED"]
+		return _V["ERR_OK"]
+
+	def _sim_stop(self, handle):
+		task = self._task(handle)
+		if task.state != _V["TASK_STARTED"]:
+			return _V["ERR_WRONG_STATE"]
+		task.state = _V["TASK_STOPPED"]
+		return _V["ERR_OK"]
+
+	def _sim_setIPAddress(self, handle, address):
+		task = self._task(handle)
+		if not address:
+			return _V["ERR_MISSING_IP"]
+		if task.state == _V["TASK_STARTED"]:
+			return _V["ERR_WRONG_STATE"]
+		task.address = address.decode("ascii")
+		task.state   = _V["TASK_UNINITIALIZED"]
+		task.unit    = None
+		task.model_terms = None
+		task.clear_calibration()
+		return _V["ERR_OK"]
+
+	def _sim_setIPPort(self, handle, port):
+		task = self._task(handle)
+		if task.state == _V["TASK_STARTED"]:
+			return _V["ERR_WRONG_STATE"]
+		task.port  = port
+		task.state = _V["TASK_UNINITIALIZED"]
+		task.unit  = None
+		task.model_terms = None
+		task.clear_calibration()
+		return _V["ERR_OK"]
+
+	def _sim_setTimeout(self, handle, timeout):
+		self._task(handle).timeout = timeout
+		return _V["ERR_OK"]
+
+	def _sim_setHopRate(self, handle, rate):
+		task = self._task(handle)
+		if rate not in HOP_RATE_HZ:
+			return _V["ERR_BAD_HOP"]
+		if task.state == _V["TASK_STARTED"]:
+			return _V["ERR_WRONG_STATE"]
+		task.hop = rate
+		return _V["ERR_OK"]
+
+	def _sim_setAttenuation(self, handle, atten):
+		task = self._task(handle)
+		if not 0 <= atten <= 31:
+			return _V["ERR_BAD_ATTEN"]
+		if task.state == _V["TASK_STARTED"]:
+			return _V["ERR_WRONG_STATE"]
+		task.atten = atten
+		return _V["ERR_OK"]
+
+	def _sim_setFrequencies(self, handle, freqs, count):
+		task = self._task(handle)
+		if task.state != _V["TASK_STOPPED"]:
+			return _V["ERR_WRONG_STATE"]
+		return self.__set_frequencies(task, np.array(_view(freqs, count), dtype=np.float64))
+
+	def __set_frequencies(self, task, freqs):
+		if freqs.shape[0] > SIM_HARDWARE["maximum_points"]:
+			return _V["ERR_TOO_MANY_POINTS"]
+		if freqs.shape[0] and (freqs.min() < SIM_HARDWARE["minimum_frequency"] or freqs.max() > SIM_HARDWARE["maximum_frequency"]):
+			return _V["ERR_FREQ_OUT_OF_BOUNDS"]
+		task.freqs = snap_frequency(freqs)
+		task.cal_sweep   = None
+		task.model_terms = None
+		return _V["ERR_OK"]
+
+	def _sim_getState(self, handle):
+		return self._task(handle).state
+
+	def _sim_getTimeout(self, handle):
+		return self._task(handle).timeout
+
+	def _sim_getIPAddress(self, handle):
+		address = self._task(handle).address
+		if address is None:
+			return None
+		return address.encode("ascii")
+
+	def _sim_getIPPort(self, handle):
+		return self._task(handle).port
+
+	def _sim_getHopRate(self, handle):
+		return self._task(handle).hop
+
+	def _sim_getAttenuation(self, handle):
+		return self._task(handle).atten
+
+	def _sim_getNumberOfFrequencies(self, handle):
+		return self._task(handle).freqs.shape[0]
+
+	def _sim_getFrequencies(self, handle, out, count):
+		freqs = self._task(handle).freqs
+		count = min(count, freqs.shape[0])
+		if count:
+			_view(out, count)[:] = freqs[:count]
+		return _V["ERR_OK"]
+
+	def _sim_getHardwareDetails(self, handle):
+		task = self._task(handle)
+		if task.unit is None:
+			return {
+				"minimum_frequency"         : 0,
+				"maximum_frequency"         : 0,
+				"maximum_points"            : 0,
+				"serial_number"             : 0,
+				"band_boundaries"           : (ct.c_int * 8)(),
+				"number_of_band_boundaries" : 0,
+			}
+		return task.unit.details()
+
+	def __check_bounds(self, task, *freqs):
+		if task.state == _V["TASK_UNINITIALIZED"]:
+			return _V["ERR_WRONG_STATE"]
+		for freq in freqs:
+			if freq < SIM_HARDWARE["minimum_frequency"] or freq > SIM_HARDWARE["maximum_frequency"]:
+				return _V["ERR_FREQ_OUT_OF_BOUNDS"]
+		return _V["ERR_OK"]
+
+	def _sim_utilNearestLegalFreq(self, handle, freq):
+		freq = getattr(freq, "_obj", freq).contents
+		ret = self.__check_bounds(self._task(handle), freq.value)
+		if ret == _V["ERR_OK"]:
+			freq.value = float(snap_frequency(freq.value))
+		return ret
+
+	def __fix_limits(self, start, end, count):
+		start = float(snap_frequency(start))
+		if count <= 1 or start == end:
+			return start, float(snap_frequency(end))
+		step = float(snap_frequency((end - start) / (count - 1)))
+		if start + step * (count - 1) > SIM_HARDWARE["maximum_frequency"]:
+			# Rounding the step up must not push the sweep past the hardware limit.
+			step = float(np.floor((end - start) / (count - 1) / FREQ_RESOLUTION) * FREQ_RESOLUTION)
+		return start, start + step * (count - 1)
+
+	def _sim_utilFixLinearSweepLimits(self, handle, start, end, count):
+		start = getattr(start, "_obj", start).contents
+		end   = getattr(end,   "_obj", end).contents
+		ret = self.__check_bounds(self._task(handle), start.value, end.value)
+		if ret != _V["ERR_OK"]:
+			return ret
+		if count > SIM_HARDWARE["maximum_points"]:
+			return _V["ERR_TOO_MANY_POINTS"]
+		start.value, end.value = self.__fix_limits(start.value, end.value, count)
+		return _V["ERR_OK"]
+
+	def _sim_utilPingUnit(self, handle):
+		task = self._task(handle)
+		if not task.address:
+			return _V["ERR_MISSING_IP"]
+		if not task.port:
+			return _V["ERR_MISSING_PORT"]
+		if task.state == _V["TASK_STARTED"]:
+			task.interrupt.set()
+		return _V["ERR_OK"]
+
+	def _sim_utilGenerateLinearSweep(self, handle, start, end, count):
+		task = self._task(handle)
+		if task.state != _V["TASK_STOPPED"]:
+			return _V["ERR_WRONG_STATE"]
+		ret = self.__check_bounds(task, start, end)
+		if ret != _V["ERR_OK"]:
+			return ret
+		if count > SIM_HARDWARE["maximum_points"]:
+			return _V["ERR_TOO_MANY_POINTS"]
+		start, end = self.__fix_limits(start, end, count)
+		return self.__set_frequencies(task, np.linspace(start, end, count))
+
+	def _sim_measureUncalibrated(self, handle, t1r1, t1r2, t2r1, t2r2, ref):
+		task = self._task(handle)
+		if task.state != _V["TASK_STARTED"]:
+			return _V["ERR_WRONG_STATE"]
+
+		ret, (s11m, s21m, s12m, s22m), reference = self.__measure_dut(task)
+		if ret != _V["ERR_OK"]:
+			return ret
+
+		_write_complex(t1r1, s11m * reference)
+		_write_complex(t1r2, s21m * reference)
+		_write_complex(t2r1, s12m * reference)
+		_write_complex(t2r2, s22m * reference)
+		_write_complex(ref,  reference)
+		return _V["ERR_OK"]
+
+	def __measure_dut(self, task):
+		ret, ratios, reference = self._acquire(task, self.dut(task.freqs))
+		if ret != _V["ERR_OK"]:
+			return ret, (None, None, None, None), None
+		return ret, ratios, reference
+
+	def _sim_measure2PortCalibrated(self, handle, s11, s21, s12, s22):
+		task = self._task(handle)
+		if task.state != _V["TASK_STARTED"]:
+			return _V["ERR_WRONG_STATE"]
+		if task.cal_terms is None:
+			return _V["ERR_BAD_CAL"]
+
+		ret, ratios, _ = self.__measure_dut(task)
+		if ret != _V["ERR_OK"]:
+			return ret
+
+		corrected = remove_error_model(task.sweep_terms(), *ratios)
+		for out, values in zip((s11, s21, s12, s22), corrected):
+			_write_complex(out, values)
+		return _V["ERR_OK"]
+
+	def _sim_measureCalibrationStep(self, handle, step):
+		task = self._task(handle)
+		if task.state != _V["TASK_STARTED"]:
+			return _V["ERR_WRONG_STATE"]
+		if step not in CAL_STEPS:
+			return _V["ERR_BAD_CAL"]
+		if task.cal_steps and task.cal_steps["freqs"].shape != task.freqs.shape:
+			return _V["ERR_BAD_CAL"]
+
+		zero = np.zeros(task.freqs.shape[0], dtype=np.complex128)
+		one  = np.ones(task.freqs.shape[0], dtype=np.complex128)
+		standards = {
+			_V["STEP_P1_OPEN"]  : (one,  zero, zero, zero),
+			_V["STEP_P1_SHORT"] : (-one, zero, zero, zero),
+			_V["STEP_P1_LOAD"]  : (zero, zero, zero, zero),
+			_V["STEP_P2_OPEN"]  : (zero, zero, zero, one),
+			_V["STEP_P2_SHORT"] : (zero, zero, zero, -one),
+			_V["STEP_P2_LOAD"]  : (zero, zero, zero, zero),
+			_V["STEP_THRU"]     : (zero, one,  one,  zero),
+		}
+
+		ret, ratios, _ = self._acquire(task, standards[step])
+		if ret != _V["ERR_OK"]:
+			return ret
+
+		task.cal_steps["freqs"] = task.freqs
+		task.cal_steps[step] = ratios
+
+		if all(step in task.cal_steps for step in CAL_STEPS):
+			steps = task.cal_steps
+			std = {
+				"p1_open"  : steps[_V["STEP_P1_OPEN"]][0],
+				"p1_short" : steps[_V["STEP_P1_SHORT"]][0],
+				"p1_load"  : steps[_V["STEP_P1_LOAD"]][0],
+				"p2_open"  : steps[_V["STEP_P2_OPEN"]][3],
+				"p2_short" : steps[_V["STEP_P2_SHORT"]][3],
+				"p2_load"  : steps[_V["STEP_P2_LOAD"]][3],
+				"fw_leak"  : steps[_V["STEP_P1_LOAD"]][1],
+				"rv_leak"  : steps[_V["STEP_P2_LOAD"]][2],
+				"thru"     : steps[_V["STEP_THRU"]],
+			}
+			task.set_calibration(steps["freqs"], solve_solt(std))
+			task.cal_steps = {}
+		return _V["ERR_OK"]
+
+	def _sim_interruptMeasurement(self, handle):
+		task = self._task(handle)
+		if task.state != _V["TASK_STARTED"]:
+			return _V["ERR_WRONG_STATE"]
+		task.interrupt.set()
+		return _V["ERR_OK"]
+
+	def _sim_clearCalibration(self, handle):
+		self._task(handle).clear_calibration()
+		return _V["ERR_OK"]
+
+	def _sim_isCalibrationComplete(self, handle):
+		return self._task(handle).cal_terms is not None
+
+	def _sim_hasFactoryCalibration(self, handle):
+		return self._task(handle).unit is not None
+
+	def _sim_importFactoryCalibration(self, handle):
+		task = self._task(handle)
+		if task.state == _V["TASK_UNINITIALIZED"]:
+			return _V["ERR_WRONG_STATE"]
+		self._sleep(self.prom_delay)
+		task.set_calibration(task.unit.factory_cal_freqs, task.unit.factory_cal_terms)
+		return _V["ERR_OK"]
+
+	def _sim_getCalibrationNumberOfFrequencies(self, handle):
+		return self._task(handle).cal_freqs.shape[0]
+
+	def _sim_getCalibrationFrequencies(self, handle):
+		task = self._task(handle)
+		if not task.cal_freqs.shape[0]:
+			return None
+		# Keep the buffer alive on the task, as the caller only gets a pointer to it.
+		task.cal_buffer = np.ctypeslib.as_ctypes(task.cal_freqs)
+		return ct.pointer(task.cal_buffer)
+
+	def _sim_exportCalibration(self, handle, *terms):
+		task = self._task(handle)
+		if task.cal_terms is None:
+			return _V["ERR_BAD_CAL"]
+		for out, values in zip(terms, task.cal_terms):
+			_write_complex(out, values)
+		return _V["ERR_OK"]
+
+	def _sim_importCalibration(self, handle, freqs, count, *terms):
+		task = self._task(handle)
+		if task.state == _V["TASK_UNINITIALIZED"]:
+			return _V["ERR_WRONG_STATE"]
+		if not freqs or any(not term for term in terms):
+			return _V["ERR_BAD_CAL"]
+		freqs = np.array(_view(freqs, count), dtype=np.float64)
+		task.set_calibration(freqs, [_read_complex(term, count) for term in terms])
+		return _V["ERR_OK"]
+
+## @}
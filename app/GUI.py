@@ -30,7 +30,7 @@ from PyQt5.QtGui  import QIcon
 
 from PyQt5.QtCore import pyqtSlot
 import pyqtgraph
-# import numpy as np
+import numpy as np
 
 import os.path
 import app.vnathread
@@ -147,106 +147,113 @@ class VnaPanel(QWidget):
 		layout.addLayout(self.makeControlWindow())
 		self.setLayout(layout)
 
-		self.proc, self.command_queue, self.response_queue = app.vnathread.create_thread(self.vna_no)
+		self.proc, self.command_queue, self.response_queue, self.ring = app.vnathread.create_thread(self.vna_no)
+		self.epoch    = None
+		self.sweep    = None
+		self.last_seq = -1
+
+		# Displayed curves, rebuilt by `sync_curves()` only when the selection changes.
+		# Each is `[is_fft, row, plot item, legend label, display buffer]`.
+		self.curves          = []
+		self.curve_selection = None
+
+		self.frames      = app.vnathread.FrameScheduler()
+		self.status_time = 0
 
 		self.timer = QTimer()
-		self.timer.setInterval(1000/30)
+		self.timer.setInterval(int(round(self.frames.interval)))
 		self.timer.timeout.connect(self.timer_evt)
 		self.timer.start()
 		self.updateSweepParameters()
 
-	def update_ffts(self, mag, freq, pens):
-		paths = []
-		keys = list(mag.keys())
-		keys.sort()
-		for key in keys:
-			if key.replace("-", " ") in self.plot_paths:
-				value = mag[key]
-				color = pens.pop()
-				ret = self.plot.plot(freq, value, pen=color, antialias=True)
-
-				# Oh god, abusing nbsp here is HORRIBLE.
-				# The spacing of the legend is ghastly without it, though.
-				self.plot.plotItem.legend.addItem(ret, "&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;"+key)
-				paths.append(key)
-		return paths
-
-	def update_sparams(self, mag, freq, pens):
-		paths = []
-		keys = list(mag.keys())
-
-		keys.sort()
-		for key in keys:
-			if key in self.plot_paths:
-				value = mag[key]
-				color = pens.pop()
-				ret = self.plot.plot(freq, value, pen=color, antialias=True)
-
-				# Oh god, abusing nbsp here is HORRIBLE.
-				# The spacing of the legend is ghastly without it, though.
-				self.plot.plotItem.legend.addItem(ret, "&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;"+key)
-				paths.append(key)
-		return paths
-
-	def update_plot(self, data):
+	def sync_curves(self, comp_paths, fft_paths):
+		# Labels, pens and legend entries only depend on which paths are shown.
+		selection = (comp_paths, fft_paths)
+		if selection == self.curve_selection:
+			return
+		self.curve_selection = selection
 
-		assert data['pts']
+		comp_count = len(comp_paths)
+		fft_count  = len(fft_paths)
 
-		if len(data['fft_data']) and len(data['comp_data']):
+		if fft_count and comp_count:
 			self.plot.setLabel("left", text="Magnitude")
 			self.plot.setLabel("bottom", text="Time & Frequency")
-		elif len(data['comp_data']):
+		elif comp_count:
 			self.plot.setLabels(left="Magnitude (dB)", bottom="Frequency (Mhz)")
 
-		elif len(data['fft_data']):
+		elif fft_count:
 			self.plot.setLabels(left="Magnitude", bottom="Time (nanoseconds)")
 
 		else:
 			self.plot.setLabels(left="Wat?", bottom="Wat?")
 
 
-		if len(data['comp_data']) + len(data['fft_data']) == 1:
+		if comp_count + fft_count == 1:
 			pens = ["k"]
 		else:
-			# print(data)
-
 			pens = ["s", "g", "c", "m", (0, 200, 50), "b", (150, 150, 0), "r"]
 
-		paths = []
-		self.plot.clear()
-		self.plot.plotItem.legend.items = []
-
-		if len(data['comp_data']):
-			loc_pens = pens[0:len(data['comp_data'])]
-			paths += self.update_sparams(data['comp_data'], data['pts'], loc_pens)
+		for dummy_is_fft, dummy_row, item, label, dummy_buf in self.curves:
+			self.plot.removeItem(item)
+			self.legend.removeItem(label)
+		self.curves = []
 
+		comp_pens = pens[0:comp_count]
+		fft_pens  = pens[comp_count:comp_count+fft_count]
+		names = []
+		for is_fft, keys, loc_pens in ((False, comp_paths, comp_pens), (True, fft_paths, fft_pens)):
+			for key in keys:
+				name = key+"-FFT" if is_fft else key
 
-			# Scale up the fft_data arrays so the look decent (this is
-			# a visual-only tweak, the Y values are meaningless here anyways)
-
-		if len(data['fft_data']):
-			loc_pens = pens[len(data['comp_data']):len(data['comp_data'])+len(data['fft_data'])]
+				# Oh god, abusing nbsp here is HORRIBLE.
+				# The spacing of the legend is ghastly without it, though.
+				label = "&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;"+name
+				item = self.plot.plot(pen=loc_pens.pop(), antialias=True)
+				self.legend.addItem(item, label)
+				self.curves.append([is_fft, app.vnathread.PATH_INDEX[key], item, label, None])
+				names.append(name)
 
-			for key in data['fft_data'].keys():
-				data['fft_data'][key] = data['fft_data'][key] * 800
-			if len(data['comp_data']):
-				x_ax_val = data['pts']
-			else:
-				x_ax_val = data['fft_pts']
+		self.plot.setTitle(title='VNA %s - %s' % (self.targetIpWidget.text(), ", ".join(names)))
 
+	def update_plot(self, epoch, slot):
 
-			paths += self.update_ffts(data['fft_data'], x_ax_val, loc_pens)
+		assert len(epoch.freqs)
 
+		self.sync_curves(
+				tuple(key for key in sorted(slot.comp_paths) if key in self.plot_paths),
+				tuple(key for key in sorted(slot.fft_paths) if key + " FFT" in self.plot_paths),
+			)
 
-		self.plot.setTitle(title='VNA %s - %s' % (self.targetIpWidget.text(), ", ".join(paths)))
+		if self.curve_selection[0]:
+			fft_x = epoch.freqs
+		else:
+			fft_x = epoch.time_axis
+
+		# The plot items keep referencing the arrays they are given, so each curve
+		# gets its own buffer rather than a row of the (reused) sweep slot.
+		for curve in self.curves:
+			is_fft, row, item, dummy_label, buf = curve
+			src = slot.fft[row] if is_fft else slot.comp[row]
+			if buf is None or buf.shape != src.shape:
+				buf = curve[4] = np.empty_like(src)
+			if is_fft:
+				# Scale up the fft arrays so the look decent (this is
+				# a visual-only tweak, the Y values are meaningless here anyways)
+				np.multiply(src, 800, out=buf)
+				item.setData(fft_x, buf)
+			else:
+				np.copyto(buf, src)
+				item.setData(epoch.freqs, buf)
 
 
 	def timer_evt(self):
 		# print("Timer Event!")
+		tick = self.frames.tick()
 		while not self.response_queue.empty():
 			arg, value = self.response_queue.get()
-			if arg == 'sweep data':
-				self.update_plot(value)
+			if arg == 'config':
+				self.epoch = value
 			elif arg == 'connect':
 				if value == True:
 					self.runButton.setEnabled(True)
@@ -259,6 +266,30 @@ class VnaPanel(QWidget):
 			else:
 				print("Unknown response type: '%s'" % arg)
 
+		# Sweeps only carry their epoch id. The epoch itself is announced on the
+		# response queue before its first sweep is published, so it is known here.
+		sweep = self.ring.read_latest(self.last_seq, self.sweep)
+		if sweep is None:
+			return
+
+		skipped = sweep.seq - self.last_seq - 1 if self.last_seq >= 0 else 0
+		self.sweep    = sweep
+		self.last_seq = sweep.seq
+		if self.epoch is None or sweep.epoch != self.epoch.epoch:
+			self.frames.skip(skipped + 1)
+			return
+
+		self.update_plot(self.epoch, sweep)
+		# Changing the interval restarts the timer, so only do it for a real change.
+		interval = int(round(self.frames.rendered(tick, skipped)))
+		if abs(interval - self.timer.interval()) > self.timer.interval() * 0.1:
+			self.timer.setInterval(interval)
+			self.frames.restarted()
+
+		if tick[0] - self.status_time >= 1.0:
+			self.status_time = tick[0]
+			self.frameStatus.setText("Frames: %s drawn, %s dropped - %.0f ms refresh" % (self.frames.drawn, self.frames.dropped, self.frames.interval))
+
 	def buttonConnect_evt(self):
 		params = (self.targetIpWidget.text(), int(self.targetPortWidget.text()))
 		self.command_queue.put(("connect", params))
@@ -300,6 +331,9 @@ class VnaPanel(QWidget):
 		self.legend = self.plot.addLegend(offset=(-60, -30))
 		layout.addWidget(self.plot)
 
+		self.frameStatus = QLabel("")
+		layout.addWidget(self.frameStatus)
+
 		return layout
 
 
@@ -358,6 +392,9 @@ class VnaPanel(QWidget):
 
 		self.plot_paths = checked
 
+		# Only have the VNA thread compute what's actually displayed.
+		self.command_queue.put(("subscribe", ("plot", checked)))
+
 
 	def makeCallButtonCtrl(self):
 		self.calButtonControl = CalibrateDialog(self)
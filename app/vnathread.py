@@ -9,6 +9,7 @@ except ImportError:
 import runstate
 import traceback
 import logging
+import collections
 
 import numpy as np
 
@@ -56,9 +57,345 @@ def get_param_from_ret(param, scan):
 		raise ValueError("Unknown path: '%s'. Wat?" % param)
 
 
+class TimeDomainPlan(object):
+	''' Everything `VnaThread.get_fft()` needs for one sweep setup, worked out once.
+
+		Holds the window, the zero-padding layout, the transform size and the
+		time axis for sweeps of `npts` points from `start_f` to `stop_f` (MHz), plus
+		the work and output buffers the transform runs in. `transform()` then
+		windows, pads and inverse-FFTs any number of paths in a single batched call
+		(`inverse()` does the same for rows that are already windowed).
+	'''
+
+	# Transform sizes, smallest first. Sweeps that don't fit are transformed at
+	# their padded length, and truncated to the largest size.
+	SIZES = (128, 256, 512, 1024, 2048, 4096, 8192)
+
+	def __init__(self, npts, start_f, stop_f, window=np.hanning, paths=4):
+		self.key    = (npts, start_f, stop_f, window)
+		self.npts   = npts
+		self.window = window(npts)
+
+		if start_f == stop_f:
+			step_val = 0
+			start_padding = 0
+		else:
+			# Pad the start of the array for phase-correctness, and
+			# the end to make the calculation a power of N
+			step_val = abs(start_f - stop_f) / npts
+			start_padding = max(int(start_f / step_val), 0)
+
+		startsize = start_padding + npts
+		output_size = self.SIZES[-1]
+		for size in self.SIZES:
+			if size >= startsize:
+				output_size = size
+				break
+
+		self.start_padding = start_padding
+		self.nfft          = max(output_size, startsize)
+		self.keep          = int(output_size / 2)
+
+		if step_val == 0:
+			self.time_axis = np.arange(self.keep, dtype=np.float64)
+		else:
+			# Time of each bin, in nanoseconds
+			self.time_axis = np.arange(self.keep) * (1 / (self.keep * step_val * 1e6 * 2)) * 1e9
+
+		self.__padded = np.zeros((paths, self.nfft), dtype=np.complex128)
+		self.__spectrum = np.empty((paths, self.nfft), dtype=np.complex128)
+		self.__out = np.empty((paths, self.keep), dtype=np.float64)
+
+	def output(self, count):
+		# `(count, keep)` output buffer owned by the plan, for `transform()` callers
+		# that use the result before the next transform.
+		if count > self.__out.shape[0]:
+			self.__out = np.empty((count, self.keep), dtype=np.float64)
+		return self.__out[:count]
+
+	def transform(self, rows, out=None):
+		''' Magnitude of the (windowed, padded) inverse FFT of each row in `rows`.
+
+			Args:
+				rows	-- Sequence of `npts` complex arrays.
+				out		-- Optional `(len(rows), keep)` float64 array to write into.
+
+			Returns:
+				`(len(rows), keep)` float64 array, positive time bins only.
+		'''
+		return self.inverse(rows, out=out, window=True)
+
+	def inverse(self, rows, out=None, window=False):
+		''' As `transform()`, but only applies the window if `window` is set.
+		'''
+		count = len(rows)
+		if count > self.__padded.shape[0]:
+			self.__padded   = np.zeros((count, self.nfft), dtype=np.complex128)
+			self.__spectrum = np.empty((count, self.nfft), dtype=np.complex128)
+		if out is None:
+			out = np.empty((count, self.keep), dtype=np.float64)
+
+		padded = self.__padded[:count]
+		# Only the data region is ever written, so the padding stays zero.
+		data = padded[:, self.start_padding:self.start_padding + self.npts]
+		for idx, row in enumerate(rows):
+			if window:
+				np.multiply(row, self.window, out=data[idx])
+			else:
+				data[idx] = row
+
+		spectrum = self.__spectrum[:count]
+		try:
+			np.fft.ifft(padded, axis=-1, out=spectrum)
+		except TypeError:
+			# numpy < 2.0 has no `out` argument
+			spectrum = np.fft.ifft(padded, axis=-1)
+
+		# Chop off the negative time component (we don't care about it here)
+		np.absolute(spectrum[:, :self.keep], out=out)
+		return out
+
+
+
+class SweepGraph(object):
+	''' Demand-driven per-sweep processing.
+
+		Stages are registered by name, along with the stages they take their input
+		from, and compute one value per S-parameter path. Consumers subscribe to
+		`(stage, path)` outputs, and `run()` only computes the stages (and paths)
+		that some subscription needs, each of them once per sweep, no matter how
+		many outputs depend on it.
+
+		Stage functions are called as `func(context, paths, *inputs)`, where each
+		of `inputs` is a list of values from one input stage, in `paths` order, and
+		return a list of values in the same order. A stage sees all of its paths
+		at once, so it can process them in one batch.
+	'''
+
+	def __init__(self):
+		self.stages = collections.OrderedDict()
+		self.subscriptions = {}
+		self.__plan = None
+
+	def add_stage(self, name, func, inputs=()):
+		for dep in inputs:
+			assert dep in self.stages, "Input stages have to be added before the stages using them!"
+		self.stages[name] = (func, tuple(inputs))
+		self.__plan = None
+
+	def subscribe(self, subscriber, outputs):
+		# Replaces any previous subscription by `subscriber`.
+		outputs = set(outputs)
+		for stage, path in outputs:
+			assert stage in self.stages, "Unknown stage: '%s'" % stage
+		self.subscriptions[subscriber] = outputs
+		self.__plan = None
+
+	def unsubscribe(self, subscriber):
+		self.subscriptions.pop(subscriber, None)
+		self.__plan = None
+
+	def plan(self):
+		# List of `(stage, paths)` to run, in dependency order. Only changes when
+		# the subscriptions (or stages) do.
+		if self.__plan is None:
+			needed = collections.defaultdict(set)
+			pending = [output for outputs in self.subscriptions.values() for output in outputs]
+			while pending:
+				stage, path = pending.pop()
+				if path in needed[stage]:
+					continue
+				needed[stage].add(path)
+				pending.extend((dep, path) for dep in self.stages[stage][1])
+			self.__plan = [(stage, sorted(needed[stage])) for stage in self.stages if needed[stage]]
+		return self.__plan
+
+	def run(self, context):
+		# Returns a dict of the values of every stage that ran, as `{stage : {path : value}}`.
+		values = {}
+		for stage, paths in self.plan():
+			func, inputs = self.stages[stage]
+			args = [[values[dep][path] for path in paths] for dep in inputs]
+			values[stage] = dict(zip(paths, func(context, paths, *args)))
+		return values
+
+
+## The S-parameter paths `VnaThread` processes
+S_PATHS = ('S11', 'S21', 'S12', 'S22')
+
+def build_sweep_graph():
+	graph = SweepGraph()
+	graph.add_stage("ratio",  lambda ctx, paths: [get_param_from_ret(path, ctx['sweep'])[1] for path in paths])
+	graph.add_stage("logmag", lambda ctx, paths, ratios: [log_mag(val) for val in ratios], inputs=("ratio", ))
+	graph.add_stage("ifft",   lambda ctx, paths, ratios: list(ctx['plan'].transform(ratios, out=ctx['plan'].output(len(ratios)))), inputs=("ratio", ))
+	graph.add_stage("peak",   lambda ctx, paths, mags: [np.max(val) for val in mags], inputs=("ifft", ))
+	return graph
+
+def display_outputs(names):
+	# Graph outputs needed to display `names`, as named by the GUI's path check
+	# boxes (e.g. "S21", or "S21 FFT").
+	outputs = []
+	for name in names:
+		if name.endswith(" FFT"):
+			path = name[:-len(" FFT")]
+			outputs += [("ifft", path), ("peak", path)]
+		else:
+			outputs.append(("logmag", name))
+	return outputs
+
+
+## Row of each path in the `SweepSlot` arrays
+PATH_INDEX = dict((path, idx) for idx, path in enumerate(S_PATHS))
+
+## Everything about a sweep that only changes when the unit is reprogrammed (or
+## the calibration changes). Announced once, as a `("config", SweepEpoch)`
+## response, before the first sweep that uses it. `cal_id` is None for
+## uncalibrated sweeps; replayed sweeps have no hop rate or attenuation.
+SweepEpoch = collections.namedtuple("SweepEpoch", ["epoch", "freqs", "time_axis", "hoprate", "attenuation", "cal_id"])
+
+class SweepSlot(object):
+	''' One preallocated entry of a `SweepRing`.
+
+		A sweep carries only the id of its `SweepEpoch`, its sequence number and
+		the data. `comp` holds the log-magnitude of each path in `S_PATHS` order,
+		`fft` the time-domain magnitude and `fft_max` its peak. Only the rows named
+		in `comp_paths` and `fft_paths` were written for this sweep.
+	'''
+	def __init__(self, npts, keep):
+		self.seq        = -1
+		self.epoch      = -1
+		self.timestamp  = 0.0
+		self.comp       = np.zeros((len(S_PATHS), npts))
+		self.fft        = np.zeros((len(S_PATHS), keep))
+		self.fft_max    = np.zeros(len(S_PATHS))
+		self.comp_paths = ()
+		self.fft_paths  = ()
+
+class SweepRing(object):
+	''' Fixed-capacity ring of preallocated sweep slots, passing processed sweeps
+		from the VNA thread (the only writer) to the GUI.
+
+		The writer fills the slot from `begin()` and hands it over with `publish()`,
+		which numbers it. Readers copy the newest complete sweep out with
+		`read_latest()`, which checks the sequence number again after the copy so
+		a slot reused by the writer in the meantime is never returned. A slot is
+		only reused after `capacity - 1` newer sweeps have been published.
+
+		Each new `SweepEpoch` is passed to `configure()`, which reallocates the
+		slots if the sweep changed shape.
+	'''
+	def __init__(self, capacity=4):
+		assert capacity >= 2, "The ring needs at least two slots!"
+		self.capacity = capacity
+		self.epoch    = None
+		self.slots    = []
+		self.latest   = None
+		self.__seq    = 0
+
+	def configure(self, epoch):
+		shape = (epoch.freqs.shape[0], epoch.time_axis.shape[0])
+		if not self.slots or (self.slots[0].comp.shape[1], self.slots[0].fft.shape[1]) != shape:
+			self.slots = [SweepSlot(*shape) for dummy in range(self.capacity)]
+		self.epoch = epoch
+
+	def begin(self):
+		slot = self.slots[self.__seq % self.capacity]
+		slot.seq = -1
+		return slot
+
+	def publish(self, slot, timestamp):
+		slot.epoch     = self.epoch.epoch
+		slot.timestamp = timestamp
+		slot.seq       = self.__seq
+		self.latest    = (self.slots, self.__seq)
+		self.__seq    += 1
+
+	def read_latest(self, last_seq=-1, into=None):
+		# Copies the newest sweep after `last_seq` into the reader's own slot `into`
+		# (allocated if missing or the wrong shape) and returns it. Returns None if
+		# there is nothing new, or if the writer overwrote the sweep while it was
+		# being copied.
+		latest = self.latest
+		if latest is None or latest[1] <= last_seq:
+			return None
+		slots, seq = latest
+		slot = slots[seq % self.capacity]
+		if into is None or into.comp.shape != slot.comp.shape or into.fft.shape != slot.fft.shape:
+			into = SweepSlot(slot.comp.shape[1], slot.fft.shape[1])
+		into.epoch      = slot.epoch
+		into.comp_paths = slot.comp_paths
+		into.fft_paths  = slot.fft_paths
+		into.timestamp  = slot.timestamp
+		np.copyto(into.comp,    slot.comp)
+		np.copyto(into.fft,     slot.fft)
+		np.copyto(into.fft_max, slot.fft_max)
+		if slot.seq != seq:
+			return None
+		into.seq = seq
+		return into
+
+
+class FrameScheduler(object):
+	''' Paces the redraws of one panel.
+
+		Only the newest sweep is drawn on each tick, so anything the VNA thread
+		published in between is counted as dropped. The tick interval follows the
+		measured render cost, so a slow plot is redrawn less often rather than
+		falling behind. Render cost is the time spent in the tick, plus however
+		late the tick fired (Qt paints the plot between ticks). `clock` returns the
+		current time in seconds.
+	'''
+	def __init__(self, min_interval=1000/60.0, max_interval=1000/4.0, budget=0.5, smoothing=0.2, clock=time.time):
+		self.clock        = clock
+		self.min_interval = min_interval
+		self.max_interval = max_interval
+		self.budget       = budget
+		self.smoothing    = smoothing
+
+		self.interval = 1000/30.0
+		self.cost     = 0.0
+		self.drawn    = 0
+		self.dropped  = 0
+		self.__last_tick = None
+		self.__last_busy = 0.0
+
+	def tick(self):
+		# Start of a timer tick. Returns the tick time, for `rendered()`. A tick that
+		# ran past the interval delays the next one by itself, which is not counted
+		# as lateness.
+		now = self.clock()
+		late = 0.0
+		if self.__last_tick is not None:
+			late = max(0.0, (now - self.__last_tick) * 1000 - max(self.interval, self.__last_busy))
+		self.__last_tick = now
+		self.__last_busy = 0.0
+		return now, late
+
+	def rendered(self, tick, skipped=0):
+		# Record one drawn frame, and the `skipped` sweeps it superseded. Returns the
+		# new tick interval (ms).
+		started, late = tick
+		self.__last_busy = (self.clock() - started) * 1000
+		cost = self.__last_busy + late
+		self.cost     += self.smoothing * (cost - self.cost)
+		self.drawn    += 1
+		self.dropped  += skipped
+		self.interval  = min(self.max_interval, max(self.min_interval, self.cost / self.budget))
+		return self.interval
+
+	def restarted(self):
+		# The timer was restarted (by changing its interval), so the next tick is
+		# due one interval from now.
+		self.__last_tick = self.clock()
+		self.__last_busy = 0.0
+
+	def skip(self, count=1):
+		# Sweeps that were read but could not be drawn.
+		self.dropped += count
+
 
 class VnaThread():
-	def __init__(self, vna_no, command_queue, response_queue):
+	def __init__(self, vna_no, command_queue, response_queue, ring=None):
 
 
 		self.vna_no = vna_no
@@ -68,6 +405,7 @@ class VnaThread():
 
 		self.command_queue  = command_queue
 		self.response_queue = response_queue
+		self.ring           = ring if ring is not None else SweepRing()
 		self.vna            = None
 		self.runstate       = False
 		self.log.info("VNA Thread running")
@@ -80,6 +418,8 @@ class VnaThread():
 		self.start_f     = 375
 		self.stop_f      = 6050
 		self.npts_s      = 256
+		self.hoprate     = VNA.HOP_45K
+		self.attenuation = VNA.ATTEN_0
 
 		# self.start_f = 500
 		# self.stop_f  = 6000
@@ -87,49 +427,53 @@ class VnaThread():
 
 		self.connection_params = None
 
+		# Sweep recording (see `start_recording()`)
+		self.recorder       = None
+		self.record_serial  = None
+		self.record_configs = {}
+
+		# Sweep source standing in for the unit (see `start_replay()`)
+		self.replay = None
+
+		# Cached transform layout for `get_fft()`
+		self.time_domain = None
+
+		# Current `SweepEpoch` (and the transform layout for it). Reset to None
+		# whenever the unit is reprogrammed, and re-announced with the next sweep.
+		# `cal_generation` is bumped whenever the calibration may have changed.
+		self.epoch          = None
+		self.epoch_plan     = None
+		self.epoch_count    = 0
+		self.cal_generation = 0
+
+		# Per-sweep processing. Until a consumer subscribes (with the
+		# "subscribe" command), everything is computed.
+		self.graph = build_sweep_graph()
+		self.graph.subscribe("default", display_outputs(S_PATHS + tuple(path + " FFT" for path in S_PATHS)))
+
 	def tryLoadLocalCal(self):
 		fname = "../VNA-Cal-{ip}.csv".format(ip=self.vna.getIPAddress())
-		if not os.path.exists(fname):
+		binname = os.path.splitext(fname)[0] + VNA.calfile.CALFILE_EXTENSION
+
+		# The CSV is converted to the binary format the first time it is seen (or
+		# whenever it changes), after which loading it is a single mmap.
+		if os.path.exists(fname):
+			if not os.path.exists(binname) or os.path.getmtime(binname) < os.path.getmtime(fname):
+				self.log.info("Found local CSV cal file! Converting it to '%s'.", binname)
+				try:
+					VNA.calfile.convert_calibration(fname, binname)
+				except (IOError, OSError):
+					self.log.warning("Could not write '%s'. Loading the CSV directly.", binname)
+					binname = fname
+		elif not os.path.exists(binname):
 			self.log.warning("Could not find local CSV cal file '%s'.", fname)
 			return False
 
 		self.log.info("Found local cal file! Trying to load.")
-		dat = np.genfromtxt(fname, delimiter=",", skip_header=1, dtype=np.float64)
-
-		# Row structure:
-		# Freq,
-		# EDFi,EDFq,
-		# ESFi,ESFq,
-		# ERFi,ERFq,
-		# EXFi,EXFq,
-		# ELFi,ELFq,
-		# ETFi,ETFq,
-		# EDRi,EDRq,
-		# ESRi,ESRq,
-		# ERRi,ERRq,
-		# EXRi,EXRq,
-		# ELRi,ELRq,
-		# ETRi,ETRq
-
-		freqs = dat[...,0]
-		EDF = dat[..., 1] + 1j* dat[..., 2] # EDF/e00
-		ESF = dat[..., 3] + 1j* dat[..., 4] # ESF/e11
-		ERF = dat[..., 5] + 1j* dat[..., 6] # ERF/e10e01
-		EXF = dat[..., 7] + 1j* dat[..., 8] # EXF/e30
-		ELF = dat[..., 9] + 1j* dat[...,10] # ELF/e22
-		ETF = dat[...,11] + 1j* dat[...,12] # ETF/e10e32
-		EDR = dat[...,13] + 1j* dat[...,14] # EDR/ep33
-		ESR = dat[...,15] + 1j* dat[...,16] # ESR/ep22
-		ERR = dat[...,17] + 1j* dat[...,18] # ERR/ep12ep32
-		EXR = dat[...,19] + 1j* dat[...,20] # EXR/ep03
-		ELR = dat[...,21] + 1j* dat[...,22] # ELR/ep11
-		ETR = dat[...,23] + 1j* dat[...,24] # ETR/ep23ep01
-
-		# print(freqs, EDF, ESF, ERF, EXF, ELF, ETF, EDR, ESR, ERR, EXR, ELR, ETR )
-
-		self.vna.importCalibration(freqs, EDF, ESF, ERF, EXF, ELF, ETF, EDR, ESR, ERR, EXR, ELR, ETR)
-
-		print("Cal name:", fname)
+		cal = VNA.calfile.import_calibration(binname)
+		self.vna.importCalibrationArray(cal.freqs, cal.terms)
+
+		print("Cal name:", binname)
 		return True
 
 	def do_connect(self, connection_params):
@@ -141,14 +485,14 @@ class VnaThread():
 				pass
 
 		self.vna = VNA.VNA(*connection_params, vna_no=self.vna_no)
-		self.vna.set_config(VNA.HOP_45K, VNA.ATTEN_0, freq=[self.start_f, self.stop_f, self.npts_s])
+		self.configure_vna()
 		self.vna.setTimeout(500)
 
 
 
 		try:
-			self.vna.importFactoryCalibration()
-			self.log.info("Factory calibration loaded! Cal complete: %s", self.vna.isCalibrationComplete())
+			source = self.vna.load_factory_cal()
+			self.log.info("Factory calibration loaded from %s! Cal complete: %s", source, self.vna.isCalibrationComplete())
 		except VNA.VNA_Exception:
 			for line in traceback.format_exc().split("\n"):
 				self.log.warn("No factory calibration in VNA?")
@@ -190,6 +534,7 @@ class VnaThread():
 				except VNA.VNA_Exception:
 					pass
 
+				self.stop_recording()
 				self.vna = None
 				self.log.info("VNA Disconnected")
 				self.response_queue.put(("connect", False))
@@ -198,23 +543,26 @@ class VnaThread():
 
 
 		elif command == "run":
-			if not self.vna and params == True:
+			if not self.vna and self.replay is None and params == True:
 				self.log.error("You have to connect to a VNA first!")
 				return True
 			if self.runstate == params and params == True:
 				self.log.error("Run command that matches current state?")
 			else:
 
-				if params == True:
+				if params == True and self.replay is not None:
+					self.log.info("Starting replay")
+					self.runstate = True
+				elif params == True:
 					self.log.info("Starting VNA task")
-					self.vna.set_config(VNA.HOP_45K, VNA.ATTEN_0, freq=[self.start_f, self.stop_f, self.npts_s])
+					self.configure_vna()
 					self.vna.start()
 					self.runstate = True
 				else:
-					if self.vna != None:
+					if self.vna != None and self.replay is None:
 						self.log.info("Stopping VNA task")
 						self.vna.stop()
-						self.runstate = False
+					self.runstate = False
 
 
 		elif command == "halt" and params == True:
@@ -249,6 +597,21 @@ class VnaThread():
 			self.handle_calibrate(step = params)
 		elif command == "cal_data":
 			self.calibrate_manage(command = params)
+		elif command == "subscribe":
+			# `(subscriber, displayed_paths)`, see `display_outputs()`
+			subscriber, names = params
+			self.graph.unsubscribe("default")
+			self.graph.subscribe(subscriber, display_outputs(names))
+		elif command == "replay":
+			if params:
+				self.start_replay(params)
+			else:
+				self.stop_replay()
+		elif command == "record":
+			if params:
+				self.start_recording(params)
+			else:
+				self.stop_recording()
 		else:
 			self.log.error("Unknown command: '%s'", command)
 			self.log.error("Command parameters: '%s'", params)
@@ -284,6 +647,7 @@ class VnaThread():
 
 	def calibrate_manage(self, command):
 
+		self.cal_generation += 1
 		if command == 'CAL_LOAD':
 			if self.tryLoadLocalCal():
 				self.log.info("Found local CSV calibration! Loading....")
@@ -293,7 +657,7 @@ class VnaThread():
 
 		elif command == 'CAL_FACTORY':
 			try:
-				self.vna.importFactoryCalibration()
+				self.vna.load_factory_cal()
 				self.vna.measure_cal()
 				self.log.info("Factory calibration loaded! Cal complete: %s", self.vna.isCalibrationComplete())
 				return
@@ -302,7 +666,9 @@ class VnaThread():
 				self.log.info("Failed to load factory cal! %s", self.vna.isCalibrationComplete())
 
 		elif command == 'CAL_CLEAR':
+			# The library copy goes too, or the next `configure_vna()` would bring it back.
 			self.vna.clearCalibration()
+			self.vna.discard_library_cal()
 		elif command == 'CAL_SAVE':
 			self.vna.save_dll_cal_auto()
 
@@ -310,6 +676,65 @@ class VnaThread():
 		else:
 			raise ValueError("Unknown calibration management command: %s." % command)
 
+	def start_replay(self, params):
+		# `params` is an archive directory, or a `(directory, speed[, prefix])` tuple. A
+		# speed of None replays as fast as the sweeps can be processed. Only this
+		# panel's recording (see `start_recording()`) is replayed, unless another
+		# recording prefix is given.
+		prefix = "vna-%s" % self.vna_no
+		if isinstance(params, (tuple, list)):
+			dirpath, speed = params[:2]
+			if len(params) > 2:
+				prefix = params[2]
+		else:
+			dirpath, speed = params, 1.0
+
+		# The replay stands in for the unit, so the live task is not left running.
+		if self.vna:
+			try:
+				self.vna.stop()
+			except VNA.VNA_Exception:
+				pass
+
+		self.replay = VNA.archive.SweepReplay(VNA.archive.SweepArchive(dirpath, prefix=prefix), speed=speed, loop=True)
+		self.epoch  = None
+		if not len(self.replay):
+			self.log.error("No recorded sweeps with prefix '%s' in '%s'!", prefix, dirpath)
+			self.replay = None
+			return
+		self.log.info("Replaying %s sweeps from '%s' (speed: %s)", len(self.replay), dirpath, speed or "unlimited")
+
+	def stop_replay(self):
+		if self.replay is not None:
+			self.replay = None
+			self.epoch  = None
+			self.runstate = False
+			self.log.info("Replay stopped")
+
+	def start_recording(self, dirpath):
+		if not self.vna:
+			self.log.error("You have to connect to a VNA first!")
+			return
+		self.stop_recording()
+		self.recorder       = VNA.archive.SweepRecorder(dirpath, prefix="vna-%s" % self.vna_no)
+		self.record_serial  = self.vna.getHardwareDetails()['serial_number']
+		self.record_configs = {}
+		self.log.info("Recording sweeps to '%s'", dirpath)
+
+	def stop_recording(self):
+		if self.recorder is not None:
+			self.recorder.close()
+			self.recorder = None
+			self.log.info("Sweep recording stopped")
+
+	def record_sweep(self, values):
+		# Configuration ids are looked up once per sweep setup, and forgotten by `configure_vna()`.
+		config = self.record_configs.get(values._fields)
+		if config is None:
+			config = self.recorder.register_config(self.epoch.freqs, values._fields)
+			self.record_configs[values._fields] = config
+		self.recorder.append(config, self.record_serial, values)
+
 	def handle_calibrate(self, step):
 		commands = {
 			'STEP_P1_OPEN'  : VNA.STEP_P1_OPEN,
@@ -325,7 +750,38 @@ class VnaThread():
 			raise VNA.VNA_Exception_Bad_Cal("Invalid calibration step: %s" % step)
 
 		self.vna.measureCalibrationStep(commands[step])
+		self.cal_generation += 1
 		self.log.info("Calibration step complete.")
+
+		# Keep the finished calibration around, so switching back to this sweep
+		# configuration later re-activates it (see `set_config()`).
+		if self.vna.isCalibrationComplete():
+			self.vna.store_cal()
+
+	def configure_vna(self):
+		# Every reprogramming of the unit starts a new sweep epoch.
+		self.record_configs = {}
+		self.epoch = None
+		self.vna.set_config(self.hoprate, self.attenuation, freq=[self.start_f, self.stop_f, self.npts_s])
+
+	def new_epoch(self, freqs, hoprate, attenuation, cal_id, span):
+		# `span` is the `(start_f, stop_f)` the FFT time axis is worked out for.
+		freqs = np.asarray(freqs, dtype=np.float64)
+		freqs.flags.writeable = False
+		self.epoch_plan = self.fft_plan(freqs.shape[0], *span)
+		self.epoch_count += 1
+		self.epoch = SweepEpoch(
+				epoch       = self.epoch_count,
+				freqs       = freqs,
+				time_axis   = self.epoch_plan.time_axis,
+				hoprate     = hoprate,
+				attenuation = attenuation,
+				cal_id      = cal_id,
+			)
+		self.ring.configure(self.epoch)
+		self.response_queue.put(("config", self.epoch))
+		self.log.info("Sweep epoch %s: %s points, %s-%s MHz, cal: %s", self.epoch.epoch, freqs.shape[0], span[0], span[1], cal_id)
+
 	def restart_acq(self, check=False):
 		if check:
 			state = self.vna.getState()
@@ -342,57 +798,25 @@ class VnaThread():
 				self.vna.stop()
 			except VNA.VNA_Exception_Wrong_State:
 				pass
-		self.vna.set_config(VNA.HOP_45K, VNA.ATTEN_0, freq=[self.start_f, self.stop_f, self.npts_s])
+		self.configure_vna()
 		self.vna.start()
 
 
-	def get_fft(self, data, points):
-
-
-		data_len = data.shape[0]
-
-		# Apply windowing (needs to be an elementwise multiplication)
-		data = np.multiply(data, np.hanning(data_len))
-
-		# Pad the start of the array for phase-correctness, and
-		# the end to make the calculation a power of N
-		step_val = abs(self.start_f - self.stop_f) / self.npts_s
-		start_padding = max(int(self.start_f/step_val), 0)
-
-		startsize = start_padding + data_len
-
-		sizes = [128, 256, 512, 1024, 2048, 4096, 8192]
-		start_idx   = 0
-		output_size = 0
-		while output_size < startsize and start_idx < len(sizes):
-			output_size = sizes[start_idx]
-			start_idx += 1
-
-		end_padding = max(output_size - startsize, 0)
+	def fft_plan(self, npts, start_f=None, stop_f=None):
+		# Rebuilt only when the sweep setup changes. Defaults to the live sweep range.
+		if start_f is None:
+			start_f, stop_f = self.start_f, self.stop_f
+		key = (npts, start_f, stop_f, np.hanning)
+		if self.time_domain is None or self.time_domain.key != key:
+			self.time_domain = TimeDomainPlan(npts, start_f, stop_f)
+		return self.time_domain
 
-		# Default padding value is "0"
-		arr = np.pad(data, (start_padding, end_padding), mode='constant')
-
-		fft_data = np.fft.ifft(arr)
-
-		# Chop off the negative time component (we don't care about it here)
-		fft_data = fft_data[:int(output_size/2)]
-		fft_data = np.absolute(fft_data)
-
-		if self.start_f == self.stop_f:
-			return fft_data, np.array(range(fft_data.shape[0]))
-
-		pts = np.array(range(fft_data.shape[0]))
-
-		# Convert to hertz
-		step_val = step_val * 1e6
-		pts = pts * (1 / (len(pts) * step_val * 2))
-
-		pts = pts * 1e9
-		return fft_data, pts
+	def get_fft(self, data, points):
+		plan = self.fft_plan(data.shape[0])
+		return plan.transform([data])[0], plan.time_axis
 
 
-	def get_data(self):
+	def measure_sweep(self):
 
 		self.restart_acq(check=True)
 
@@ -406,7 +830,8 @@ class VnaThread():
 		# 		self.log.info("Failed to load factory cal! %s", self.vna.isCalibrationComplete())
 
 		try:
-			if self.vna.isCalibrationComplete():
+			calibrated = self.vna.isCalibrationComplete()
+			if calibrated:
 				self.log.info("Doing calibrated measurement!")
 				return_values = self.vna.measure_cal()
 			else:
@@ -417,7 +842,7 @@ class VnaThread():
 			self.vna.stop()
 			self.log.info("VNA Acquisition halted. Restarting...")
 			time.sleep(0.1)
-			self.vna.set_config(VNA.HOP_45K, VNA.ATTEN_0, freq=[self.start_f, self.stop_f, self.npts_s])
+			self.configure_vna()
 
 			# Be double plus sure we're stopped.
 			try:
@@ -426,61 +851,67 @@ class VnaThread():
 				pass
 			time.sleep(0.1)
 			self.vna.start()
-			return
-
-		compensated_data = {}
-
+			return None
 
+		# The frequency axis is only fetched from the unit once per epoch.
+		cal_id = self.cal_generation if calibrated else None
+		if self.epoch is None or self.epoch.cal_id != cal_id:
+			self.new_epoch(self.vna.getFrequencies(), self.hoprate, self.attenuation, cal_id, (self.start_f, self.stop_f))
 
-		fft_data = {}
-		fft_pts  = []
-		frequencies = self.vna.getFrequencies()
+		if self.recorder is not None:
+			self.record_sweep(return_values)
 
-		assert frequencies is not None
-
-		for path in ('S11', 'S12', 'S21', 'S22', 'S11-FFT', 'S21-FFT', 'S12-FFT', 'S22-FFT'):
-			base = path.split("-")[0]
-			key, val = get_param_from_ret(base, return_values)
-			if "FFT" in path:
-				fft_data_tmp, fft_pts = self.get_fft(val, frequencies)
-				fft_data[path] = fft_data_tmp
-			else:
-				compensated_data[path] = log_mag(val)
+		return return_values
 
-		# print([len(compensated_data[path]) for path in compensated_data.keys()])
-		# if not any([len(compensated_data[path]) for path in compensated_data.keys()]):
+	def next_replay_sweep(self):
+		try:
+			sweep = self.replay.next_sweep()
+		except StopIteration:
+			self.log.info("Replay finished.")
+			self.runstate = False
+			return None
+
+		if sweep.paths == VNA.CAL_PATHS:
+			return_values = VNA.Cal_Scan_Return(*sweep.data)
+		else:
+			return_values = VNA.Uncal_Scan_Return(*sweep.data)
 
-		if not len(compensated_data):
-			frequencies = []
+		# Follow the recorded sweep setup, so the FFT axis matches the data. The live
+		# sweep settings are left alone, for when the replay stops.
+		if self.epoch is None or (self.epoch.freqs is not sweep.freqs and not np.array_equal(self.epoch.freqs, sweep.freqs)):
+			self.new_epoch(sweep.freqs, None, None, None, (float(sweep.freqs[0]), float(sweep.freqs[-1])))
+		return return_values
 
+	def get_data(self):
 
-		fft_max = {}
-		for key, arr in fft_data.items():
-			fft_max[key] = np.max(arr)
+		if self.replay is not None:
+			return_values = self.next_replay_sweep()
+		else:
+			return_values = self.measure_sweep()
+		if return_values is None:
+			return
 
-		data = {
-			'comp_data' : compensated_data,
-			'pts'       : frequencies,
-			'fft_data'  : fft_data,
-			'fft_pts'   : fft_pts,
-			'fft_max'   : fft_max,
+		context = {
+			'sweep' : return_values,
+			'plan'  : self.epoch_plan,
 		}
-
-
-		data['pts'] = list(data['pts'])
-		data['fft_pts'] = list(data['fft_pts'])
-
-
-		# dict_children = [('comp_data', 'pts'), ('fft_data', 'fft_pts')]
-		# for child_d, src_k in dict_children:
-		# 	for key in data[child_d]:
-		# 		data[child_d][key] = list(zip(data[src_k], list(data[child_d][key])))
-
-
-		self.response_queue.put(("sweep data", data))
+		values = self.graph.run(context)
+
+		slot = self.ring.begin()
+		logmag = values.get('logmag', {})
+		for path, val in logmag.items():
+			slot.comp[PATH_INDEX[path]] = val
+		ifft = values.get('ifft', {})
+		for path, val in ifft.items():
+			slot.fft[PATH_INDEX[path]] = val
+		for path, val in values.get('peak', {}).items():
+			slot.fft_max[PATH_INDEX[path]] = val
+		slot.comp_paths = tuple(path for path in S_PATHS if path in logmag)
+		slot.fft_paths  = tuple(path for path in S_PATHS if path in ifft)
+		self.ring.publish(slot, time.time())
 
 	def process(self):
-		if self.runstate and self.vna:
+		if self.runstate and (self.vna or self.replay is not None):
 			self.get_data()
 
 		if self.command_queue.empty():
@@ -492,6 +923,7 @@ class VnaThread():
 			return True
 
 	def shutdown(self):
+		self.stop_recording()
 		if self.vna:
 			print("Stopping current task (if any)")
 			try:
@@ -536,12 +968,14 @@ def create_thread(vna_no):
 	command_queue  = queue.Queue()
 	response_queue = queue.Queue()
 
-	vnat = VnaThread(vna_no, command_queue, response_queue)
+	ring           = SweepRing()
+
+	vnat = VnaThread(vna_no, command_queue, response_queue, ring)
 
 	proc = threading.Thread(target=vnat.run)
 	proc.daemon = True
 	proc.start()
-	return proc, command_queue, response_queue
+	return proc, command_queue, response_queue, ring
 
 def halt_threads():
 	runstate.run = False
@@ -32,9 +32,11 @@ def test_class():
 	# Start the VNA
 	vna.start()
 
-	# Load the factory calibration from the embedded memory into the VNA task
+	# Load the factory calibration from the embedded memory into the VNA task.
+	# load_factory_cal() keeps a local copy, so only the first connect to each
+	# unit has to wait for the PROM read.
 	try:
-		vna.importFactoryCalibration()
+		vna.load_factory_cal()
 		vna.measure_cal()
 		vna.log.info("Factory calibration loaded! Cal complete: %s", vna.isCalibrationComplete())
 	except VNA.VNA_Exception:
@@ -63,6 +65,12 @@ def test_class():
 		pprint.pprint(("T2R2: ", raw_return_values.T2R2))
 		pprint.pprint(("Ref:  ", raw_return_values.Ref))
 
+	# If you're doing something with each sweep that takes a while, stream()
+	# keeps the next measurement running in the background while you process
+	# the current one. Each sweep's data is only valid until the next one is requested.
+	for sweep in vna.stream(calibrated=vna.isCalibrationComplete(), count=10):
+		pprint.pprint(("Sweep %s: " % sweep.sequence, dict(zip(sweep.paths, abs(sweep.data).max(axis=1)))))
+
 
 if __name__ == "__main__":
 	test_class()